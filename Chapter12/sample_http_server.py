@@ -1,33 +1,178 @@
+import json
+from hashlib import sha256
+from http.cookies import SimpleCookie
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
 
 
 class TestHandler(BaseHTTPRequestHandler):
+    """Stands in for the ABQ REST API
 
-    def _print_request_data(self):
-        content_length = self.headers['Content-Length']
-        print("Content-length: {}".format(content_length))
-        data = self.rfile.read(int(content_length))
-        print(data.decode('utf-8'))
+    POST /auth logs in by setting a session cookie, and /upload
+    takes chunked uploads as described in
+    network.CorporateRestUploaderWithQueue in Chapter15.  A PUT to
+    /upload without a Content-Range is a whole file, as the earlier
+    chapters' uploaders send; it is printed and accepted.  Upload
+    requests without a current session cookie get a 401.
+
+    This is the reference for the upload protocol.  The Chapter15
+    tests run against a subclass of it, UploadHandler in
+    abq_data_entry/test/support.py, which adds simulated failures.
+    The uploads and logins are kept on the server, an UploadServer.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _report(self, message):
+        """Print what the server is doing"""
+        print(message)
+
+    def _request_received(self):
+        self._report('{} request received'.format(self.command))
+
+    def _endpoint(self):
+        """The last part of the request's path, e.g. 'auth'"""
+        return urlsplit(self.path).path.rstrip('/').rpartition('/')[2]
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
 
     def _send_200(self):
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-length', '0')
+        self.end_headers()
+
+    def _send_json(self, status, data, headers=()):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
         self.end_headers()
+        self.wfile.write(body)
+
+    def _logged_in(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        if 'session' in cookie and cookie['session'].value in (
+                self.server.sessions):
+            return True
+        self._send_json(401, {})
+        return False
+
+    def _get_upload(self):
+        return self.server.uploads.get(self._endpoint())
 
     def do_POST(self, *args, **kwargs):
-        print('POST request received')
-        self._print_request_data()
-        self._send_200()
+        self._request_received()
+        form = {
+            key: values[0] for key, values in
+            parse_qs(self._read_body().decode('utf-8')).items()}
+        if self._endpoint() == 'auth':
+            session = uuid4().hex
+            self.server.sessions.add(session)
+            self._report('Logged in {}'.format(form.get('username')))
+            self._send_json(200, self.server.login, [
+                ('Set-Cookie', 'session={}; Path=/'.format(session))])
+        elif not self._logged_in():
+            return
+        elif self._endpoint() == 'upload':
+            # start a chunked upload
+            token = uuid4().hex
+            # accept gzip-compressed chunks if the client offers them
+            offered = form.get('encodings', '').split(',')
+            encoding = 'identity'
+            if self.server.accept_gzip and 'gzip' in offered:
+                encoding = 'gzip'
+            self.server.uploads[token] = {
+                'filename': form['filename'],
+                'size': int(form['size']),
+                'encoding': encoding,
+                'data': bytearray()}
+            self._report('Started upload {} of {} ({})'.format(
+                token, form['filename'], encoding))
+            self._send_json(201, {'token': token, 'encoding': encoding})
+        else:
+            self._send_json(404, {})
+
+    def do_GET(self, *args, **kwargs):
+        self._request_received()
+        if not self._logged_in():
+            return
+        upload = self._get_upload()
+        if upload is None:
+            self._send_json(404, {})
+        else:
+            self._send_json(200, {
+                'offset': len(upload['data']),
+                'encoding': upload['encoding']})
 
     def do_PUT(self, *args, **kwargs):
-        print("PUT request received")
-        self._print_request_data()
-        self._send_200()
+        self._request_received()
+        data = self._read_body()
+        if not self._logged_in():
+            return
+        if 'Content-Range' not in self.headers:
+            # a whole file upload
+            self._report('Content-length: {}'.format(len(data)))
+            self._report(data.decode('utf-8', 'replace'))
+            self._send_200()
+            return
+        upload = self._get_upload()
+        if upload is None:
+            self._send_json(404, {})
+        else:
+            self._receive_chunk(upload, data)
+
+    def _receive_chunk(self, upload, chunk):
+        """Add chunk to upload if it follows on and its checksum matches"""
+        byte_range = self.headers['Content-Range'].split()[1]
+        start = int(byte_range.partition('-')[0])
+        data = upload['data']
+        if start != len(data):
+            self._send_json(409, {'offset': len(data)})
+        elif sha256(chunk).hexdigest() != self.headers['X-Chunk-SHA256']:
+            self._report('Checksum mismatch')
+            self._send_json(422, {})
+        else:
+            data.extend(chunk)
+            self._report(
+                'Received {}; {} bytes ({}) of a {} byte file'.format(
+                    byte_range, len(data), upload['encoding'],
+                    upload['size']))
+            self._send_json(200, {'offset': len(data)})
+
+
+class UploadServer(ThreadingMixIn, HTTPServer):
+    """Keeps the logins and uploads for a TestHandler
+
+    Each connection is handled on its own thread, so a client holding
+    a keep-alive connection open doesn't lock out the others.
 
+    login is the JSON body sent back by POST /auth, for instance
+    {'token': ..., 'expires_in': ...}.  Set accept_gzip to False to
+    refuse gzipped uploads.  Clear sessions to log every client out.
+    """
 
-def run(server_class=HTTPServer, handler_class=TestHandler):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class=TestHandler):
+        super().__init__(server_address, handler_class)
+        # token -> {'filename', 'size', 'encoding', 'data'}
+        self.uploads = {}
+        self.sessions = set()
+        self.login = {}
+        self.accept_gzip = True
+
+
+def run(server_class=UploadServer, handler_class=TestHandler):
     server_address = ('', 8000)
     httpd = server_class(server_address, handler_class)
     httpd.serve_forever()
 
-run()
+
+if __name__ == '__main__':
+    run()
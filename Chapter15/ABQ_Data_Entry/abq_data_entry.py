@@ -1,4 +1,3 @@
-from abq_data_entry.application import Application
+from abq_data_entry import main
 
-app = Application()
-app.mainloop()
+main()
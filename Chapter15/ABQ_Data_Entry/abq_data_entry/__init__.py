@@ -1,6 +1,26 @@
-from .application import Application
+import argparse
+
+
+def __getattr__(name):
+    # Application is imported on first use, so abq-import doesn't
+    # load the GUI and network code
+    if name == 'Application':
+        from .application import Application
+        return Application
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def main():
+    parser = argparse.ArgumentParser(description='ABQ Data Entry')
+    parser.add_argument(
+        '--profile-startup', action='store_true',
+        help='report the import time of each module loaded at startup')
+    args = parser.parse_args()
+    if args.profile_startup:
+        from .startup import print_import_profile
+        print_import_profile()
+        return
+    from .application import Application
     app = Application()
     app.mainloop()
@@ -1,4 +1,6 @@
+import os
 import platform
+import shutil
 from os import environ
 from tempfile import mkdtemp
 import tkinter as tk
@@ -6,17 +8,24 @@ from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
 from tkinter.font import nametofont
+from contextlib import closing
 from datetime import datetime
-from queue import Queue
+from itertools import chain
 from . import views as v
 from . import models as m
 from .mainmenu import get_main_menu_for_os
 from .images import ABQ_LOGO_32, ABQ_LOGO_64
 from . import network as n
+from . import workers as w
+from .uploads import UploadScheduler
 
 
 class Application(tk.Tk):
     """Application root window"""
+
+    # milliseconds to wait for typing to stop before an autofill lookup
+    autofill_delay = 250
+
     config_dirs = {
         'Linux': environ.get('$XDG_CONFIG_HOME', '~/.config'),
         'freebsd7': environ.get('$XDG_CONFIG_HOME', '~/.config'),
@@ -36,9 +45,6 @@ class Application(tk.Tk):
         self.logo = tk.PhotoImage(file=ABQ_LOGO_32)
         tk.Label(self, image=self.logo).grid(row=0)
 
-        self.inserted_rows = []
-        self.updated_rows = []
-
         datestring = datetime.today().strftime("%Y-%m-%d")
         default_filename = "abq_data_record_{}.csv".format(datestring)
         self.filename = tk.StringVar(value=default_filename)
@@ -46,6 +52,7 @@ class Application(tk.Tk):
         # settings model & settings
         config_dir = self.config_dirs.get(platform.system(), '~')
         self.settings_model = m.SettingsModel(path=config_dir)
+        self.upload_queue = m.UploadQueueModel(path=config_dir)
         self.load_settings()
         self.set_font()
         self.settings['font size'].trace('w', self.set_font)
@@ -62,10 +69,21 @@ class Application(tk.Tk):
             self.destroy()
             return
 
+        # runs calls from worker threads on the Tk thread
+        self.dispatcher = w.Dispatcher(self)
+        # runs data model calls off the Tk thread
+        self.model_tasks = w.AsyncModel(
+            self.dispatcher, self.data_model, on_busy=self.show_busy)
+
+        # pending debounced calls by name
+        self._debounced = {}
+
         self.callbacks = {
             'file->select': self.on_file_select,
             'file->quit': self.quit,
             'show_recordlist': self.show_recordlist,
+            'refresh_recordlist': self.populate_recordlist,
+            'load_record_pages': self.load_record_pages,
             'new_record': self.open_record,
             'on_open_record': self.open_record,
             'on_save': self.on_save,
@@ -74,6 +92,10 @@ class Application(tk.Tk):
             'update_weather_data': self.update_weather_data,
             'upload_to_corporate_rest': self.upload_to_corporate_rest,
             'upload_to_corporate_ftp': self.upload_to_corporate_ftp,
+            'upload_to_all': self.upload_to_all,
+            'show_upload_status': self.show_upload_status,
+            'retry_upload': self.retry_upload,
+            'remove_upload': self.remove_upload,
             'show_growth_chart': self.show_growth_chart,
             'show_yield_chart': self.show_yield_chart
         }
@@ -82,6 +104,17 @@ class Application(tk.Tk):
         menu = menu_class(self, self.settings, self.callbacks)
         self.config(menu=menu)
 
+        # The upload status panel, under the form and list
+        self.uploadstatus = v.UploadStatusView(self, self.callbacks)
+        self.uploadstatus.grid(row=1, padx=10, sticky='NSEW')
+        # sends extracts in the background
+        self.uploads = UploadScheduler(
+            self.dispatcher, self.upload_queue,
+            on_status=self.uploadstatus.update_job,
+            on_done=self.on_upload_done)
+        for job in self.uploads.jobs:
+            self.uploadstatus.update_job(job)
+
         # The data record form
         self.recordform = v.DataRecordForm(
             self, self.data_model.fields, self.settings, self.callbacks)
@@ -90,51 +123,91 @@ class Application(tk.Tk):
         self.recordlist = v.RecordList(
             self,
             self.callbacks,
-            inserted=self.inserted_rows,
-            updated=self.updated_rows
+            changes=self.data_model.changes
         )
         self.recordlist.grid(row=1, padx=10, sticky='NSEW')
-        self.populate_recordlist()
 
         # status bar
         self.status = tk.StringVar()
         self.statusbar = ttk.Label(self, textvariable=self.status)
         self.statusbar.grid(sticky="we", row=3, padx=10)
+        self.busy_indicator = ttk.Progressbar(
+            self, mode='indeterminate', length=80)
 
         self.records_saved = 0
+        self.populate_recordlist()
+
+    def show_busy(self, busy):
+        """Show or hide the status bar's busy indicator"""
+        if busy:
+            self.busy_indicator.grid(sticky="e", row=3, padx=10)
+            self.busy_indicator.start()
+            self.config(cursor='watch')
+        else:
+            self.busy_indicator.stop()
+            self.busy_indicator.grid_remove()
+            self.config(cursor='')
+
+    def destroy(self):
+        if hasattr(self, 'model_tasks'):
+            self.model_tasks.shutdown()
+        if hasattr(self, 'uploads'):
+            self.uploads.shutdown()
+        if hasattr(self, 'data_model'):
+            self.data_model.close()
+        n.shared_sessions.close()
+        if hasattr(self, 'dispatcher'):
+            self.dispatcher.close()
+        super().destroy()
+
+    def show_read_error(self, error):
+        messagebox.showerror(
+            title='Error',
+            message='Problem reading file',
+            detail=str(error)
+        )
 
     def show_recordlist(self):
         """Show the recordform"""
         self.recordlist.tkraise()
 
     def populate_recordlist(self):
-        try:
-            rows = self.data_model.get_all_records()
-        except Exception as e:
-            messagebox.showerror(
-                title='Error',
-                message='Problem reading file',
-                detail=str(e)
-            )
-        else:
-            self.recordlist.populate(rows)
+        model = self.data_model
+
+        def load_rows():
+            rows = m.PagedRecords(
+                model.get_record_count(), model.get_records)
+            if rows:
+                # fetch the first page here rather than on the Tk thread
+                rows[0]
+            return rows
+
+        self.model_tasks.run(
+            load_rows, callback=self.recordlist.populate,
+            errback=self.show_read_error, channel='recordlist')
+
+    def load_record_pages(self, rows, numbers):
+        """Fetch pages of the record list on a worker thread"""
+        generation = rows.generation
+        self.model_tasks.run(
+            rows.fetch_pages, numbers,
+            callback=lambda pages: self.recordlist.add_pages(
+                rows, generation, pages),
+            errback=self.show_read_error, channel='recordlist_pages')
 
     def open_record(self, rowkey=None):
         """Rowkey must be a tuple of (Date, Time, Lab, Plot)"""
+        def load(record):
+            self.recordform.load_record(rowkey, record)
+            self.recordform.tkraise()
+
         if rowkey is None:
-            record = None
+            self.model_tasks.cancel('open_record')
+            load(None)
         else:
-            try:
-                record = self.data_model.get_record(*rowkey)
-            except Exception as e:
-                messagebox.showerror(
-                    title='Error',
-                    message='Problem reading file',
-                    detail=str(e)
-                )
-                return
-        self.recordform.load_record(rowkey, record)
-        self.recordform.tkraise()
+            self.model_tasks.call(
+                'get_record', *rowkey, callback=load,
+                errback=self.show_read_error, channel='open_record')
 
     def on_save(self):
         """Handles save button clicks"""
@@ -155,9 +228,8 @@ class Application(tk.Tk):
             return False
 
         data = self.recordform.get()
-        try:
-            self.data_model.save_record(data)
-        except Exception as e:
+
+        def on_error(e):
             messagebox.showerror(
                 title='Error',
                 message='Problem saving record',
@@ -165,22 +237,23 @@ class Application(tk.Tk):
             )
             self.status.set('Problem saving record')
 
-        else:
+        def on_saved(result):
+            row, last_write, index = result
             self.records_saved += 1
             self.status.set(
                 "{} records saved this session".format(self.records_saved)
             )
-            key = (data['Date'], data['Time'], data['Lab'], data['Plot'])
-            if self.data_model.last_write == 'update':
-                self.updated_rows.append(key)
-            else:
-                # we just inserted a row
-                self.inserted_rows.append(key)
-            self.populate_recordlist()
+            # only the saved row needs updating in the list
+            if index is not None:
+                self.recordlist.upsert_row(
+                    index, row, update=last_write == 'update')
             # Only reset the form when we're appending records
-            if self.data_model.last_write == 'insert':
+            if last_write == 'insert':
                 self.recordform.reset()
 
+        self.status.set('Saving record...')
+        self.model_tasks.call(
+            'save_record', data, callback=on_saved, errback=on_error)
 
     def on_file_select(self):
         """Handle the file->select action from the menu"""
@@ -193,9 +266,9 @@ class Application(tk.Tk):
         if filename:
             self.filename.set(filename)
             self.data_model = m.CSVModel(filename=self.filename.get())
+            self.model_tasks.model = self.data_model
+            self.recordlist.changes = self.data_model.changes
             self.populate_recordlist()
-            self.inserted_rows = []
-            self.updated_rows = []
 
 
     def save_settings(self, *args):
@@ -252,7 +325,24 @@ class Application(tk.Tk):
                 else:
                     break
 
+    def debounce(self, name, function):
+        """Call function after autofill_delay, unless called again first"""
+        if name in self._debounced:
+            self.after_cancel(self._debounced[name])
+
+        def run():
+            del self._debounced[name]
+            function()
+
+        self._debounced[name] = self.after(self.autofill_delay, run)
+
     def get_current_seed_sample(self, *args):
+        self.debounce('seed_sample', self.lookup_seed_sample)
+
+    def get_tech_for_lab_check(self, *args):
+        self.debounce('lab_check', self.lookup_lab_check)
+
+    def lookup_seed_sample(self):
         if not (
             hasattr(self, 'recordform')
             and self.settings['autofill sheet data'].get()
@@ -263,11 +353,15 @@ class Application(tk.Tk):
         lab = data['Lab']
 
         if plot and lab:
-            seed = self.data_model.get_current_seed_sample(lab, plot)
-            self.recordform.inputs['Seed sample'].set(seed)
-            self.recordform.focus_next_empty()
+            self.model_tasks.call(
+                'get_current_seed_sample', lab, plot,
+                callback=self.fill_seed_sample, channel='seed_sample')
 
-    def get_tech_for_lab_check(self, *args):
+    def fill_seed_sample(self, seed):
+        self.recordform.inputs['Seed sample'].set(seed)
+        self.recordform.focus_next_empty()
+
+    def lookup_lab_check(self):
         if not (
             hasattr(self, 'recordform')
             and self.settings['autofill sheet data'].get()
@@ -278,11 +372,20 @@ class Application(tk.Tk):
         time = data['Time']
         lab = data['Lab']
 
+        try:
+            # skip partly typed dates
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            return
         if all([date, time, lab]):
-            check = self.data_model.get_lab_check(date, time, lab)
-            tech = check['lab_tech'] if check else ''
-            self.recordform.inputs['Technician'].set(tech)
-            self.recordform.focus_next_empty()
+            self.model_tasks.call(
+                'get_lab_check', date, time, lab,
+                callback=self.fill_lab_check, channel='lab_check')
+
+    def fill_lab_check(self, check):
+        tech = check['lab_tech'] if check else ''
+        self.recordform.inputs['Technician'].set(tech)
+        self.recordform.focus_next_empty()
 
     def update_weather_data(self):
 
@@ -304,104 +407,176 @@ class Application(tk.Tk):
                 .format(weather_data['observation_time_rfc822'])
             )
 
-    def _create_csv_extract(self):
-        tmpfilepath = mkdtemp()
-        csvmodel = m.CSVModel(
-            filename=self.filename.get(), filepath=tmpfilepath)
-        records = self.data_model.get_all_records()
-        if not records:
-            return None
-        for record in records:
-            csvmodel.save_record(record)
-
-        return csvmodel.filename
-
-
-    def upload_to_corporate_rest(self):
-
-        csvfile = self._create_csv_extract()
+    @staticmethod
+    def _create_csv_extract(model, filename, spool_dir, destinations):
+        """Write the records any of destinations hasn't received
+
+        The extract starts from the oldest of the destinations'
+        watermarks; records a destination already has are merged by
+        key on the corporate side.  This runs on a worker thread, so
+        it takes the model and file name rather than reading them
+        from the application.  The extract is named by
+        _extract_name() and written to its own directory under
+        spool_dir, never over the file the model is reading.
+
+        Returns (csvfile, manifest, until), or None if there are no
+        records to send.  Once an upload succeeds, until is passed to
+        set_upload_watermark() so the next extract starts from there.
+        """
+        since, until = model.get_upload_window(destinations)
+        with closing(model.iter_changes(since, until)) as records:
+            first = next(records, None)
+            if first is None:
+                return None
+            os.makedirs(spool_dir, exist_ok=True)
+            csvmodel = m.CSVModel(
+                filename=Application._extract_name(filename, since, until),
+                filepath=mkdtemp(dir=spool_dir))
+            source = getattr(model, 'filename', None)
+            if source is not None and os.path.realpath(
+                    csvmodel.filename) == os.path.realpath(source):
+                raise ValueError(
+                    'Cannot write an extract over {}'.format(source))
+            count = csvmodel.save_records(chain([first], records))
+        until = until and until.isoformat()
+        manifest = csvmodel.write_manifest(
+            destinations=destinations, records=count, full=since is None,
+            since=since and since.isoformat(), until=until)
+
+        return csvmodel.filename, manifest, until
+
+    @staticmethod
+    def _extract_name(filename, since, until):
+        """Name an extract of filename after the window it covers
+
+        Extracts made on the same day would otherwise share a name,
+        and each would replace the last at the destinations, losing
+        its records.  An extract without a window, as from a CSV
+        file, holds every record, so it keeps filename's name.
+        """
+        name = os.path.basename(filename)
+        if until is None:
+            return name
+        stem, ext = os.path.splitext(name)
+        stamp = '%Y%m%dT%H%M%S%f'
+        return '{}_{}-{}{}'.format(
+            stem, since.strftime(stamp) if since else 'full',
+            until.strftime(stamp), ext)
+
+    def set_upload_watermark(self, destination, until):
+        """Record a successful upload on a worker thread"""
+        self.model_tasks.run(
+            self.data_model.set_upload_watermark, destination, until,
+            errback=self.show_read_error)
+
+    def get_upload_destinations(self):
+        """Return the upload destinations from the settings, by kind"""
+        upload_url = self.settings['abq_upload_url'].get()
+        ftp_host = self.settings['abq_ftp_host'].get()
+        return {
+            'rest': {
+                'name': 'rest ' + upload_url, 'kind': 'rest',
+                'upload_url': upload_url,
+                'auth_url': self.settings['abq_auth_url'].get()},
+            'ftp': {
+                'name': 'ftp ' + ftp_host, 'kind': 'ftp',
+                'host': ftp_host,
+                'port': self.settings['abq_ftp_port'].get()}
+        }
 
-        if csvfile is None:
+    def login_for_upload(self, destination):
+        """Get credentials for destination if the uploads need them
+
+        Returns False if the login was cancelled.
+        """
+        if not self.uploads.needs_login(destination['name']):
+            return True
+        titles = {'rest': 'Login to ABQ Corporate REST API',
+                  'ftp': 'Login to ABQ Corporate FTP'}
+        d = v.LoginDialog(self, titles[destination['kind']])
+        if d.result is None:
+            return False
+        self.uploads.login(destination['name'], *d.result)
+        return True
+
+    def upload(self, *kinds):
+        """Extract the new records and queue them for each kind"""
+        destinations = [self.get_upload_destinations()[kind] for kind in kinds]
+        self.status.set('Preparing upload')
+        self.model_tasks.run(
+            self._create_csv_extract, self.data_model, self.filename.get(),
+            self.upload_queue.spool_dir,
+            [destination['name'] for destination in destinations],
+            callback=lambda extract: self.queue_upload(extract, destinations),
+            errback=self.show_read_error, channel='extract')
+
+    def queue_upload(self, extract, destinations):
+        if extract is None:
+            self.status.set('')
             messagebox.showwarning(
                 title='No records',
-                message='There are no records to upload'
+                message='There are no new records to upload'
             )
             return
-
-        d = v.LoginDialog(
-            self,
-            'Login to ABQ Corporate REST API'
-        )
-        if d.result is not None:
-            username, password = d.result
-        else:
+        destinations = [
+            destination for destination in destinations
+            if self.login_for_upload(destination)]
+        csvfile, manifest, until = extract
+        if not destinations:
+            shutil.rmtree(os.path.dirname(csvfile), ignore_errors=True)
+            self.status.set('')
             return
-        self.rest_queue = Queue()
-        self.uploader = n.CorporateRestUploaderWithQueue(
-            csvfile, self.settings['abq_upload_url'].get(),
-            self.settings['abq_auth_url'].get(),
-            username, password,
-            self.rest_queue
-        )
-        self.uploader.start()
-        self.check_queue(self.rest_queue)
+        self.uploads.add(csvfile, manifest, destinations, until)
+        self.status.set('Uploading {}'.format(os.path.basename(csvfile)))
+        self.show_upload_status()
 
+    def upload_to_corporate_rest(self):
+        self.upload('rest')
 
     def upload_to_corporate_ftp(self):
+        self.upload('ftp')
 
-        csvfile = self._create_csv_extract()
+    def upload_to_all(self):
+        self.upload('rest', 'ftp')
 
-        d = v.LoginDialog(
-            self,
-            'Login to ABQ Corporate FTP'
-        )
+    def show_upload_status(self):
+        self.uploadstatus.tkraise()
 
-        if d.result is not None:
-            username, password = d.result
-            try:
-                n.upload_to_corporate_ftp(
-                    csvfile,
-                    self.settings['abq_ftp_host'].get(),
-                    self.settings['abq_ftp_port'].get(),
-                    username,
-                    password
-                )
-            except n.ftp.all_errors as e:
-                messagebox.showerror('Error connecting to ftp', str(e))
-            else:
-                messagebox.showinfo(
-                    'Success',
-                    '{} successfully uploaded to FTP'.format(csvfile)
-                )
-
-    def check_queue(self, queue):
-        if not queue.empty():
-            item = queue.get()
-            if item.status == 'done':
-                messagebox.showinfo(
-                    item.status,
-                    message=item.subject,
-                    detail=item.body
-                )
-                self.status.set(item.subject)
-                return
-            elif item.status == 'error':
-                messagebox.showerror(
-                    item.status,
-                    message=item.subject,
-                    detail=item.body
-                )
-                self.status.set(item.subject)
-                return
-            else:
-                self.status.set(item.body)
-        self.after(100, self.check_queue, queue)
+    def retry_upload(self, job_id):
+        if self.login_for_upload(self.uploads.get_job(job_id)['destination']):
+            self.uploads.retry(job_id)
+
+    def remove_upload(self, job_id):
+        if self.uploads.remove(job_id):
+            self.uploadstatus.remove_job(job_id)
+        else:
+            messagebox.showwarning(
+                title='Upload in progress',
+                message='An upload can not be removed while it is sent'
+            )
+
+    def on_upload_done(self, job):
+        self.set_upload_watermark(job['destination']['name'], job['until'])
+        self.status.set('{} uploaded to {}'.format(
+            os.path.basename(job['filepath']), job['destination']['name']))
 
     def show_growth_chart(self):
+        model = self.data_model
+
+        def load():
+            from . import charts
+            return charts.growth_series(model.get_growth_by_lab())
+
+        self.model_tasks.run(
+            load, callback=self.draw_growth_chart,
+            errback=self.show_read_error, channel='growth_chart')
 
-        data = self.data_model.get_growth_by_lab()
-        max_x = max([x['day'] for x in data])
-        max_y = max([x['avg_height'] for x in data])
+    def draw_growth_chart(self, data):
+        max_x, max_y, series = data
+        if not series:
+            messagebox.showinfo(
+                title='No data', message='There are no records to chart')
+            return
         popup = tk.Toplevel()
         chart = v.LineChartView(popup, 600, 300, 'day',
                                 'centimeters', max_x, max_y)
@@ -412,29 +587,34 @@ class Application(tk.Tk):
         chart.draw_legend(legend)
 
         for lab, color in legend.items():
-            dataxy = [
-                (x['day'], x['avg_height'])
-                for x in data
-                if x['lab_id'] == lab]
-            chart.plot_line(dataxy, color)
+            if lab in series:
+                days, heights = series[lab]
+                chart.plot_line(days, heights, color)
 
     def show_yield_chart(self):
+        model = self.data_model
+
+        def load():
+            from . import charts
+            return charts.yield_series(model.get_yield_by_plot())
+
+        self.model_tasks.run(
+            load, callback=self.draw_yield_chart,
+            errback=self.show_read_error, channel='yield_chart')
 
+    def draw_yield_chart(self, series):
         popup = tk.Toplevel()
         chart = v.YieldChartView(popup,
             'Average plot humidity', 'Average Plot temperature',
             'Yield as a product of humidity and temperature')
         chart.pack(fill='both', expand=True)
 
-        data = self.data_model.get_yield_by_plot()
         seed_colors = {'AXM477': 'red', 'AXM478': 'yellow',
             'AXM479': 'green', 'AXM480': 'blue'}
 
         for seed, color in seed_colors.items():
-            seed_data = [
-                (x['avg_humidity'], x['avg_temperature'], x['yield'])
-                for x in data if x['seed_sample'] == seed]
-            chart.draw_scatter(seed_data, color, seed)
+            if seed in series:
+                chart.draw_scatter(*series[seed], color, seed)
 
 
 def main():
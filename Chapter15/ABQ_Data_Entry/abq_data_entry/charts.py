@@ -0,0 +1,103 @@
+"""Chart data preparation
+
+Query results are loaded into NumPy arrays once and split into one
+series per group with a single sort.  numpy is slow to import, so the
+application only loads this module when a chart is first drawn.
+"""
+import numpy as np
+
+
+def to_columns(records, key, columns):
+    """Load records into a key array and a float array per column
+
+    Missing (None) values become NaN.
+    """
+    rows = [(record[key], *(record[c] for c in columns)) for record in records]
+    if not rows:
+        return np.array([], dtype=str), [np.array([])] * len(columns)
+    keys, *values = zip(*rows)
+    return np.array(keys), [np.array(v, dtype=float) for v in values]
+
+
+def group_by(keys, columns):
+    """Split each column by the matching key
+
+    Returns a dict mapping each key to a tuple of arrays, in the
+    original row order.
+    """
+    if not len(keys):
+        return {}
+    order = np.argsort(keys, kind='stable')
+    unique, starts = np.unique(keys[order], return_index=True)
+    split = [np.split(column[order], starts[1:]) for column in columns]
+    return {
+        str(key): tuple(column[i] for column in split)
+        for i, key in enumerate(unique)}
+
+
+def growth_series(records):
+    """Prepare get_growth_by_lab() results for LineChartView
+
+    Returns (max_day, max_height, series), where series maps each
+    lab to arrays of days and average heights.
+    """
+    labs, (days, heights) = to_columns(
+        records, 'lab_id', ('day', 'avg_height'))
+    if not len(days):
+        return 0, 0, {}
+    return np.nanmax(days), np.nanmax(heights), group_by(labs, (days, heights))
+
+
+def yield_series(records):
+    """Prepare get_yield_by_plot() results for YieldChartView
+
+    Returns a dict mapping each seed sample to arrays of humidity,
+    temperature and yield.
+    """
+    seeds, columns = to_columns(
+        records, 'seed_sample',
+        ('avg_humidity', 'avg_temperature', 'yield'))
+    return group_by(seeds, columns)
+
+
+def lttb(x, y, threshold):
+    """Downsample a series to threshold points
+
+    This uses Largest-Triangle-Three-Buckets.  The first and last
+    points are kept.  The points between them are split into
+    threshold - 2 buckets, and from each bucket the point forming the
+    largest triangle with the previously kept point and the average
+    of the next bucket is kept.  x must be sorted.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(x)
+    if threshold < 3 or threshold >= size:
+        return x, y
+
+    # bucket boundaries over the points between the first and last
+    edges = (
+        np.arange(threshold - 1) * (size - 2) // (threshold - 2) + 1)
+    counts = np.diff(edges)
+    # every bucket's average point, from running sums
+    x_sums = np.concatenate(([0], np.cumsum(x)))
+    y_sums = np.concatenate(([0], np.cumsum(y)))
+    avg_x = (x_sums[edges[1:]] - x_sums[edges[:-1]]) / counts
+    avg_y = (y_sums[edges[1:]] - y_sums[edges[:-1]]) / counts
+    # each bucket is compared with the next one's average,
+    # and the last bucket with the last point
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    kept = np.empty(threshold, dtype=int)
+    kept[0], kept[-1] = 0, size - 1
+    a = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # twice the triangle areas; the factor doesn't change the max
+        areas = np.abs(
+            (x[a] - next_x[bucket]) * (y[start:end] - y[a]) -
+            (x[a] - x[start:end]) * (next_y[bucket] - y[a]))
+        a = start + np.argmax(areas)
+        kept[bucket + 1] = a
+    return x[kept], y[kept]
@@ -0,0 +1,58 @@
+import zlib
+
+
+class GzipReader:
+    """Read a binary file as a gzip stream, compressing as it is read
+
+    Only as much of the file is compressed as each read() needs, so
+    nothing is written to disk.  The output is the same every time,
+    so seek() can move forward by compressing and discarding, or back
+    by starting again from the beginning.
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(self, fileobj, level=6):
+        self.fileobj = fileobj
+        self.level = level
+        self._start = fileobj.tell()
+        self._restart()
+
+    def _restart(self):
+        self.fileobj.seek(self._start)
+        # wbits of 31 gives a gzip header and trailer
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        self._buffer = bytearray()
+        self._position = 0
+        self._flushed = False
+
+    @property
+    def eof(self):
+        """True once every compressed byte has been read"""
+        return self._flushed and not self._buffer
+
+    def read(self, size=-1):
+        while not self._flushed and (size < 0 or len(self._buffer) < size):
+            data = self.fileobj.read(self.block_size)
+            if data:
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._flushed = True
+        if size < 0:
+            size = len(self._buffer)
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._position += len(chunk)
+        return chunk
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset):
+        if offset < self._position:
+            self._restart()
+        while self._position < offset:
+            if not self.read(min(offset - self._position, self.block_size)):
+                break
+        return self._position
@@ -0,0 +1,214 @@
+import argparse
+import csv
+import io
+import time
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from getpass import getpass
+from itertools import islice
+from .constants import FieldTypes as FT
+from . import models as m
+
+ImportReport = namedtuple(
+    'ImportReport', ['rows', 'rejected', 'seconds', 'rows_per_second'])
+
+
+def validate_record(fields, record):
+    """Check a record against a model's field definitions
+
+    Returns a dict of field names and error messages.
+    """
+    errors = {}
+    for key, spec in fields.items():
+        value = record.get(key)
+        if value in (None, ''):
+            if spec.get('req'):
+                errors[key] = 'A value is required'
+            continue
+        if spec['type'] == FT.string_list and spec.get('values'):
+            if value not in spec['values']:
+                errors[key] = 'Invalid value: {}'.format(value)
+        elif spec['type'] == FT.iso_date_string:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                errors[key] = 'Invalid date: {}'.format(value)
+        elif spec['type'] in (FT.decimal, FT.integer):
+            try:
+                number = Decimal(value)
+            except InvalidOperation:
+                errors[key] = 'Invalid number: {}'.format(value)
+                continue
+            if 'min' in spec and number < Decimal(str(spec['min'])):
+                errors[key] = 'Value is too low (min {})'.format(spec['min'])
+            elif 'max' in spec and number > Decimal(str(spec['max'])):
+                errors[key] = 'Value is too high (max {})'.format(spec['max'])
+
+    # plot_checks requires the median height to lie between the others
+    heights = ('Min Height', 'Median Height', 'Max Height')
+    if all(key in fields for key in heights) and not (
+            set(heights) & set(errors)):
+        values = [record.get(key) for key in heights]
+        if '' not in values and None not in values:
+            low, median, high = map(Decimal, values)
+            if not low <= median <= high:
+                errors['Median Height'] = (
+                    'Must be between Min Height and Max Height')
+    return errors
+
+
+class CSVImporter:
+    """Bulk load an ABQ CSV file into the SQL database
+
+    Rows are validated against CSVModel's fields, copied into
+    temporary staging tables with COPY, then merged into
+    lab_checks and plot_checks in a single transaction.  Where the
+    file has a check more than once, its last row wins.
+    """
+
+    # number of rows sent per COPY
+    chunk_size = 10000
+
+    lc_columns = ('date', 'time', 'lab_id', 'lab_tech_id')
+    pc_columns = (
+        'date', 'time', 'lab_id', 'plot', 'seed_sample', 'humidity',
+        'light', 'temperature', 'equipment_fault', 'blossoms', 'plants',
+        'fruit', 'max_height', 'min_height', 'median_height', 'notes')
+    pc_fields = (
+        'Date', 'Time', 'Lab', 'Plot', 'Seed sample', 'Humidity',
+        'Light', 'Temperature', 'Equipment Fault', 'Blossoms', 'Plants',
+        'Fruit', 'Max Height', 'Min Height', 'Median Height', 'Notes')
+
+    # staged rows carry their row number in the file
+    stage_query = (
+        'CREATE TEMP TABLE lab_checks_stage '
+        '(LIKE lab_checks INCLUDING DEFAULTS, rownum INTEGER) '
+        'ON COMMIT DROP; '
+        'CREATE TEMP TABLE plot_checks_stage '
+        '(LIKE plot_checks INCLUDING DEFAULTS, rownum INTEGER) '
+        'ON COMMIT DROP')
+
+    copy_query = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'
+
+    lc_merge_query = (
+        'INSERT INTO lab_checks ({columns}) '
+        'SELECT DISTINCT ON (date, time, lab_id) {columns} '
+        'FROM lab_checks_stage '
+        'ORDER BY date, time, lab_id, rownum DESC '
+        'ON CONFLICT (date, time, lab_id) DO UPDATE '
+        'SET lab_tech_id = EXCLUDED.lab_tech_id, updated_at = now() '
+        'WHERE lab_checks.lab_tech_id <> EXCLUDED.lab_tech_id')
+
+    pc_merge_query = (
+        'INSERT INTO plot_checks ({columns}) '
+        'SELECT DISTINCT ON (date, time, lab_id, plot) {columns} '
+        'FROM plot_checks_stage '
+        'ORDER BY date, time, lab_id, plot, rownum DESC '
+        'ON CONFLICT (date, time, lab_id, plot) DO UPDATE '
+        'SET {updates}, updated_at = now()')
+
+    def __init__(self, sql_model, filename):
+        self.sql_model = sql_model
+        self.csv_model = m.CSVModel(filename)
+        # (rownum, errors) for each rejected row
+        self.rejected = []
+        self._tech_ids = None
+
+    @property
+    def tech_ids(self):
+        """A cached map of technician names to lab_techs ids"""
+        if self._tech_ids is None:
+            techs = self.sql_model.query('SELECT id, name FROM lab_techs')
+            self._tech_ids = {tech['name']: tech['id'] for tech in techs}
+        return self._tech_ids
+
+    def _write_chunk(self, cursor, records, first_rownum):
+        """COPY a chunk of records into the staging tables"""
+        lc_buffer = io.StringIO()
+        pc_buffer = io.StringIO()
+        lc_writer = csv.writer(lc_buffer)
+        pc_writer = csv.writer(pc_buffer)
+        for rownum, record in enumerate(records, first_rownum):
+            errors = validate_record(self.csv_model.fields, record)
+            tech_id = self.tech_ids.get(record['Technician'])
+            if tech_id is None and 'Technician' not in errors:
+                errors['Technician'] = 'Unknown technician: {}'.format(
+                    record['Technician'])
+            if errors:
+                self.rejected.append((rownum, errors))
+                continue
+            lc_writer.writerow(
+                (record['Date'], record['Time'], record['Lab'], tech_id,
+                 rownum))
+            pc_writer.writerow(
+                [record[key] for key in self.pc_fields] + [rownum])
+
+        for table, columns, buffer in (
+            ('lab_checks_stage', self.lc_columns, lc_buffer),
+            ('plot_checks_stage', self.pc_columns, pc_buffer)
+        ):
+            buffer.seek(0)
+            cursor.copy_expert(
+                self.copy_query.format(
+                    table, ', '.join(columns + ('rownum',))),
+                buffer)
+
+    def run(self, progress=None):
+        """Import the file, calling progress(rows) after each chunk
+
+        Returns an ImportReport.
+        """
+        self.rejected = []
+        start = time.perf_counter()
+        rows = 0
+        with closing(self.csv_model.iter_records()) as records, \
+                self.sql_model.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.stage_query)
+            chunk = list(islice(records, self.chunk_size))
+            while chunk:
+                self._write_chunk(cursor, chunk, rows)
+                rows += len(chunk)
+                if progress:
+                    progress(rows)
+                chunk = list(islice(records, self.chunk_size))
+
+            updates = ', '.join(
+                '{0} = EXCLUDED.{0}'.format(column)
+                for column in self.pc_columns[4:])
+            cursor.execute(self.lc_merge_query.format(
+                columns=', '.join(self.lc_columns)))
+            cursor.execute(self.pc_merge_query.format(
+                columns=', '.join(self.pc_columns), updates=updates))
+        seconds = time.perf_counter() - start
+        return ImportReport(
+            rows, len(self.rejected), seconds,
+            rows / seconds if seconds else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Import an ABQ CSV data file into the ABQ database')
+    parser.add_argument('filename', help='CSV file to import')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--database', default='abq')
+    parser.add_argument('--user', required=True)
+    args = parser.parse_args()
+
+    sql_model = m.SQLModel(
+        args.host, args.database, args.user, getpass())
+    importer = CSVImporter(sql_model, args.filename)
+
+    def progress(rows):
+        print('{} rows read'.format(rows), end='\r', flush=True)
+
+    report = importer.run(progress)
+    for rownum, errors in importer.rejected:
+        print('Row {} rejected: {}'.format(rownum, '; '.join(
+            '{}: {}'.format(key, error) for key, error in errors.items())))
+    print('Imported {} of {} rows in {:.1f}s ({:.0f} rows/sec)'.format(
+        report.rows - report.rejected, report.rows,
+        report.seconds, report.rows_per_second))
+    sql_model.close()
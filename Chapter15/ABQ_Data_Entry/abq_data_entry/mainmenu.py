@@ -53,6 +53,14 @@ class GenericMainMenu(tk.Menu):
             label="Upload CSV to corporate FTP",
             command=self.callbacks['upload_to_corporate_ftp']
         )
+        tools_menu.add_command(
+            label="Upload CSV to all destinations",
+            command=self.callbacks['upload_to_all']
+        )
+        tools_menu.add_command(
+            label="Show Upload Status",
+            command=self.callbacks['show_upload_status']
+        )
         tools_menu.add_separator()
         tools_menu.add_command(
             label="Show Growth Chart",
@@ -103,6 +111,11 @@ class GenericMainMenu(tk.Menu):
             command=self.callbacks['show_recordlist'],
             accelerator='Ctrl+L'
         )
+        go_menu.add_command(
+            label="Refresh Record List",
+            command=self.callbacks['refresh_recordlist'],
+            accelerator='F5'
+        )
         go_menu.add_command(
             label="New Record",
             command=self.callbacks['new_record'],
@@ -120,7 +133,8 @@ class GenericMainMenu(tk.Menu):
             '<Control-o>': self.callbacks['file->select'],
             '<Control-q>': self.callbacks['file->quit'],
             '<Control-n>': self.callbacks['new_record'],
-            '<Control-l>': self.callbacks['show_recordlist']
+            '<Control-l>': self.callbacks['show_recordlist'],
+            '<F5>': self.callbacks['refresh_recordlist']
         }
 
     @staticmethod
@@ -190,6 +204,11 @@ class WindowsMainMenu(GenericMainMenu):
             command=self.callbacks['show_recordlist'],
             accelerator='Ctrl+L'
         )
+        self.add_command(
+            label="Refresh",
+            command=self.callbacks['refresh_recordlist'],
+            accelerator='F5'
+        )
         self.add_command(
             label="New Record",
             command=self.callbacks['new_record'],
@@ -212,6 +231,14 @@ class WindowsMainMenu(GenericMainMenu):
             label="Upload CSV to corporate FTP",
             command=self.callbacks['upload_to_corporate_ftp']
         )
+        tools_menu.add_command(
+            label="Upload CSV to all destinations",
+            command=self.callbacks['upload_to_all']
+        )
+        tools_menu.add_command(
+            label="Show Upload Status",
+            command=self.callbacks['show_upload_status']
+        )
         tools_menu.add_separator()
         tools_menu.add_command(
             label="Show Growth Chart",
@@ -264,7 +291,8 @@ class WindowsMainMenu(GenericMainMenu):
         return {
             '<Control-o>': self.callbacks['file->select'],
             '<Control-n>': self.callbacks['new_record'],
-            '<Control-l>': self.callbacks['show_recordlist']
+            '<Control-l>': self.callbacks['show_recordlist'],
+            '<F5>': self.callbacks['refresh_recordlist']
         }
 
 
@@ -331,6 +359,11 @@ class LinuxMainMenu(GenericMainMenu):
             command=self.callbacks['show_recordlist'],
             accelerator='Ctrl+L'
         )
+        go_menu.add_command(
+            label="Refresh Record List",
+            command=self.callbacks['refresh_recordlist'],
+            accelerator='F5'
+        )
         go_menu.add_command(
             label="New Record",
             command=self.callbacks['new_record'],
@@ -352,6 +385,14 @@ class LinuxMainMenu(GenericMainMenu):
             label="Upload CSV to corporate FTP",
             command=self.callbacks['upload_to_corporate_ftp']
         )
+        tools_menu.add_command(
+            label="Upload CSV to all destinations",
+            command=self.callbacks['upload_to_all']
+        )
+        tools_menu.add_command(
+            label="Show Upload Status",
+            command=self.callbacks['show_upload_status']
+        )
         tools_menu.add_separator()
         tools_menu.add_command(
             label="Show Growth Chart",
@@ -445,6 +486,14 @@ class MacOsMainMenu(GenericMainMenu):
             label="Upload CSV to corporate FTP",
             command=self.callbacks['upload_to_corporate_ftp']
         )
+        tools_menu.add_command(
+            label="Upload CSV to all destinations",
+            command=self.callbacks['upload_to_all']
+        )
+        tools_menu.add_command(
+            label="Show Upload Status",
+            command=self.callbacks['show_upload_status']
+        )
         tools_menu.add_separator()
         tools_menu.add_command(
             label="Show Growth Chart",
@@ -464,6 +513,11 @@ class MacOsMainMenu(GenericMainMenu):
             command=self.callbacks['show_recordlist'],
             accelerator="Cmd-L"
         )
+        window_menu.add_command(
+            label="Refresh Record List",
+            command=self.callbacks['refresh_recordlist'],
+            accelerator="F5"
+        )
         window_menu.add_command(
             label="New Record",
             command=self.callbacks['new_record'],
@@ -475,7 +529,8 @@ class MacOsMainMenu(GenericMainMenu):
         return {
             '<Command-o>': self.callbacks['file->select'],
             '<Command-n>': self.callbacks['new_record'],
-            '<Command-l>': self.callbacks['show_recordlist']
+            '<Command-l>': self.callbacks['show_recordlist'],
+            '<F5>': self.callbacks['refresh_recordlist']
         }
 
 
@@ -1,9 +1,140 @@
 import csv
+import io
 import os
 import json
+import shutil
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from datetime import date, timedelta
+from hashlib import sha256
+from contextlib import closing, contextmanager
+from itertools import islice
+from tempfile import mkstemp
+from threading import BoundedSemaphore, Lock, RLock, Thread
 from .constants import FieldTypes as FT
+from .compression import GzipReader
 import psycopg2 as pg
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class ChangeTracker:
+    """Records which rows were inserted or updated this session
+
+    Changes are kept in dicts mapping each row key to the time
+    it was changed, so lookups take constant time no matter how
+    many edits have been made.  Changes older than max_age seconds
+    are ignored; None keeps them for the whole session.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.inserted = {}
+        self.updated = {}
+
+    @staticmethod
+    def make_key(record):
+        return (str(record['Date']), record['Time'],
+                record['Lab'], str(record['Plot']))
+
+    def mark(self, record, write):
+        """Record that record was written; write is 'insert' or 'update'"""
+        changes = self.inserted if write == 'insert' else self.updated
+        changes[self.make_key(record)] = time.monotonic()
+
+    def _is_current(self, changed):
+        return (
+            changed is not None and
+            (self.max_age is None or
+             time.monotonic() - changed <= self.max_age)
+        )
+
+    def get_status(self, key):
+        """Return 'inserted', 'updated' or '' for a row key"""
+        if self._is_current(self.inserted.get(key)):
+            return 'inserted'
+        if self._is_current(self.updated.get(key)):
+            return 'updated'
+        return ''
+
+    def expire(self, max_age=None):
+        """Forget changes older than max_age seconds (default self.max_age)"""
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is None:
+            return
+        cutoff = time.monotonic() - max_age
+        for changes in (self.inserted, self.updated):
+            for key in [k for k, t in changes.items() if t < cutoff]:
+                del changes[key]
+
+    def clear(self):
+        """Forget all changes"""
+        self.inserted.clear()
+        self.updated.clear()
+
+
+class FileLock:
+    """A lock shared by every process that uses the same lock file
+
+    Like an RLock, it can be taken again by the thread holding it.
+    The lock file is created when first needed and left in place.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self._fd = os.open(
+                    self.filename, os.O_RDWR | os.O_CREAT, 0o666)
+                self._lock_file(self._fd)
+            except Exception:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            # closing the file releases the lock on it
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *args):
+        self.release()
+
+    @staticmethod
+    def _lock_file(fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                # gives up with OSError after about ten seconds
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
 
 
 class SQLModel:
@@ -40,36 +171,78 @@ class SQLModel:
                           'min': 0, 'max': 1000, 'inc': .01},
         "Notes": {'req': False, 'type': FT.long_string}
     }
-    lc_update_query = (
-                'UPDATE lab_checks SET lab_tech_id = '
-                '(SELECT id FROM lab_techs WHERE name = %(Technician)s) '
-                'WHERE date=%(Date)s AND time=%(Time)s AND lab_id=%(Lab)s')
-
-    lc_insert_query = (
-        'INSERT INTO lab_checks VALUES (%(Date)s, %(Time)s, %(Lab)s, '
-        '(SELECT id FROM lab_techs WHERE name LIKE %(Technician)s))')
-
-    pc_update_query = (
-        'UPDATE plot_checks SET seed_sample = %(Seed sample)s, '
-        'humidity = %(Humidity)s, light = %(Light)s, '
-        'temperature = %(Temperature)s, '
-        'equipment_fault = %(Equipment Fault)s, '
-        'blossoms = %(Blossoms)s, plants = %(Plants)s, '
-        'fruit = %(Fruit)s, max_height = %(Max Height)s, '
-        'min_height = %(Min Height)s, median_height = %(Median Height)s, '
-        'notes = %(Notes)s WHERE date=%(Date)s AND time=%(Time)s '
-        'AND lab_id=%(Lab)s AND plot=%(Plot)s')
-
-    pc_insert_query = (
-        'INSERT INTO plot_checks VALUES (%(Date)s, %(Time)s, %(Lab)s,'
-        ' %(Plot)s, %(Seed sample)s, %(Humidity)s, %(Light)s,'
-        ' %(Temperature)s, %(Equipment Fault)s, %(Blossoms)s, %(Plants)s,'
-        ' %(Fruit)s, %(Max Height)s, %(Min Height)s,'
-        ' %(Median Height)s, %(Notes)s)')
+    # VALUES rows for the upsert queries; save_records()
+    # uses these as templates for multi-row inserts
+    lc_values = (
+        '(%(Date)s, %(Time)s, %(Lab)s, '
+        '(SELECT id FROM lab_techs WHERE name = %(Technician)s))')
+
+    pc_values = (
+        '(%(Date)s, %(Time)s, %(Lab)s, %(Plot)s, %(Seed sample)s,'
+        ' %(Humidity)s, %(Light)s, %(Temperature)s, %(Equipment Fault)s,'
+        ' %(Blossoms)s, %(Plants)s, %(Fruit)s, %(Max Height)s,'
+        ' %(Min Height)s, %(Median Height)s, %(Notes)s)')
+
+    # the lab check is only touched if its technician changed, so
+    # saving a plot check doesn't mark the lab's other plots updated
+    lc_upsert_query = (
+        'INSERT INTO lab_checks VALUES {} '
+        'ON CONFLICT (date, time, lab_id) DO UPDATE '
+        'SET lab_tech_id = EXCLUDED.lab_tech_id, updated_at = now() '
+        'WHERE lab_checks.lab_tech_id <> EXCLUDED.lab_tech_id')
+
+    # xmax is only zero on a freshly inserted row,
+    # so it tells us whether the conflict clause fired
+    pc_upsert_query = (
+        'INSERT INTO plot_checks VALUES {} '
+        'ON CONFLICT (date, time, lab_id, plot) DO UPDATE '
+        'SET seed_sample = EXCLUDED.seed_sample, '
+        'humidity = EXCLUDED.humidity, light = EXCLUDED.light, '
+        'temperature = EXCLUDED.temperature, '
+        'equipment_fault = EXCLUDED.equipment_fault, '
+        'blossoms = EXCLUDED.blossoms, plants = EXCLUDED.plants, '
+        'fruit = EXCLUDED.fruit, max_height = EXCLUDED.max_height, '
+        'min_height = EXCLUDED.min_height, '
+        'median_height = EXCLUDED.median_height, '
+        'notes = EXCLUDED.notes, updated_at = now() '
+        'RETURNING (xmax = 0) AS inserted')
+
+    # number of records sent per statement by save_records()
+    batch_size = 1000
+
+    # size limits for the connection pool
+    min_connections = 1
+    max_connections = 8
+
+    # seconds before the autofill cache is reloaded
+    autofill_ttl = 300
+
+    seed_samples_query = (
+        'SELECT lab_id, plot, current_seed_sample FROM plots')
+
+    lab_checks_query = (
+        "SELECT to_char(date, 'YYYY-MM-DD') AS date, "
+        "to_char(time, 'FMHH24:MI') AS time, lab_id, lab_tech_id, "
+        'lt.name AS lab_tech FROM lab_checks JOIN lab_techs lt '
+        'ON lab_checks.lab_tech_id = lt.id WHERE {}')
 
     def __init__(self, host, database, user, password):
-        self.connection = pg.connect(host=host, database=database,
-            user=user, password=password, cursor_factory=DictCursor)
+        self.pool = ThreadedConnectionPool(
+            self.min_connections, self.max_connections,
+            host=host, database=database, user=user,
+            password=password, cursor_factory=DictCursor)
+        # ThreadedConnectionPool raises an error when it runs out
+        # of connections, so make threads wait their turn instead
+        self._available = BoundedSemaphore(self.max_connections)
+        # last record before each page start seen by get_records()
+        self._bookmarks = {}
+        self.changes = ChangeTracker()
+        # autofill lookups, loaded by warm_autofill_cache()
+        self._seed_samples = {}
+        self._lab_checks = {}
+        self._autofill_date = None
+        self._autofill_loaded = None
+        self._autofill_lock = Lock()
 
         techs = self.query("SELECT * FROM lab_techs ORDER BY name")
         labs = self.query("SELECT id FROM labs ORDER BY id")
@@ -78,31 +251,214 @@ class SQLModel:
         self.fields['Lab']['values'] = [x['id'] for x in labs]
         self.fields['Plot']['values'] = [str(x['plot']) for x in plots]
 
+    @contextmanager
+    def connection(self):
+        """Check out a pooled connection for a unit of work
+
+        The transaction is committed when the block exits normally
+        and rolled back if it raises.  Each thread should use its
+        own connection, so it is safe to call from worker threads.
+        """
+        with self._available:
+            connection = self.pool.getconn()
+            try:
+                yield connection
+            except BaseException:
+                if not connection.closed:
+                    connection.rollback()
+                raise
+            else:
+                connection.commit()
+            finally:
+                self.pool.putconn(connection, close=bool(connection.closed))
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.closeall()
 
     def query(self, query, parameters=None):
-        cursor = self.connection.cursor()
-        try:
+        with self.connection() as connection:
+            cursor = connection.cursor()
             cursor.execute(query, parameters)
-        except (pg.Error) as e:
-            self.connection.rollback()
-            raise e
-        else:
-            self.connection.commit()
             # cursor.description is None when
             # no rows are returned
             if cursor.description is not None:
                 return cursor.fetchall()
 
+    # the columns of data_record_view, selected from the tables so
+    # filters and ordering on the base columns can use their indexes
+    record_select = (
+        'SELECT pc.date AS "Date", '
+        """to_char(pc.time, 'FMHH24:MI') AS "Time", """
+        'lt.name AS "Technician", pc.lab_id AS "Lab", pc.plot AS "Plot", '
+        'pc.seed_sample AS "Seed sample", pc.humidity AS "Humidity", '
+        'pc.light AS "Light", pc.temperature AS "Temperature", '
+        'pc.plants AS "Plants", pc.blossoms AS "Blossoms", '
+        'pc.fruit AS "Fruit", pc.max_height AS "Max Height", '
+        'pc.min_height AS "Min Height", '
+        'pc.median_height AS "Median Height", pc.notes AS "Notes" '
+        'FROM plot_checks AS pc JOIN lab_checks AS lc '
+        'ON pc.lab_id = lc.lab_id AND pc.date = lc.date '
+        'AND pc.time = lc.time '
+        'JOIN lab_techs AS lt ON lc.lab_tech_id = lt.id ')
+
+    # ordered on the plot_checks primary key, so a page is read
+    # from the index rather than by sorting every row
+    records_query = (
+        record_select +
+        'WHERE (NOT %(all_dates)s OR pc.date = CURRENT_DATE) {} '
+        'ORDER BY pc.date, pc.time, pc.lab_id, pc.plot')
+
+    # rows after a given key, for keyset pagination
+    keyset_clause = (
+        'AND (pc.date, pc.time, pc.lab_id, pc.plot) > '
+        '(%(Date)s, %(Time)s::time, %(Lab)s, %(Plot)s)')
+
+    # number of rows to pull from the server at a time
+    fetch_size = 1000
+
+    # how far upload windows end behind now(); see get_upload_window()
+    upload_lag = timedelta(minutes=5)
+
     def get_all_records(self, all_dates=False):
         """Return all records.
 
         By default, only return today's records, unless
         all_dates is True.
         """
-        query = ('SELECT * FROM data_record_view '
-            'WHERE NOT %(all_dates)s OR "Date" = CURRENT_DATE '
-            'ORDER BY "Date", "Time", "Lab", "Plot"')
-        return self.query(query, {'all_dates': all_dates})
+        return self.query(
+            self.records_query.format(''), {'all_dates': all_dates})
+
+    def iter_record_batches(self, all_dates=False, batch_size=None):
+        """Yield lists of records from a server-side cursor
+
+        Only batch_size rows (default fetch_size) are held
+        in memory at a time.  The generator holds a pooled connection
+        until it is exhausted or closed, so callers that may stop
+        early should close it, e.g. with contextlib.closing().
+        """
+        batch_size = batch_size or self.fetch_size
+        with self.connection() as connection:
+            cursor = connection.cursor(name='record_batches')
+            cursor.execute(
+                self.records_query.format(''), {'all_dates': all_dates})
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                yield rows
+                rows = cursor.fetchmany(batch_size)
+            cursor.close()
+
+    def iter_records(self, all_dates=False, batch_size=None):
+        """Yield records one at a time instead of returning a list
+
+        As with iter_record_batches(), close it if it isn't exhausted.
+        """
+        with closing(
+            self.iter_record_batches(all_dates, batch_size)
+        ) as batches:
+            for rows in batches:
+                yield from rows
+
+    changes_query = (
+        record_select +
+        'WHERE (pc.updated_at > %(since)s OR lc.updated_at > %(since)s) '
+        'AND pc.updated_at <= %(until)s AND lc.updated_at <= %(until)s '
+        'ORDER BY pc.date, pc.time, pc.lab_id, pc.plot')
+
+    def iter_changes(self, since, until, batch_size=None):
+        """Yield records inserted or updated after since, up to until
+
+        since may be None for every record.  As with
+        iter_record_batches(), close it if it isn't exhausted.
+        """
+        batch_size = batch_size or self.fetch_size
+        with self.connection() as connection:
+            cursor = connection.cursor(name='record_changes')
+            cursor.execute(self.changes_query, {
+                'since': since or '-infinity', 'until': until})
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                yield from rows
+                rows = cursor.fetchmany(batch_size)
+            cursor.close()
+
+    def get_upload_window(self, destinations):
+        """Return the (since, until) range of changes to upload next
+
+        The range covers what every one of destinations is missing:
+        since is the oldest of their watermarks, or None if anything
+        has never been uploaded to one of them.  until is read once
+        for all of them.  updated_at is the time a writing transaction
+        started, so a change can commit with a stamp older than now();
+        until is held back by upload_lag so those changes are picked
+        up next time rather than missed.  Writes taking longer than
+        upload_lag can still be missed, so keep them short.
+        """
+        destinations = sorted(set(destinations))
+        result = self.query(
+            'SELECT now() - %(lag)s AS until, '
+            'CASE WHEN count(*) = %(count)s THEN min(uploaded_until) END '
+            'AS since FROM upload_watermarks '
+            'WHERE destination = ANY(%(destinations)s)',
+            {'destinations': destinations, 'count': len(destinations),
+             'lag': self.upload_lag})
+        return result[0]['since'], result[0]['until']
+
+    def set_upload_watermark(self, destination, until):
+        """Record that destination has every change up to until"""
+        self.query(
+            'INSERT INTO upload_watermarks VALUES '
+            '(%(destination)s, %(until)s) ON CONFLICT (destination) '
+            'DO UPDATE SET uploaded_until = GREATEST('
+            'upload_watermarks.uploaded_until, EXCLUDED.uploaded_until)',
+            {'destination': destination, 'until': until})
+
+    def get_records_page(self, after=None, limit=None, all_dates=True):
+        """Return up to limit records following the record after
+
+        after is a record (or dict with its Date, Time, Lab and Plot);
+        pass the last record of one page to get the next one.  This
+        seeks on the plot_checks primary key rather than using an
+        OFFSET scan; sql/check_record_pages.sql checks the plans.
+        """
+        parameters = {'all_dates': all_dates}
+        if after is None:
+            query = self.records_query.format('')
+        else:
+            query = self.records_query.format(self.keyset_clause)
+            parameters.update({
+                key: after[key] for key in ('Date', 'Time', 'Lab', 'Plot')})
+        query += ' LIMIT %(limit)s'
+        parameters['limit'] = limit or self.fetch_size
+        return self.query(query, parameters)
+
+    count_query = (
+        'SELECT count(*) AS count FROM plot_checks '
+        'WHERE NOT %(all_dates)s OR date = CURRENT_DATE')
+
+    def get_record_count(self, all_dates=False):
+        """Return the number of records"""
+        result = self.query(self.count_query, {'all_dates': all_dates})
+        return result[0]['count']
+
+    def get_records(self, start, limit, all_dates=False):
+        """Return up to limit records starting at row number start
+
+        When the page before has already been read, the page is
+        found with a keyset query from its last record; otherwise
+        this falls back to OFFSET.
+        """
+        after = self._bookmarks.get((all_dates, start))
+        if start == 0 or after is not None:
+            rows = self.get_records_page(after, limit, all_dates)
+        else:
+            rows = self.query(
+                self.records_query.format('') +
+                ' LIMIT %(limit)s OFFSET %(start)s',
+                {'all_dates': all_dates, 'limit': limit, 'start': start})
+        if rows:
+            self._bookmarks[(all_dates, start + len(rows))] = rows[-1]
+        return rows
 
     def get_record(self, date, time, lab, plot):
         """Return a single record
@@ -118,41 +474,126 @@ class SQLModel:
                     "lab": lab, "plot": plot})
         return result[0] if result else {}
 
-    def save_record(self, record):
+    # the plot check upsert, also returning the number of rows
+    # get_records() lists before the record, or NULL if it isn't
+    # listed; the row itself isn't in the statement's snapshot, and
+    # isn't counted anyway
+    save_query = (
+        'WITH saved AS ({}) SELECT saved.inserted, '
+        'CASE WHEN NOT %(all_dates)s OR %(Date)s::date = CURRENT_DATE '
+        'THEN (SELECT count(*) FROM plot_checks AS pc '
+        'WHERE (NOT %(all_dates)s OR pc.date = CURRENT_DATE) '
+        'AND (pc.date, pc.time, pc.lab_id, pc.plot) < '
+        '(%(Date)s, %(Time)s::time, %(Lab)s, %(Plot)s)) END AS index '
+        'FROM saved')
 
-        date = record['Date']
-        time = record['Time']
-        lab = record['Lab']
-        plot = record['Plot']
+    def save_record(self, record, all_dates=False):
+        """Insert or update a record
 
-        if self.get_lab_check(date, time, lab):
-            lc_query = self.lc_update_query
-        else:
-            lc_query = self.lc_insert_query
-        if self.get_record(date, time, lab, plot):
-            pc_query = self.pc_update_query
-            self.last_write = 'update'
-        else:
-            pc_query = self.pc_insert_query
-            self.last_write = 'insert'
+        Both tables are written by one round trip in a single
+        transaction.  Returns (record, write, index): the saved
+        record, 'insert' or 'update', and the record's row number in
+        get_records(), or None if it isn't listed there.  Use these
+        rather than last_write and last_index, which another thread's
+        save may have changed by the time they are read.
+        """
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                self.lc_upsert_query.format(self.lc_values) + '; ' +
+                self.save_query.format(
+                    self.pc_upsert_query.format(self.pc_values)),
+                dict(record, all_dates=all_dates))
+            result = cursor.fetchone()
+        write = 'insert' if result['inserted'] else 'update'
+        index = result['index']
+        self.last_write, self.last_index = write, index
+        self._bookmarks.clear()
+        self.invalidate_autofill_cache()
+        self.changes.mark(record, write)
+        return dict(record), write, index
 
-        self.query(lc_query, record)
-        self.query(pc_query, record)
+    def save_records(self, records):
+        """Insert or update many records in a single transaction
+
+        Records are sent in multi-row statements of batch_size rows.
+        Returns the number of records written; a key repeated within
+        a batch is only written once, as its last version.
+        """
+        records = iter(records)
+        written = 0
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            batch = list(islice(records, self.batch_size))
+            while batch:
+                # a statement may only update each row once, so
+                # keep the last version of any repeated key
+                lab_checks = {
+                    (r['Date'], r['Time'], r['Lab']): r for r in batch}
+                plot_checks = {
+                    (r['Date'], r['Time'], r['Lab'], r['Plot']): r
+                    for r in batch}
+                execute_values(
+                    cursor, self.lc_upsert_query.format('%s'),
+                    lab_checks.values(), template=self.lc_values,
+                    page_size=self.batch_size)
+                execute_values(
+                    cursor, self.pc_upsert_query.format('%s'),
+                    plot_checks.values(), template=self.pc_values,
+                    page_size=self.batch_size)
+                written += len(plot_checks)
+                batch = list(islice(records, self.batch_size))
+        self._bookmarks.clear()
+        self.invalidate_autofill_cache()
+        return written
+
+    def warm_autofill_cache(self):
+        """Load every plot's seed sample and today's lab checks"""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.seed_samples_query)
+            seed_samples = {
+                (row['lab_id'], str(row['plot'])):
+                row['current_seed_sample'] or ''
+                for row in cursor.fetchall()}
+            cursor.execute(
+                self.lab_checks_query.format('date = CURRENT_DATE'))
+            lab_checks = {
+                (row['date'], row['time'], row['lab_id']): dict(row)
+                for row in cursor.fetchall()}
+        self._seed_samples = seed_samples
+        self._lab_checks = lab_checks
+        self._autofill_date = date.today().isoformat()
+        self._autofill_loaded = time.monotonic()
+
+    def invalidate_autofill_cache(self):
+        self._autofill_loaded = None
+
+    def _check_autofill_cache(self):
+        """Reload the autofill cache if it is missing or expired"""
+        with self._autofill_lock:
+            if (
+                self._autofill_loaded is None or
+                time.monotonic() - self._autofill_loaded > self.autofill_ttl
+            ):
+                self.warm_autofill_cache()
 
     def get_lab_check(self, date, time, lab):
-        query = ('SELECT date, time, lab_id, lab_tech_id, '
-            'lt.name as lab_tech FROM lab_checks JOIN lab_techs lt '
-            'ON lab_checks.lab_tech_id = lt.id WHERE '
-            'lab_id = %(lab)s AND date = %(date)s AND time = %(time)s')
-        results = self.query(
-            query, {'date': date, 'time': time, 'lab': lab})
-        return results[0] if results else {}
+        self._check_autofill_cache()
+        key = (str(date), time, lab)
+        if key not in self._lab_checks and key[0] != self._autofill_date:
+            # only today's checks are preloaded; cache others as used
+            results = self.query(
+                self.lab_checks_query.format(
+                    'lab_id = %(lab)s AND date = %(date)s '
+                    'AND time = %(time)s'),
+                {'date': date, 'time': time, 'lab': lab})
+            self._lab_checks[key] = dict(results[0]) if results else {}
+        return self._lab_checks.get(key, {})
 
     def get_current_seed_sample(self, lab, plot):
-        result = self.query('SELECT current_seed_sample FROM plots '
-            'WHERE lab_id=%(lab)s AND plot=%(plot)s',
-            {'lab': lab, 'plot': plot})
-        return result[0]['current_seed_sample'] if result else ''
+        self._check_autofill_cache()
+        return self._seed_samples.get((lab, str(plot)), '')
 
     def add_weather_data(self, data):
         query = (
@@ -168,20 +609,20 @@ class SQLModel:
             pass
 
     def get_growth_by_lab(self):
+        # read from the rollup maintained by the plot_checks trigger
         query = (
-            'SELECT date - (SELECT min(date) FROM plot_checks) AS day, '
-            'lab_id, avg(median_height) AS avg_height FROM plot_checks '
-            'GROUP BY date, lab_id ORDER BY day, lab_id;'
+            'SELECT date - (SELECT min(date) FROM growth_by_lab_day) AS day, '
+            'lab_id, total_median_height / check_count AS avg_height '
+            'FROM growth_by_lab_day ORDER BY day, lab_id;'
         )
         return self.query(query)
 
     def get_yield_by_plot(self):
         query = (
-            'SELECT lab_id, plot, seed_sample, MAX(fruit) AS yield, '
-            'AVG(humidity) AS avg_humidity, '
-            'AVG(temperature) AS avg_temperature '
-            'FROM plot_checks WHERE NOT equipment_fault '
-            'GROUP BY lab_id, plot, seed_sample'
+            'SELECT lab_id, plot, seed_sample, max_fruit AS yield, '
+            'total_humidity / NULLIF(humidity_count, 0) AS avg_humidity, '
+            'total_temperature / NULLIF(temperature_count, 0) '
+            'AS avg_temperature FROM yield_by_plot'
         )
         return self.query(query)
 
@@ -222,6 +663,19 @@ class CSVModel:
     }
 
 
+    # suffix for the sidecar file holding the row offset index
+    index_suffix = '.idx'
+    # suffix for the manifest describing an extract
+    manifest_suffix = '.manifest.json'
+    # the fields that identify a record
+    key_fields = ('Date', 'Time', 'Lab', 'Plot')
+    # suffix for the journal of row updates
+    journal_suffix = '.journal'
+    # number of journaled updates that triggers a compaction
+    compact_threshold = 1000
+    # suffix for the file locked while the CSV file or journal change
+    lock_suffix = '.lock'
+
     def __init__(self, filename, filepath=None):
 
         if filepath:
@@ -230,65 +684,594 @@ class CSVModel:
             self.filename = os.path.join(filepath, filename)
         else:
             self.filename = filename
+        self.index_filename = self.filename + self.index_suffix
+        self._offsets = None
+        self._indexed_stat = None
 
-    def get_all_records(self):
-        """Read in all records from the CSV and return a list"""
-        if not os.path.exists(self.filename):
-            return []
+        self.journal_filename = self.filename + self.journal_suffix
+        # a journal being folded into the file by compact()
+        self.old_journal_filename = self.journal_filename + '.old'
+        self._journal = {}
+        # the stats of the old and current journal files last read
+        self._journal_stat = (None, None)
+        # how far the current journal has been read, and whether a
+        # torn row follows that point
+        self._journal_end = 0
+        self._journal_torn = False
+        # other processes may have the same file open
+        self._lock = FileLock(self.filename + self.lock_suffix)
+        self._compacting = False
+        self._compactor = None
+        self.changes = ChangeTracker()
 
-        with open(self.filename, 'r', encoding='utf-8') as fh:
-            # turning fh into a list is necessary for our unit tests
-            csvreader = csv.DictReader(list(fh.readlines()))
-            missing_fields = set(self.fields.keys()) - set(csvreader.fieldnames)
-            if len(missing_fields) > 0:
-                raise Exception(
-                    "File is missing fields: {}"
-                    .format(', '.join(missing_fields))
-                )
-            else:
-                records = list(csvreader)
+    def _file_stat(self):
+        """Return the (size, mtime) pair used to validate the index"""
+        stat = os.stat(self.filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _scan_offsets(fh):
+        """Yield the byte offset of each CSV row in binary file fh
 
-        # Correct issue with boolean fields
+        Rows may span several lines when a quoted field contains
+        newlines, so a line only ends a row when it leaves us
+        outside of a quoted field.  Blank lines are skipped, as
+        DictReader skips them.
+        """
+        offset = fh.tell()
+        start = offset
+        in_quotes = False
+        for line in fh:
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            offset += len(line)
+            if not in_quotes:
+                if offset - start > len(line) or line.strip(b'\r\n'):
+                    yield start
+                start = offset
+
+    def _write_index(self, start=0):
+        """Save the in-memory index to the sidecar file
+
+        If start is given, the offsets before it are already in the
+        file, so only the rest are appended.  The stat at the head of
+        the file is written last, so an interrupted write leaves an
+        index that won't match the CSV file.
+        """
+        stat = array('q', self._indexed_stat)
+        if start:
+            try:
+                with open(self.index_filename, 'r+b') as fh:
+                    fh.seek(stat.itemsize * (len(stat) + start))
+                    self._offsets[start:].tofile(fh)
+                    fh.truncate()
+                    fh.seek(0)
+                    stat.tofile(fh)
+                return
+            except FileNotFoundError:
+                pass
+        with open(self.index_filename, 'wb') as fh:
+            stat.tofile(fh)
+            self._offsets.tofile(fh)
+
+    def _build_index(self):
+        """Scan the CSV file and build the row offset index"""
+        stat = self._file_stat()
+        with open(self.filename, 'rb') as fh:
+            offsets = array('q', self._scan_offsets(fh))
+        # the first row is the header
+        self._offsets = offsets[1:]
+        self._indexed_stat = stat
+        self._write_index()
+
+    def _load_index(self):
+        """Load the sidecar index, if it matches the CSV file"""
+        index = array('q')
+        try:
+            with open(self.index_filename, 'rb') as fh:
+                index.frombytes(fh.read())
+        except (OSError, ValueError):
+            return
+        if len(index) >= 2:
+            self._indexed_stat = tuple(index[:2])
+            self._offsets = index[2:]
+
+    def get_row_offsets(self):
+        """Return the byte offsets of each data row in the file
+
+        The index is cached in a sidecar file and rebuilt whenever
+        the file's size or modification time no longer matches.
+        """
+        stat = self._file_stat()
+        if self._indexed_stat != stat:
+            self._load_index()
+        if self._indexed_stat != stat:
+            self._build_index()
+        return self._offsets
+
+    def _update_index(self, old_stat):
+        """Index rows appended since old_stat, if the index was current"""
+        if self._indexed_stat is None or self._indexed_stat != old_stat:
+            return
+        start = len(self._offsets)
+        with open(self.filename, 'rb') as fh:
+            fh.seek(old_stat[0])
+            self._offsets.extend(self._scan_offsets(fh))
+        self._indexed_stat = self._file_stat()
+        self._write_index(start)
+
+    def _check_fields(self, fieldnames):
+        missing_fields = set(self.fields.keys()) - set(fieldnames or [])
+        if len(missing_fields) > 0:
+            raise Exception(
+                "File is missing fields: {}"
+                .format(', '.join(missing_fields))
+            )
+
+    def _fix_booleans(self, record):
+        """Correct issue with boolean fields"""
         trues = ('true', 'yes', '1')
-        bool_fields = [
-            key for key, meta
-            in self.fields.items()
-            if meta['type'] == FT.boolean
-        ]
-        for record in records:
-            for key in bool_fields:
+        for key, meta in self.fields.items():
+            if meta['type'] == FT.boolean and key in record:
                 record[key] = record[key].lower() in trues
-        return records
+        return record
+
+    def _read_journal(self, filename, start=0):
+        """Read the journaled updates in filename from offset start
+
+        Returns a list of (rownum, record) pairs and the offset just
+        past the last complete row.  A row left torn by a crash part
+        way through writing it is not included.
+        """
+        data = bytearray()
+        end = start
+        try:
+            with open(filename, 'rb') as fh:
+                fh.seek(start)
+                in_quotes = False
+                for line in fh:
+                    if line.count(b'"') % 2:
+                        in_quotes = not in_quotes
+                    data += line
+                    if not in_quotes and line.endswith(b'\n'):
+                        end = start + len(data)
+        except FileNotFoundError:
+            return [], start
+        text = data[:end - start].decode('utf-8')
+        rows = []
+        fieldnames = ['Row'] + list(self.fields)
+        reader = csv.DictReader(io.StringIO(text, newline=None), fieldnames)
+        for record in reader:
+            rownum = record.pop('Row')
+            # skips the header
+            if rownum.isdigit() and None not in record.values():
+                rows.append((int(rownum), record))
+        return rows, end
+
+    @staticmethod
+    def _journal_file_stat(filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _get_journal(self):
+        """Return a dict of the journaled updates, keyed by row number
+
+        Rows appended to the current journal since the last call are
+        read and added to the cached dict; it is only read again from
+        the start when compact() moves the journal aside.
+        """
+        old_stat = self._journal_file_stat(self.old_journal_filename)
+        stat = self._journal_file_stat(self.journal_filename)
+        last_old_stat, last_stat = self._journal_stat
+        if (old_stat == last_old_stat and stat is not None and
+                last_stat is not None and stat[0] == last_stat[0] and
+                stat[1] >= self._journal_end):
+            if stat[1] > self._journal_end:
+                rows, self._journal_end = self._read_journal(
+                    self.journal_filename, self._journal_end)
+                self._journal.update(rows)
+        elif old_stat != last_old_stat or stat != last_stat:
+            journal = {}
+            if old_stat is not None:
+                journal.update(self._read_journal(
+                    self.old_journal_filename)[0])
+            rows, self._journal_end = self._read_journal(
+                self.journal_filename)
+            journal.update(rows)
+            self._journal = journal
+        self._journal_stat = (old_stat, stat)
+        self._journal_torn = (
+            stat is not None and stat[1] > self._journal_end)
+        return self._journal
+
+    def iter_records(self, start=0, limit=None, fields=None):
+        """Yield records from the CSV one at a time
+
+        start is the row number to begin at, limit the maximum number
+        of rows to yield.  If fields is given, only those fields are
+        included in each record.  The file stays open until the
+        generator is exhausted or closed.
+        """
+        if not os.path.exists(self.filename):
+            return
+
+        # compact() may replace the file, so the offsets are read
+        # under the lock along with opening the version they index
+        with self._lock:
+            journal = self._get_journal()
+            offsets = self.get_row_offsets() if start else None
+            fh = open(self.filename, 'r', encoding='utf-8')
+        with fh:
+            csvreader = csv.DictReader(fh)
+            self._check_fields(csvreader.fieldnames)
+            if start:
+                if start >= len(offsets):
+                    return
+                fh.seek(offsets[start])
+            rows = enumerate(islice(csvreader, limit), start)
+            for rownum, record in rows:
+                if rownum in journal:
+                    record = dict(journal[rownum])
+                if fields is not None:
+                    record = {key: record[key] for key in fields}
+                yield self._fix_booleans(record)
+
+    def get_all_records(self):
+        """Read in all records from the CSV and return a list"""
+        return list(self.iter_records())
+
+    def get_record_count(self):
+        """Return the number of records in the file"""
+        if not os.path.exists(self.filename):
+            return 0
+        return len(self.get_row_offsets())
+
+    def get_records(self, start, limit):
+        """Return up to limit records starting at row number start"""
+        return list(self.iter_records(start, limit))
 
     def get_record(self, rownum):
         """Get a single record by row number
 
+        Only the requested row is read, using the row offset index.
         Callling code should catch IndexError
           in case of a bad rownum.
         """
-
-        return self.get_all_records()[rownum]
+        if not os.path.exists(self.filename):
+            raise IndexError('No records in file')
+        offsets = self.get_row_offsets()
+        if rownum < 0:
+            rownum += len(offsets)
+        if not 0 <= rownum < len(offsets):
+            raise IndexError('Row {} does not exist'.format(rownum))
+        with closing(self.iter_records(start=rownum, limit=1)) as records:
+            return next(records)
 
     def save_record(self, data, rownum=None):
-        """Save a dict of data to the CSV file"""
+        """Save a dict of data to the CSV file
+
+        Updates are appended to a journal rather than rewriting the
+        file; the journal is folded back in by compact().  Returns
+        (data, write, index), where write is 'insert' or 'update' and
+        index is the record's row number.
+        """
 
         if rownum is not None:
             # This is an update
-            records = self.get_all_records()
-            records[rownum] = data
-            with open(self.filename, 'w', encoding='utf-8') as fh:
-                csvwriter = csv.DictWriter(fh, fieldnames=self.fields.keys())
-                csvwriter.writeheader()
-                csvwriter.writerows(records)
+            with self._lock:
+                if not os.path.exists(self.filename):
+                    raise IndexError('No records in file')
+                rowcount = len(self.get_row_offsets())
+                if rownum < 0:
+                    rownum += rowcount
+                if not 0 <= rownum < rowcount:
+                    raise IndexError('Row {} does not exist'.format(rownum))
+
+                self._get_journal()
+                if self._journal_torn:
+                    # start the new row on a line of its own
+                    os.truncate(self.journal_filename, self._journal_end)
+                newfile = self._journal_end == 0
+                with open(
+                    self.journal_filename, 'a', encoding='utf-8'
+                ) as fh:
+                    csvwriter = csv.DictWriter(
+                        fh, fieldnames=['Row'] + list(self.fields.keys()))
+                    if newfile:
+                        csvwriter.writeheader()
+                    csvwriter.writerow(dict(data, Row=rownum))
+                pending = len(self._get_journal())
+            if pending >= self.compact_threshold:
+                self.compact_in_background()
+            write, index = 'update', rownum
         else:
             # This is a new record
+            with self._lock:
+                self.save_records([data])
+                index = self.get_record_count() - 1
+            write = 'insert'
+        self.last_write, self.last_index = write, index
+        self.changes.mark(data, write)
+        return data, write, index
+
+    # A CSV file has no change times, so every upload is a full one
+
+    def get_upload_window(self, destinations):
+        return None, None
+
+    def iter_changes(self, since, until, batch_size=None):
+        return self.iter_records()
+
+    def set_upload_watermark(self, destination, until):
+        pass
+
+    def save_records(self, records):
+        """Append an iterable of records to the CSV file
+
+        All records are written through one buffered file handle.
+        Returns the number of records written.
+        """
+        written = 0
+        with self._lock:
             newfile = not os.path.exists(self.filename)
+            old_stat = None if newfile else self._indexed_stat
+            if old_stat is not None:
+                old_stat = self._file_stat()
 
             with open(self.filename, 'a', encoding='utf-8') as fh:
                 csvwriter = csv.DictWriter(fh, fieldnames=self.fields.keys())
                 if newfile:
                     csvwriter.writeheader()
-                csvwriter.writerow(data)
+                for written, record in enumerate(records, 1):
+                    csvwriter.writerow(record)
+
+            if old_stat is not None:
+                self._update_index(old_stat)
+        return written
+
+    def write_manifest(self, **details):
+        """Write a JSON manifest describing the CSV file
+
+        The manifest holds the file's name, size, SHA-256, fields and
+        the fields that identify a record, so a receiver can check the
+        file and merge it into what it already has.  Uploads may send
+        the file gzipped instead (FTP stores it as name.gz), so the
+        gzip_file, gzip_size and gzip_sha256 of the compressed stream
+        are given too.  Any details given are added.  Returns the
+        manifest's file name.
+        """
+        name = os.path.basename(self.filename)
+        with open(self.filename, 'rb') as fh:
+            size, digest = self._digest(fh)
+            fh.seek(0)
+            gzip_size, gzip_digest = self._digest(GzipReader(fh))
+        manifest = {
+            'file': name,
+            'size': size,
+            'sha256': digest,
+            'gzip_file': name + '.gz',
+            'gzip_size': gzip_size,
+            'gzip_sha256': gzip_digest,
+            'fields': list(self.fields),
+            'key': list(self.key_fields)
+        }
+        manifest.update(details)
+        filename = self.filename + self.manifest_suffix
+        with open(filename, 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh, indent=2, default=str)
+        return filename
+
+    @staticmethod
+    def _digest(fh):
+        """Return the size and SHA-256 of what fh reads"""
+        digest = sha256()
+        size = 0
+        for block in iter(lambda: fh.read(64 * 1024), b''):
+            digest.update(block)
+            size += len(block)
+        return size, digest.hexdigest()
+
+    def compact(self):
+        """Fold the journaled updates into the CSV file
+
+        The merged data is written to a temporary file which replaces
+        the original with an atomic rename, so a crash part way
+        through leaves the original file and journal intact.
+        Returns True if a compaction took place.
+        """
+        with self._lock:
+            if self._compacting:
+                return False
+            if not os.path.exists(self.old_journal_filename):
+                if not os.path.exists(self.journal_filename):
+                    return False
+                # updates made from now on go to a fresh journal
+                os.replace(self.journal_filename, self.old_journal_filename)
+            self._compacting = True
+            old_journal = self._journal_file_stat(self.old_journal_filename)
+            rowcount = len(self.get_row_offsets())
+
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        tmpname = None
+        try:
+            fd, tmpname = mkstemp(dir=dirname, suffix='.tmp')
+            updates = dict(
+                self._read_journal(self.old_journal_filename)[0])
+            with open(fd, 'w', encoding='utf-8') as fh, \
+                    open(self.filename, 'r', encoding='utf-8') as basefh:
+                csvwriter = csv.DictWriter(fh, fieldnames=self.fields.keys())
+                csvwriter.writeheader()
+                rows = enumerate(islice(csv.DictReader(basefh), rowcount))
+                for rownum, record in rows:
+                    csvwriter.writerow(updates.get(rownum, record))
+
+            with self._lock:
+                if self._journal_file_stat(
+                        self.old_journal_filename) != old_journal:
+                    # another process has already folded it in
+                    os.remove(tmpname)
+                    return False
+                # copy over any rows appended while we were merging
+                offsets = self.get_row_offsets()
+                if len(offsets) > rowcount:
+                    with open(self.filename, 'rb') as src, \
+                            open(tmpname, 'ab') as dest:
+                        src.seek(offsets[rowcount])
+                        shutil.copyfileobj(src, dest)
+                # mkstemp() makes the file private to its owner
+                shutil.copymode(self.filename, tmpname)
+                os.replace(tmpname, self.filename)
+                os.remove(self.old_journal_filename)
+                self._build_index()
+        except Exception:
+            if tmpname is not None and os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        finally:
+            self._compacting = False
+        return True
+
+    def compact_in_background(self):
+        """Run compact() on a separate thread
+
+        The thread isn't a daemon, so exiting waits for it rather than
+        leaving a partly written temporary file behind.
+        """
+        if not self._compacting:
+            self._compactor = Thread(target=self.compact)
+            self._compactor.start()
+
+    def close(self):
+        """Wait for a background compaction to finish"""
+        if self._compactor is not None:
+            self._compactor.join()
+
+
+class PagedRecords(MutableSequence):
+    """A sequence of records loaded from a model a page at a time
+
+    fetch(start, limit) is called to load a page the first time
+    one of its records is accessed.  Only the max_pages most
+    recently used pages are kept.
+
+    Changes made through the sequence only update the cached
+    pages and count; they should mirror a change already made
+    to the underlying data.
+
+    To keep fetches off the Tk thread, read rows with peek(), which
+    never fetches, and load the missing_pages() with fetch_pages() on
+    a worker and add_pages() on the Tk thread.  generation changes
+    whenever rows move, so pages fetched before then are dropped.
+    """
+
+    def __init__(self, count, fetch, page_size=100, max_pages=50):
+        self.count = count
+        self.fetch = fetch
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.generation = 0
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return self.count
+
+    def _add_page(self, number, page):
+        self._pages[number] = page
+        self._pages.move_to_end(number)
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def _get_page(self, number):
+        if number in self._pages:
+            self._pages.move_to_end(number)
+        else:
+            self._add_page(number, self.fetch(
+                number * self.page_size, self.page_size))
+        return self._pages[number]
+
+    def peek(self, index):
+        """Return the record at index if its page is loaded, else None"""
+        number, offset = divmod(index, self.page_size)
+        page = self._pages.get(number)
+        if page is None or offset >= len(page):
+            return None
+        self._pages.move_to_end(number)
+        return page[offset]
+
+    def missing_pages(self, start, stop):
+        """Return the numbers of unloaded pages holding start to stop"""
+        stop = min(stop, self.count)
+        if start >= stop:
+            return []
+        return [
+            number for number in range(
+                start // self.page_size, (stop - 1) // self.page_size + 1)
+            if number not in self._pages]
+
+    def fetch_pages(self, numbers):
+        """Fetch pages without caching them, for a worker thread"""
+        return {
+            number: self.fetch(number * self.page_size, self.page_size)
+            for number in numbers}
+
+    def add_pages(self, pages, generation):
+        """Cache pages from fetch_pages()
+
+        The pages are dropped if rows have moved since generation.
+        Returns True if they were added.
+        """
+        if generation != self.generation:
+            return False
+        for number, page in pages.items():
+            self._add_page(number, page)
+        return True
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('record index out of range')
+        page = self._get_page(index // self.page_size)
+        return page[index % self.page_size]
+
+    def _drop_pages_from(self, number):
+        for page in [n for n in self._pages if n >= number]:
+            del self._pages[page]
+
+    def __setitem__(self, index, record):
+        if index < 0:
+            index += self.count
+        page = self._pages.get(index // self.page_size)
+        if page is not None:
+            page[index % self.page_size] = record
+
+    def __delitem__(self, index):
+        if index < 0:
+            index += self.count
+        self._drop_pages_from(index // self.page_size)
+        self.count -= 1
+        self.generation += 1
+
+    def insert(self, index, record):
+        number, offset = divmod(index, self.page_size)
+        self._drop_pages_from(number + 1)
+        page = self._pages.get(number)
+        if page is not None:
+            page.insert(offset, record)
+            if len(page) > self.page_size:
+                page.pop()
+        self.count += 1
+        self.generation += 1
+
+    def invalidate(self):
+        """Drop all cached pages"""
+        self._pages.clear()
+        self.generation += 1
 
 
 class SettingsModel:
@@ -351,3 +1334,43 @@ class SettingsModel:
             if key in raw_values and 'value' in raw_values[key]:
                 raw_value = raw_values[key]['value']
                 self.variables[key]['value'] = raw_value
+
+
+class UploadQueueModel:
+    """A model for saving the upload job queue
+
+    Jobs are dicts, saved as a JSON list so pending uploads survive a
+    restart.  The file is replaced atomically, so a crash while saving
+    leaves the previous queue intact.  Extracts waiting to be sent are
+    kept in spool_dir beside it.
+    """
+
+    # jobs in these states are finished and aren't saved
+    finished = ('done',)
+
+    def __init__(self, filename='abq_uploads.json', path='~'):
+        dirname = os.path.expanduser(path)
+        self.filepath = os.path.join(dirname, filename)
+        self.spool_dir = os.path.join(dirname, 'abq_upload_spool')
+        self.jobs = []
+        self.load()
+
+    def save(self):
+        """Save the unfinished jobs to the file"""
+        jobs = [job for job in self.jobs if job['status'] not in self.finished]
+        dirname = os.path.dirname(self.filepath)
+        fd, tmpname = mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8') as fh:
+                json.dump(jobs, fh)
+            os.replace(tmpname, self.filepath)
+        except Exception:
+            os.remove(tmpname)
+            raise
+
+    def load(self):
+        """Load the jobs from the file"""
+        if not os.path.exists(self.filepath):
+            return
+        with open(self.filepath, 'r', encoding='utf-8') as fh:
+            self.jobs = json.load(fh)
@@ -2,11 +2,25 @@ from urllib.request import urlopen
 from xml.etree import ElementTree
 import requests
 import ftplib as ftp
+import time
+from hashlib import sha256
 from os import path
-from threading import Thread
+from threading import Event, Lock, Thread, local
 from collections import namedtuple
+from .compression import GzipReader
 
 Message = namedtuple('Message', ['status', 'subject', 'body'])
+# a login shared by the sessions a SessionManager hands out
+Login = namedtuple('Login', ['password', 'expires', 'cookies', 'token'])
+# seconds to wait for a server to accept a connection, and then for
+# each read from it, so a stalled server raises an error instead of
+# blocking the thread for good
+request_timeout = (10, 30)
+ftp_timeout = 30
+
+
+class UploadStopped(Exception):
+    """Raised in an upload when its stop event is set"""
 
 
 def get_local_weather(station):
@@ -14,7 +28,7 @@ def get_local_weather(station):
         'http://w1.weather.gov/xml/current_obs/{}.xml'
         .format(station)
     )
-    response = urlopen(url)
+    response = urlopen(url, timeout=request_timeout[1])
 
     xmlroot = ElementTree.fromstring(response.read())
     weatherdata = {
@@ -33,63 +47,317 @@ def get_local_weather(station):
     return weatherdata
 
 
+class SessionManager:
+    """Keep logged in sessions to the ABQ REST API for reuse
+
+    A requests.Session isn't safe to share between threads, so each
+    thread gets its own for each auth URL and user name, and uploads
+    it makes one after another share its pooled keep-alive
+    connections.  The login itself is shared: it is made once, by
+    whichever thread first needs it, and copied into each session.
+    The API's login is kept as the cookies it sets, or as a bearer
+    token if it returns one in 'token'.  A login is renewed once it
+    is older than the API's 'expires_in', or max_age seconds if it
+    doesn't give a usable one, and when renew() is called after a
+    request is refused with a 401.
+    """
+
+    max_age = 30 * 60
+    timeout = request_timeout
+
+    def __init__(self):
+        # (auth_url, username) -> the current Login
+        self._logins = {}
+        # every session handed out, for close()
+        self._sessions = []
+        self._lock = Lock()
+        self._local = local()
+
+    def _get_session(self, key):
+        """Return the calling thread's session for key"""
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        session = sessions.get(key)
+        if session is None:
+            session = sessions[key] = requests.Session()
+            session.abq_login = None
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def get(self, auth_url, username, password):
+        """Return a logged in session, logging in if need be"""
+        key = (auth_url, username)
+        session = self._get_session(key)
+        with self._lock:
+            login = self._logins.get(key)
+            if (login is None or login.password != password or
+                    time.monotonic() >= login.expires):
+                login = self._login(session, auth_url, username, password)
+                self._logins[key] = login
+        if session.abq_login is not login:
+            session.cookies.update(login.cookies)
+            if login.token is None:
+                session.headers.pop('Authorization', None)
+            else:
+                session.headers['Authorization'] = 'Bearer {}'.format(
+                    login.token)
+            session.abq_login = login
+        return session
+
+    def renew(self, auth_url, username, password):
+        """Log in again, as when the API has dropped the login
+
+        If another thread has already renewed the login the calling
+        thread's session was using, that login is used instead.
+        """
+        key = (auth_url, username)
+        session = self._get_session(key)
+        with self._lock:
+            login = self._logins.get(key)
+            if login is not None and login is session.abq_login:
+                del self._logins[key]
+        return self.get(auth_url, username, password)
+
+    def _login(self, session, auth_url, username, password):
+        """Log in with session and return the Login"""
+        session.headers.pop('Authorization', None)
+        session.abq_login = None
+        response = session.post(
+            auth_url,
+            data={'username': username, 'password': password},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        try:
+            login = response.json()
+        except ValueError:
+            login = {}
+        if not isinstance(login, dict):
+            login = {}
+        try:
+            max_age = int(login.get('expires_in', self.max_age))
+        except (TypeError, ValueError):
+            max_age = self.max_age
+        return Login(
+            password, time.monotonic() + max_age,
+            response.cookies, login.get('token'))
+
+    def close(self):
+        """Close every session and its connections"""
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+            self._logins.clear()
+            # threads get new sessions from now on
+            self._local = local()
+
+
+# shared by uploads that aren't given a SessionManager
+shared_sessions = SessionManager()
+
+
 class CorporateRestUploader(Thread):
 
     def __init__(self, filepath, upload_url, auth_url,
-                 username, password):
+                 username, password, sessions=None):
         self.filepath = filepath
         self.upload_url = upload_url
         self.auth_url = auth_url
         self.username = username
         self.password = password
+        self.sessions = sessions or shared_sessions
         super().__init__()
 
     def run(self, *args, **kwargs):
-        session = requests.session()
-        response = session.post(
-            self.auth_url,
-            data={'username': self.username,
-                  'password': self.password}
-        )
-        response.raise_for_status()
+        session = self.sessions.get(
+            self.auth_url, self.username, self.password)
         files = {'file': open(self.filepath, 'rb')}
         response = session.put(
             self.upload_url,
-            files=files
+            files=files,
+            timeout=request_timeout
         )
         files['file'].close()
         response.raise_for_status()
 
 
 class CorporateRestUploaderWithQueue(Thread):
+    """Upload a file to the ABQ REST API in chunks, reporting on a queue
+
+    The upload is started by POSTing the file name and size to
+    upload_url, which returns a resume token.  The file is then read
+    chunk_size bytes at a time and each chunk is PUT to
+    upload_url/token with a Content-Range header and the chunk's
+    SHA-256 in X-Chunk-SHA256.  The server replies with the number of
+    bytes it holds, or with 409 and that number if the range doesn't
+    follow on from it.  A GET of upload_url/token returns the same,
+    so an upload can be resumed by passing its token.
+
+    With compress, the start request offers gzip in 'encodings'.  If
+    the server accepts it (by returning 'encoding': 'gzip' with the
+    token or offset), the file is compressed as it is sent, each
+    chunk carries Content-Encoding: gzip, and the total in
+    Content-Range is '*' until the last chunk.
+
+    Connection errors, timeouts, server errors and checksum failures
+    are retried with exponential backoff.  Each request gives up after
+    timeout, a (connect, read) pair of seconds.
+
+    If a manifest file is given it is uploaded the same way once the
+    file itself is complete.  tokens maps each file path to the token
+    of its upload.
+
+    Logged in sessions come from a SessionManager, so uploads reuse
+    its connections and login.  A 401 renews the login and the
+    request is sent again.
+
+    Setting the stop event makes the upload raise UploadStopped before
+    its next request, cutting short any backoff it is waiting out.
+    """
+
+    chunk_size = 1024 * 1024
+    max_retries = 5
+    # seconds before the first retry; doubled for each retry after
+    backoff = 1
+    max_backoff = 60
+    # 422 means the server's checksum of a chunk didn't match ours
+    retry_statuses = (422, 500, 502, 503, 504)
+    timeout = request_timeout
 
     def __init__(self, filepath, upload_url, auth_url,
-                 username, password, queue):
+                 username, password, queue, token=None, compress=True,
+                 manifest=None, sessions=None, stop=None):
         self.filepath = filepath
+        self.manifest = manifest
         self.upload_url = upload_url
         self.auth_url = auth_url
         self.username = username
         self.password = password
         self.queue = queue
+        self.tokens = {filepath: token}
+        self.compress = compress
+        self.sessions = sessions or shared_sessions
+        self.stop = stop or Event()
         super().__init__()
 
+    @property
+    def token(self):
+        """The token of the data file's upload"""
+        return self.tokens.get(self.filepath)
+
     def _putmessage(self, status, subject, body):
         self.queue.put(Message(status, subject, body))
 
+    def _send(self, session, method, url, **kwargs):
+        """Make a request, retrying failures with exponential backoff"""
+        kwargs.setdefault('timeout', self.timeout)
+        failures = 0
+        renewed = False
+        while True:
+            if self.stop.is_set():
+                raise UploadStopped('Upload stopped')
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code == 401 and not renewed:
+                    # the login has expired
+                    renewed = True
+                    self.sessions.renew(
+                        self.auth_url, self.username, self.password)
+                    continue
+                if response.status_code not in self.retry_statuses:
+                    return response
+                error = requests.HTTPError(
+                    '{} {}'.format(response.status_code, response.reason),
+                    response=response)
+            failures += 1
+            if failures > self.max_retries:
+                raise error
+            delay = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+            self._putmessage(
+                'info', 'Retrying',
+                '{}; retrying in {}s'.format(error, delay))
+            self.stop.wait(delay)
+
+    def _chunk_url(self, filepath):
+        return '{}/{}'.format(
+            self.upload_url.rstrip('/'), self.tokens[filepath])
+
+    def _start_upload(self, session, filepath, size):
+        """Get the offset and encoding to upload filepath with
+
+        A new upload is started unless its token is still valid.
+        """
+        if self.tokens.get(filepath) is not None:
+            response = self._send(session, 'GET', self._chunk_url(filepath))
+            if response.status_code != 404:
+                response.raise_for_status()
+                status = response.json()
+                return status['offset'], status.get('encoding', 'identity')
+        data = {'filename': path.basename(filepath), 'size': size}
+        if self.compress:
+            data['encodings'] = 'gzip'
+        response = self._send(session, 'POST', self.upload_url, data=data)
+        response.raise_for_status()
+        status = response.json()
+        self.tokens[filepath] = status['token']
+        return 0, status.get('encoding', 'identity')
+
+    def upload(self, session):
+        """Send the file, then the manifest if there is one"""
+        self.upload_file(session, self.filepath)
+        if self.manifest is not None:
+            self.upload_file(session, self.manifest)
+
+    def upload_file(self, session, filepath):
+        """Send filepath, returning once the server holds all of it"""
+        size = path.getsize(filepath)
+        offset, encoding = self._start_upload(session, filepath, size)
+        with open(filepath, 'rb') as fh:
+            source = GzipReader(fh) if encoding == 'gzip' else fh
+            while True:
+                source.seek(offset)
+                chunk = source.read(self.chunk_size)
+                if not chunk:
+                    break
+                headers = {'X-Chunk-SHA256': sha256(chunk).hexdigest()}
+                if source is fh:
+                    total = size
+                else:
+                    total = source.tell() if source.eof else '*'
+                    headers['Content-Encoding'] = encoding
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                    offset, offset + len(chunk) - 1, total)
+                response = self._send(
+                    session, 'PUT', self._chunk_url(filepath),
+                    data=chunk, headers=headers)
+                # 409 means the server already had some of this chunk
+                if response.status_code != 409:
+                    response.raise_for_status()
+                offset = response.json()['offset']
+                # report progress through the file itself
+                uploaded = offset if source is fh else fh.tell()
+                self._putmessage(
+                    'info', 'Uploading',
+                    '{} of {} bytes uploaded'.format(uploaded, size))
+
+    def get_session(self):
+        """Return a logged in session from the SessionManager"""
+        return self.sessions.get(self.auth_url, self.username, self.password)
+
     def run(self, *args, **kwargs):
-        session = requests.session()
         self._putmessage(
             'info', 'Authenticating',
             'Authenticating to {} as {}'.format(
                 self.auth_url, self.username))
 
         try:
-            response = session.post(
-                self.auth_url,
-                data={'username': self.username,
-                      'password': self.password}
-            )
-            response.raise_for_status()
+            session = self.get_session()
         except Exception as e:
             self._putmessage(
                 'error', 'Authentication Failure', str(e))
@@ -97,16 +365,10 @@ class CorporateRestUploaderWithQueue(Thread):
         self._putmessage(
             'info', 'Starting Upload',
             'Starting upload of {} to {}'.format(
-                self.upload_url, self.filepath
+                self.filepath, self.upload_url
             ))
-        files = {'file': open(self.filepath, 'rb')}
         try:
-            response = session.put(
-                self.upload_url,
-                files=files
-            )
-            files['file'].close()
-            response.raise_for_status()
+            self.upload(session)
         except Exception as e:
             self._putmessage(
                 'error', "Upload Failure", str(e))
@@ -118,9 +380,21 @@ class CorporateRestUploaderWithQueue(Thread):
 
 def upload_to_corporate_ftp(
         filepath, ftp_host,
-        ftp_port, ftp_user, ftp_pass):
+        ftp_port, ftp_user, ftp_pass, compress=True, manifest=None,
+        stop=None, timeout=ftp_timeout):
+    """Upload filepath by FTP, gzipped as filename.gz if compress is set
 
-    with ftp.FTP() as ftp_cx:
+    A manifest file is stored as is, after the file it describes.
+    If the stop event is set, UploadStopped is raised after the block
+    being sent.  A server that doesn't respond for timeout seconds
+    raises socket.timeout.
+    """
+
+    def check_stop(block):
+        if stop is not None and stop.is_set():
+            raise UploadStopped('Upload stopped')
+
+    with ftp.FTP(timeout=timeout) as ftp_cx:
         # connect and login
         ftp_cx.connect(ftp_host, ftp_port)
         ftp_cx.login(ftp_user, ftp_pass)
@@ -129,25 +403,31 @@ def upload_to_corporate_ftp(
         filename = path.basename(filepath)
 
         with open(filepath, 'rb') as fh:
-            ftp_cx.storbinary('STOR {}'.format(filename), fh)
+            if compress:
+                filename += '.gz'
+                fh = GzipReader(fh)
+            ftp_cx.storbinary(
+                'STOR {}'.format(filename), fh, callback=check_stop)
+
+        if manifest is not None:
+            with open(manifest, 'rb') as fh:
+                ftp_cx.storbinary(
+                    'STOR {}'.format(path.basename(manifest)), fh,
+                    callback=check_stop)
 
 
 def upload_to_corporate_rest(
         filepath, upload_url, auth_url,
-        username, password):
+        username, password, sessions=None):
 
-    session = requests.session()
-
-    response = session.post(
-        auth_url,
-        data={'username': username, 'password': password}
-    )
-    response.raise_for_status()
+    session = (sessions or shared_sessions).get(
+        auth_url, username, password)
 
     files = {'file': open(filepath, 'rb')}
     response = session.put(
         upload_url,
-        files=files
+        files=files,
+        timeout=request_timeout
     )
     files['file'].close()
     response.raise_for_status()
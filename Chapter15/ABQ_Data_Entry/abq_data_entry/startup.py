@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+
+def profile_imports(module='abq_data_entry.application'):
+    """Import module in a fresh interpreter and time every import
+
+    Uses python's -X importtime option.  Returns a list of
+    (cumulative, self, module name) tuples, with times in
+    microseconds, slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_time, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:
+            # the column header line
+            continue
+        name = fields[2].strip()
+        # the module named on the command line is listed twice;
+        # the first entry is its actual import
+        if name not in times:
+            times[name] = (cumulative, self_time, name)
+    return sorted(times.values(), reverse=True)
+
+
+def print_import_profile(limit=30):
+    """Print the slowest imports made when the application starts"""
+    times = profile_imports()
+    total = times[0][0] if times else 0
+    print('{:>12} {:>12}  module'.format('cumulative', 'self'))
+    for cumulative, self_time, name in times[:limit]:
+        print('{:>10.1f}ms {:>10.1f}ms  {}'.format(
+            cumulative / 1000, self_time / 1000, name))
+    print('Application imports took {:.1f}ms'.format(total / 1000))
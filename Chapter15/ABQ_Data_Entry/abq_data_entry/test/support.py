@@ -1,5 +1,14 @@
+import os
 import tkinter as tk
-from unittest import TestCase
+from importlib.util import module_from_spec, spec_from_file_location
+from threading import Event, Thread
+from unittest import TestCase, skipUnless
+
+# Timings depend on the machine and how busy it is, so tests that
+# check them only run when ABQ_BENCHMARK is set
+benchmark = skipUnless(
+    os.environ.get('ABQ_BENCHMARK'), 'set ABQ_BENCHMARK=1 to run benchmarks')
+
 
 class TkTestCase(TestCase):
     """A test case designed for Tkinter widgets and views"""
@@ -34,3 +43,84 @@ class TkTestCase(TestCase):
         widget.event_generate("<ButtonPress-{}>".format(button), x=x, y=y)
         widget.event_generate("<ButtonRelease-{}>".format(button), x=x, y=y)
         self.root.update()
+
+
+def _load_sample_server():
+    """Import the Chapter12 demo server, which the test server extends"""
+    filename = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+        os.pardir, os.pardir, 'Chapter12', 'sample_http_server.py')
+    spec = spec_from_file_location('sample_http_server', filename)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+sample_http_server = _load_sample_server()
+
+
+class UploadHandler(sample_http_server.TestHandler):
+    """The sample REST API handler, with simulated failures
+
+    The upload protocol itself is implemented by TestHandler in
+    Chapter12/sample_http_server.py.  This records each request on
+    the server and fails chunk uploads as the server is set up to.
+    """
+
+    def _report(self, message):
+        pass
+
+    def log_message(self, *args):
+        pass
+
+    def _request_received(self):
+        self.server.requests.append((self.command, self.path))
+
+    def _receive_chunk(self, upload, chunk):
+        if self.server.stall_puts:
+            # stop responding, until the server is stopped
+            self.server.stall_puts -= 1
+            self.server.stopped.wait(10)
+            self.close_connection = True
+            return
+        if self.server.drop_puts:
+            # hang up without a response
+            self.server.drop_puts -= 1
+            self.close_connection = True
+            return
+        if self.server.bad_checksums:
+            self.server.bad_checksums -= 1
+            self._send_json(422, {})
+            return
+        super()._receive_chunk(upload, chunk)
+
+
+class UploadServer(sample_http_server.UploadServer):
+    """Runs UploadHandler on a local port in a background thread
+
+    Set drop_puts or bad_checksums to make that many chunk uploads
+    fail by disconnecting or by reporting a checksum mismatch, or
+    stall_puts to make them hang without a response until stop().
+    requests lists the (method, path) of each request, and
+    connections counts the connections made to the server.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), UploadHandler)
+        self.requests = []
+        self.connections = 0
+        self.drop_puts = 0
+        self.stall_puts = 0
+        self.bad_checksums = 0
+        self.stopped = Event()
+        self.url = 'http://127.0.0.1:{}'.format(self.server_port)
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
@@ -1,6 +1,13 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from tempfile import TemporaryDirectory
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from .. import application
+from .. import models
 
 
 class TestApplication(TestCase):
@@ -39,14 +46,17 @@ class TestApplication(TestCase):
         with \
             patch('abq_data_entry.application.m.SQLModel') as sqlmodel,\
             patch('abq_data_entry.application.m.SettingsModel') as settingsmodel,\
+            patch('abq_data_entry.application.m.UploadQueueModel') as queue,\
             patch('abq_data_entry.application.v.DataRecordForm'),\
             patch('abq_data_entry.application.v.RecordList'),\
             patch('abq_data_entry.application.get_main_menu_for_os'),\
-            patch('abq_data_entry.application.v.DBLoginDialog') as logindlg\
+            patch('abq_data_entry.application.v.LoginDialog') as logindlg\
         :
 
             settingsmodel().variables = self.settings
-            sqlmodel().get_all_records.return_value = self.records
+            queue().jobs = []
+            sqlmodel().get_record_count.return_value = len(self.records)
+            sqlmodel().get_records.return_value = self.records
             logindlg().result = ('user', 'password')
             self.app = application.Application()
 
@@ -59,18 +69,86 @@ class TestApplication(TestCase):
         self.app.update()
         self.app.recordlist.tkraise.assert_called()
 
+    def wait_for_tasks(self):
+        """Drain the dispatcher until the app's model calls finish"""
+        deadline = time.monotonic() + 5
+        while self.app.model_tasks.busy and time.monotonic() < deadline:
+            time.sleep(.01)
+            self.app.dispatcher.dispatch()
+
     def test_populate_recordlist(self):
         # test correct functions
+        self.app.data_model.get_record_count.return_value = 2
+        self.app.data_model.get_records.return_value = self.records
         self.app.populate_recordlist()
-        self.app.data_model.get_all_records.assert_called()
-        self.app.recordlist.populate.assert_called_with(self.records)
+        self.wait_for_tasks()
+        self.app.data_model.get_record_count.assert_called()
+        rows = self.app.recordlist.populate.call_args[0][0]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(list(rows), self.records)
 
         # test exceptions
 
-        self.app.data_model.get_all_records.side_effect = Exception('Test message')
+        self.app.data_model.get_record_count.side_effect = Exception(
+            'Test message')
         with patch('abq_data_entry.application.messagebox'):
             self.app.populate_recordlist()
+            self.wait_for_tasks()
             application.messagebox.showerror.assert_called_with(
                 title='Error', message='Problem reading file',
                 detail='Test message'
             )
+
+
+class TestCSVExtract(TestCase):
+
+    def test_extract_from_csv(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('data.csv', tmpdir)
+            record = dict.fromkeys(model.fields, '1')
+            model.save_records([record] * 3)
+            size = os.path.getsize(model.filename)
+            spool_dir = os.path.join(tmpdir, 'spool')
+            # an absolute path, as File->Select gives
+            csvfile, manifest, until = (
+                application.Application._create_csv_extract(
+                    model, model.filename, spool_dir, ['rest']))
+            self.assertEqual(os.path.basename(csvfile), 'data.csv')
+            self.assertEqual(
+                os.path.dirname(os.path.dirname(csvfile)), spool_dir)
+            # the source file is left alone
+            self.assertEqual(os.path.getsize(model.filename), size)
+            self.assertEqual(
+                len(models.CSVModel(csvfile).get_all_records()), 3)
+
+    def test_same_day_deltas(self):
+        record = dict.fromkeys(models.CSVModel.fields, '1')
+        morning = datetime(2018, 6, 1, 9, 0)
+        noon = datetime(2018, 6, 1, 12, 0)
+        model = Mock(filename=None)
+        model.get_upload_window.side_effect = [
+            (None, morning), (morning, noon)]
+        model.iter_changes.side_effect = lambda since, until: (
+            r for r in [record])
+        with TemporaryDirectory() as tmpdir:
+            spool_dir = os.path.join(tmpdir, 'spool')
+            destination = os.path.join(tmpdir, 'destination')
+            os.makedirs(destination)
+            for _ in range(2):
+                csvfile, manifest, until = (
+                    application.Application._create_csv_extract(
+                        model, 'abq_data_record_2018-06-01.csv',
+                        spool_dir, ['rest']))
+                with open(manifest, encoding='utf-8') as fh:
+                    details = json.load(fh)
+                # stored under the names the uploads send them as
+                for name in (details['file'], details['gzip_file']):
+                    shutil.copy(csvfile, os.path.join(destination, name))
+                shutil.copy(manifest, destination)
+            self.assertEqual(until, noon.isoformat())
+            # the second extract doesn't replace the first
+            self.assertEqual(len(os.listdir(destination)), 6)
+            self.assertIn(
+                'abq_data_record_2018-06-01_'
+                '20180601T090000000000-20180601T120000000000.csv',
+                os.listdir(destination))
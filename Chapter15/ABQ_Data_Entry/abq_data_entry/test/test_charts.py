@@ -0,0 +1,62 @@
+import time
+from decimal import Decimal
+from unittest import TestCase
+import numpy as np
+from .. import charts
+from .support import benchmark
+
+
+class TestCharts(TestCase):
+
+    def test_growth_series(self):
+        records = [
+            {'day': 0, 'lab_id': 'A', 'avg_height': Decimal('1.5')},
+            {'day': 0, 'lab_id': 'B', 'avg_height': Decimal('2.0')},
+            {'day': 1, 'lab_id': 'A', 'avg_height': Decimal('3.5')},
+            {'day': 2, 'lab_id': 'A', 'avg_height': Decimal('4.0')}
+        ]
+        max_x, max_y, series = charts.growth_series(records)
+        self.assertEqual((max_x, max_y), (2, 4.0))
+        self.assertEqual(set(series), {'A', 'B'})
+        days, heights = series['A']
+        self.assertEqual(days.tolist(), [0, 1, 2])
+        self.assertEqual(heights.tolist(), [1.5, 3.5, 4.0])
+        self.assertEqual(charts.growth_series([]), (0, 0, {}))
+
+    def test_yield_series(self):
+        records = [
+            {'seed_sample': 'AXM478', 'avg_humidity': Decimal('20'),
+             'avg_temperature': Decimal('25'), 'yield': 10},
+            {'seed_sample': 'AXM477', 'avg_humidity': None,
+             'avg_temperature': Decimal('21'), 'yield': 3}
+        ]
+        series = charts.yield_series(records)
+        humidity, temperature, fruit = series['AXM477']
+        self.assertNotEqual(humidity[0], humidity[0])  # NaN
+        self.assertEqual(temperature.tolist(), [21.0])
+        self.assertEqual(fruit.tolist(), [3.0])
+        self.assertEqual(series['AXM478'][2].tolist(), [10.0])
+
+    def test_lttb(self):
+        x = np.arange(10)
+        y = np.array([0, 0, 9, 0, 0, 0, -9, 0, 0, 0])
+        dx, dy = charts.lttb(x, y, 4)
+        # the ends and both peaks are kept
+        self.assertEqual(dx.tolist(), [0, 2, 6, 9])
+        self.assertEqual(dy.tolist(), [0, 9, -9, 0])
+        # short series are left alone
+        dx, dy = charts.lttb(x, y, 20)
+        self.assertEqual(len(dx), 10)
+
+    # seconds allowed to reduce a million points for a 600px chart
+    lttb_budget = 0.5
+
+    @benchmark
+    def test_lttb_budget(self):
+        x = np.arange(1000000)
+        y = np.sin(x / 1000)
+        start = time.perf_counter()
+        dx, dy = charts.lttb(x, y, 1200)
+        self.assertLess(time.perf_counter() - start, self.lttb_budget)
+        self.assertEqual(len(dx), 1200)
+        self.assertTrue((np.diff(dx) > 0).all())
@@ -0,0 +1,29 @@
+import gzip
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from .. import compression
+
+
+class TestGzipReader(TestCase):
+
+    def test_read(self):
+        data = b'ABQ Agrilabs ' * 10000
+        with TemporaryDirectory() as tempdir:
+            filepath = os.path.join(tempdir, 'test.csv')
+            with open(filepath, 'wb') as fh:
+                fh.write(data)
+            with open(filepath, 'rb') as fh:
+                reader = compression.GzipReader(fh)
+                reader.block_size = 1000
+                compressed = reader.read(10)
+                while not reader.eof:
+                    compressed += reader.read(10)
+                self.assertEqual(reader.read(10), b'')
+                self.assertEqual(gzip.decompress(compressed), data)
+
+                # seeking back gives the same bytes again
+                reader.seek(5)
+                self.assertEqual(reader.read(20), compressed[5:25])
+                reader.seek(30)
+                self.assertEqual(reader.read(), compressed[30:])
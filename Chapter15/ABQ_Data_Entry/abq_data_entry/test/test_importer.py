@@ -0,0 +1,71 @@
+from .. import importer
+from .. import models
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+
+class TestImporter(TestCase):
+
+    record = {
+        "Date": '2018-07-01', "Time": '12:00',
+        "Technician": 'J Simms', "Lab": 'E',
+        "Plot": '17', "Seed sample": 'AXM477',
+        "Humidity": '10', "Light": '99',
+        "Temperature": '20', "Equipment Fault": False,
+        "Plants": '10', "Blossoms": '200',
+        "Fruit": '250', "Min Height": '40',
+        "Max Height": '50', "Median Height": '45',
+        "Notes": ''
+    }
+
+    def test_validate_record(self):
+        fields = models.CSVModel.fields
+        self.assertEqual(importer.validate_record(fields, self.record), {})
+
+        bad = dict(self.record, Date='2018-13-01', Lab='Z',
+                   Humidity='100', Plants='abc', Fruit='')
+        errors = importer.validate_record(fields, bad)
+        self.assertEqual(
+            set(errors), {'Date', 'Lab', 'Humidity', 'Plants', 'Fruit'})
+
+        # the median height must lie between the others
+        bad = dict(self.record, **{'Median Height': '55'})
+        errors = importer.validate_record(fields, bad)
+        self.assertEqual(set(errors), {'Median Height'})
+
+    def test_run(self):
+        sql_model = MagicMock()
+        sql_model.query.return_value = [{'id': 4291, 'name': 'J Simms'}]
+        cursor = sql_model.connection().__enter__().cursor()
+        progress = MagicMock()
+
+        with TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'data.csv')
+            csv_model = models.CSVModel(filename)
+            csv_model.save_records([
+                self.record,
+                dict(self.record, Plot='18'),
+                dict(self.record, Technician='Nobody')
+            ])
+            csv_importer = importer.CSVImporter(sql_model, filename)
+            csv_importer.chunk_size = 2
+            report = csv_importer.run(progress)
+
+        self.assertEqual(report.rows, 3)
+        self.assertEqual(report.rejected, 1)
+        self.assertEqual(csv_importer.rejected[0][0], 2)
+        self.assertIn('Technician', csv_importer.rejected[0][1])
+        progress.assert_called_with(3)
+        # two chunks, two tables each
+        self.assertEqual(cursor.copy_expert.call_count, 4)
+        # technicians are looked up once
+        sql_model.query.assert_called_once()
+        # staged rows keep their row number, so the last one wins
+        query, buffer = cursor.copy_expert.call_args_list[1][0]
+        self.assertIn('rownum', query)
+        self.assertTrue(buffer.getvalue().endswith(',1\r\n'))
+        merges = [args[0][0] for args in cursor.execute.call_args_list[1:]]
+        for merge in merges:
+            self.assertIn('rownum DESC', merge)
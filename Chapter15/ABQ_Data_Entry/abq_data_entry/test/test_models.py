@@ -1,6 +1,15 @@
-from .. import models
+from .. import compression, models
+import json
+import os
+import time
+import tracemalloc
+from contextlib import closing
+from hashlib import sha256
+from tempfile import TemporaryDirectory
+from threading import Lock, RLock, Thread
 from unittest import TestCase
-from unittest.mock import mock_open, patch, call
+from unittest.mock import Mock, mock_open, patch, call
+from .support import benchmark
 
 
 class TestCSVModel(TestCase):
@@ -24,6 +33,9 @@ class TestCSVModel(TestCase):
 
         self.model1 = models.CSVModel('file1')
         self.model2 = models.CSVModel('file2')
+        # the mocked files don't exist to be locked
+        self.model1._lock = RLock()
+        self.model2._lock = RLock()
 
     @patch('abq_data_entry.models.os.path.exists')
     def test_get_all_records(self, mock_exists):
@@ -57,21 +69,59 @@ class TestCSVModel(TestCase):
 
         self.file1_open.assert_called_with('file1', 'r', encoding='utf-8')
 
-    @patch('abq_data_entry.models.os.path.exists')
-    def test_get_record(self, mock_exists):
-        mock_exists.return_value = True
+    def test_get_record(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            with open(model.filename, 'w', encoding='utf-8') as fh:
+                fh.write(self.file1_open.return_value.read())
 
-        with patch(
-                'abq_data_entry.models.open',
-                self.file1_open
-        ):
-            record0 = self.model1.get_record(0)
-            record1 = self.model1.get_record(1)
+            record0 = model.get_record(0)
+            record1 = model.get_record(1)
+            self.assertTrue(os.path.exists(model.index_filename))
+            with self.assertRaises(IndexError):
+                model.get_record(2)
 
         self.assertNotEqual(record0, record1)
         self.assertEqual(record0['Date'], '2018-06-01')
         self.assertEqual(record1['Plot'], '3')
         self.assertEqual(record0['Median Height'], '5.09')
+        self.assertFalse(record0['Equipment Fault'])
+
+    def test_row_index(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            record = dict.fromkeys(model.fields, '1')
+            record['Notes'] = 'Multi\nline "quoted"\nnote'
+            for plot in ('1', '2', '3'):
+                model.save_record(dict(record, Plot=plot))
+            self.assertEqual(model.get_record(1)['Plot'], '2')
+
+            # appends keep the index current, adding to the sidecar
+            with patch.object(
+                model, '_write_index', wraps=model._write_index
+            ) as write_index:
+                model.save_record(dict(record, Plot='4'))
+            write_index.assert_called_once_with(3)
+            self.assertEqual(len(model.get_row_offsets()), 4)
+            self.assertEqual(model.get_record(3)['Notes'], record['Notes'])
+
+            # a new model reuses the sidecar index
+            model2 = models.CSVModel('file1', tmpdir)
+            with patch.object(model2, '_build_index') as build_index:
+                self.assertEqual(model2.get_record(2)['Plot'], '3')
+            build_index.assert_not_called()
+
+            # outside changes to the file trigger a rebuild
+            with open(model.filename, 'a', encoding='utf-8') as fh:
+                fh.write(','.join(['5'] * len(model.fields)) + '\n')
+            self.assertEqual(model.get_record(4)['Plot'], '5')
+
+            # blank lines aren't rows, to DictReader or the index
+            with open(model.filename, 'a', encoding='utf-8') as fh:
+                fh.write('\n\n' + ','.join(['6'] * len(model.fields)) + '\n')
+            self.assertEqual(len(model.get_row_offsets()), 6)
+            self.assertEqual(model.get_record(5)['Plot'], '6')
+            self.assertEqual(len(model.get_all_records()), 6)
 
     @patch('abq_data_entry.models.os.path.exists')
     def test_save_record(self, mock_exists):
@@ -96,30 +146,18 @@ class TestCSVModel(TestCase):
         mock_exists.return_value = True
 
         # test insert
-        with patch('abq_data_entry.models.open', self.file2_open):
-            self.model2.save_record(record, None)
+        with patch('abq_data_entry.models.open', self.file2_open), \
+                patch.object(self.model2, 'get_record_count', return_value=5):
+            result = self.model2.save_record(record, None)
             self.file2_open.assert_called_with('file2', 'a', encoding='utf-8')
             file2_handle = self.file2_open()
             file2_handle.write.assert_called_with(record_as_csv)
-
-        # test update
-        with patch('abq_data_entry.models.open', self.file1_open):
-            self.model1.save_record(record, 1)
-            self.file1_open.assert_called_with('file1', 'w', encoding='utf-8')
-            file1_handle = self.file1_open()
-            file1_handle.write.assert_has_calls([
-                call('Date,Time,Technician,Lab,Plot,Seed sample,Humidity,Light,'
-                     'Temperature,Equipment Fault,Plants,Blossoms,Fruit,'
-                     'Min Height,Max Height,Median Height,Notes\r\n'),
-                call('2018-06-01,8:00,J Simms,A,2,AX478,24.47,1.01,21.44,False,'
-                     '14,27,1,2.35,9.2,5.09,\r\n'),
-                call('2018-07-01,12:00,Test Technician,E,17,test sample,10,99,'
-                     '20,False,10,200,250,40,50,55,"Test Note\r\nTest Note\r\n"'
-                     '\r\n')])
+        self.assertEqual(result, (record, 'insert', 4))
 
         # test new file
         mock_exists.return_value = False
-        with patch('abq_data_entry.models.open', self.file2_open):
+        with patch('abq_data_entry.models.open', self.file2_open), \
+                patch.object(self.model2, 'get_record_count', return_value=1):
             self.model2.save_record(record, None)
             file2_handle = self.file2_open()
             file2_handle.write.assert_has_calls([
@@ -130,3 +168,504 @@ class TestCSVModel(TestCase):
             ])
             with self.assertRaises(IndexError):
                 self.model2.save_record(record, 2)
+
+    def test_update_journal(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            with open(model.filename, 'w', encoding='utf-8') as fh:
+                fh.write(self.file1_open.return_value.read())
+            with open(model.filename, 'rb') as fh:
+                original = fh.read()
+            record = dict(model.get_record(0), Plot='17', Notes='Updated')
+
+            # updates go to the journal, leaving the file alone
+            self.assertEqual(
+                model.save_record(record, 1), (record, 'update', 1))
+            self.assertTrue(os.path.exists(model.journal_filename))
+            with open(model.filename, 'rb') as fh:
+                self.assertEqual(fh.read(), original)
+            self.assertEqual(model.get_record(1)['Plot'], '17')
+            self.assertEqual(model.get_all_records()[1]['Notes'], 'Updated')
+            self.assertEqual(model.get_record(0)['Plot'], '2')
+            with self.assertRaises(IndexError):
+                model.save_record(record, 2)
+
+            # compaction folds the journal into the file
+            os.chmod(model.filename, 0o644)
+            self.assertTrue(model.compact())
+            self.assertEqual(os.stat(model.filename).st_mode & 0o777, 0o644)
+            self.assertFalse(os.path.exists(model.journal_filename))
+            self.assertFalse(os.path.exists(model.old_journal_filename))
+            records = models.CSVModel('file1', tmpdir).get_all_records()
+            self.assertEqual(len(records), 2)
+            self.assertEqual(records[1]['Plot'], '17')
+            self.assertEqual(model.get_record(1)['Notes'], 'Updated')
+            self.assertFalse(model.compact())
+
+    def test_torn_journal(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            with open(model.filename, 'w', encoding='utf-8') as fh:
+                fh.write(self.file1_open.return_value.read())
+            record = model.get_record(0)
+            model.save_record(dict(record, Notes='First'), 0)
+            # a crash part way through writing the next update
+            with open(model.journal_filename, 'a', encoding='utf-8') as fh:
+                fh.write('1,2018-06-01,8:00,J Sim')
+
+            other = models.CSVModel('file1', tmpdir)
+            self.assertEqual(other.get_record(0)['Notes'], 'First')
+            self.assertEqual(other.get_record(1)['Plot'], '3')
+            # the torn row is dropped before the next update is added
+            other.save_record(dict(record, Notes='Second'), 1)
+            # the lock file isn't executable
+            mode = os.stat(model.filename + model.lock_suffix).st_mode
+            self.assertFalse(mode & 0o111)
+            rows, end = model._read_journal(model.journal_filename)
+            self.assertEqual([rownum for rownum, record in rows], [0, 1])
+            self.assertEqual(end, os.path.getsize(model.journal_filename))
+
+            # only the rows added since are read
+            with patch.object(
+                model, '_read_journal', wraps=model._read_journal
+            ) as read_journal:
+                self.assertEqual(model.get_record(1)['Notes'], 'Second')
+            read_journal.assert_called_once()
+            self.assertGreater(read_journal.call_args[0][1], 0)
+
+    def test_compact_error(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            record = dict.fromkeys(model.fields, '1')
+            model.save_records([record] * 2)
+            model.save_record(dict(record, Notes='Updated'), 1)
+            with patch('abq_data_entry.models.mkstemp',
+                       side_effect=OSError('No space left on device')):
+                with self.assertRaises(OSError):
+                    model.compact()
+            # a failed compaction doesn't stop later ones
+            self.assertTrue(model.compact())
+            self.assertEqual(model.get_record(1)['Notes'], 'Updated')
+
+    def test_read_during_compact(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            record = dict.fromkeys(model.fields, '1')
+            model.save_records(
+                dict(record, Plot=str(plot)) for plot in range(10))
+            # a longer row, so compacting moves the rows after it
+            model.save_record(dict(record, Notes='x' * 100), 2)
+            get_row_offsets = model.get_row_offsets
+            compactor = Thread(target=model.compact)
+
+            def compact_while_reading():
+                # compact() calls this too
+                if not compactor.is_alive():
+                    compactor.start()
+                    # give it time to replace the file, if it can
+                    compactor.join(.5)
+                return get_row_offsets()
+
+            with patch.object(
+                    model, 'get_row_offsets', compact_while_reading):
+                records = list(model.iter_records(start=7, limit=1))
+            compactor.join(5)
+            self.assertFalse(os.path.exists(model.journal_filename))
+            self.assertEqual([r['Plot'] for r in records], ['7'])
+            self.assertEqual(model.get_record(7)['Plot'], '7')
+
+    def test_save_records(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            record = dict.fromkeys(model.fields, '1')
+            written = model.save_records(
+                dict(record, Plot=str(plot)) for plot in range(1, 4))
+            self.assertEqual(written, 3)
+            model.get_record(0)
+            model.save_records([dict(record, Plot='4')])
+            records = model.get_all_records()
+            self.assertEqual(
+                [r['Plot'] for r in records], ['1', '2', '3', '4'])
+            self.assertEqual(len(model.get_row_offsets()), 4)
+
+    def iter_peak(self, model):
+        """Return the peak memory allocated while iterating model"""
+        tracemalloc.start()
+        try:
+            for record in model.iter_records():
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_iter_records_memory(self):
+        with TemporaryDirectory() as tmpdir:
+            record = dict.fromkeys(models.CSVModel.fields, '1')
+            peaks = []
+            for rows in (1000, 50000):
+                model = models.CSVModel('file{}'.format(rows), tmpdir)
+                model.save_records(
+                    dict(record, Plot=str(plot)) for plot in range(rows))
+                peaks.append(self.iter_peak(model))
+        # fifty times the rows takes no more memory to stream
+        small, large = peaks
+        self.assertLess(large, small * 1.5)
+
+    def test_write_manifest(self):
+        with TemporaryDirectory() as tmpdir:
+            model = models.CSVModel('file1', tmpdir)
+            model.save_records([dict.fromkeys(model.fields, '1')])
+            filename = model.write_manifest(records=1, full=True)
+            self.assertEqual(filename, model.filename + '.manifest.json')
+            with open(filename) as fh:
+                manifest = json.load(fh)
+            with open(model.filename, 'rb') as fh:
+                digest = sha256(fh.read()).hexdigest()
+            self.assertEqual(manifest['file'], 'file1')
+            self.assertEqual(manifest['sha256'], digest)
+            self.assertEqual(manifest['size'], os.path.getsize(model.filename))
+            self.assertEqual(manifest['key'], ['Date', 'Time', 'Lab', 'Plot'])
+            self.assertEqual(manifest['records'], 1)
+            # the gzipped file FTP stores is described too
+            with open(model.filename, 'rb') as fh:
+                compressed = compression.GzipReader(fh).read()
+            self.assertEqual(manifest['gzip_file'], 'file1.gz')
+            self.assertEqual(manifest['gzip_size'], len(compressed))
+            self.assertEqual(
+                manifest['gzip_sha256'], sha256(compressed).hexdigest())
+
+
+class TestSQLModel(TestCase):
+
+    def setUp(self):
+        with patch('abq_data_entry.models.ThreadedConnectionPool') as pool:
+            self.connection = pool().getconn()
+            self.connection.closed = 0
+            self.cursor = self.connection.cursor()
+            self.cursor.fetchall.return_value = []
+            self.model = models.SQLModel('host', 'db', 'user', 'pass')
+        self.pool = self.model.pool
+        self.pool.reset_mock()
+        self.connection.reset_mock()
+
+    def test_query(self):
+        self.cursor.fetchall.return_value = [{'id': 'A'}]
+        result = self.model.query('SELECT id FROM labs')
+        self.assertEqual(result, [{'id': 'A'}])
+        self.pool.getconn.assert_called_once()
+        self.connection.commit.assert_called_once()
+        self.pool.putconn.assert_called_with(self.connection, close=False)
+
+    def test_query_error(self):
+        self.cursor.execute.side_effect = models.pg.Error('Test error')
+        with self.assertRaises(models.pg.Error):
+            self.model.query('SELECT id FROM labs')
+        self.connection.rollback.assert_called_once()
+        self.connection.commit.assert_not_called()
+        self.pool.putconn.assert_called_with(self.connection, close=False)
+
+    def connect(self, running, *args, **kwargs):
+        """Stand in for psycopg2.connect in the real connection pool
+
+        Queries on the connections take a moment and record the
+        most that run at once in running.
+        """
+        lock = Lock()
+
+        def execute(query, parameters=None):
+            with lock:
+                running['now'] += 1
+                running['most'] = max(running['most'], running['now'])
+            time.sleep(.01)
+            with lock:
+                running['now'] -= 1
+
+        connection = Mock(closed=0)
+        cursor = connection.cursor.return_value
+        cursor.execute.side_effect = execute
+        cursor.fetchall.return_value = [
+            {'name': 'J Simms', 'id': 'A', 'plot': 1, 'Plot': '1'}]
+        return connection
+
+    def test_concurrent_connections(self):
+        threads = 16
+        for size in (1, 2, 4):
+            running = {'now': 0, 'most': 0}
+            results, errors = [], []
+
+            def get_record():
+                try:
+                    results.append(model.get_record(
+                        '2018-06-01', '8:00', 'A', '1'))
+                except Exception as e:
+                    errors.append(e)
+
+            with patch('psycopg2.pool.psycopg2.connect',
+                       lambda *a, **k: self.connect(running, *a, **k)), \
+                    patch.object(models.SQLModel, 'max_connections', size):
+                model = models.SQLModel('host', 'db', 'user', 'pass')
+                workers = [Thread(target=get_record) for _ in range(threads)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            # the extra threads waited for a connection rather than
+            # getting a PoolError, and no more than size ran at once
+            self.assertEqual(errors, [])
+            self.assertEqual(len(results), threads)
+            self.assertLessEqual(running['most'], size)
+            self.assertEqual(len(model.pool._used), 0)
+            model.close()
+
+    def test_save_record(self):
+        record = {'Date': '2018-07-01', 'Time': '12:00', 'Lab': 'E',
+                  'Plot': 3}
+        self.cursor.fetchone.return_value = {'inserted': True, 'index': 7}
+        self.assertEqual(
+            self.model.save_record(record), (record, 'insert', 7))
+        self.cursor.execute.assert_called_once()
+        query, parameters = self.cursor.execute.call_args[0]
+        self.assertIn('ON CONFLICT', query)
+        self.assertEqual(parameters, dict(record, all_dates=False))
+        self.connection.commit.assert_called_once()
+
+        self.cursor.fetchone.return_value = {'inserted': False, 'index': None}
+        self.assertEqual(
+            self.model.save_record(record), (record, 'update', None))
+        self.assertEqual(
+            self.model.changes.get_status(('2018-07-01', '12:00', 'E', '3')),
+            'inserted')
+
+    def test_autofill_cache(self):
+        today = models.date.today().isoformat()
+        self.cursor.fetchall.side_effect = [
+            [{'lab_id': 'A', 'plot': 1, 'current_seed_sample': 'AXM477'}],
+            [{'date': today, 'time': '8:00', 'lab_id': 'A',
+              'lab_tech_id': 4291, 'lab_tech': 'J Simms'}]
+        ]
+        self.assertEqual(
+            self.model.get_current_seed_sample('A', '1'), 'AXM477')
+        self.assertEqual(
+            self.model.get_lab_check(today, '8:00', 'A')['lab_tech'],
+            'J Simms')
+        # today's missing checks come from the cache too
+        self.assertEqual(self.model.get_lab_check(today, '12:00', 'A'), {})
+        self.assertEqual(self.model.get_current_seed_sample('B', '2'), '')
+        self.assertEqual(self.cursor.execute.call_count, 2)
+        self.pool.getconn.assert_called_once()
+
+        # saving invalidates the cache
+        self.cursor.fetchone.return_value = {'inserted': True, 'index': 0}
+        self.model.save_record({
+            'Date': today, 'Time': '8:00', 'Lab': 'A', 'Plot': 1})
+        self.cursor.fetchall.side_effect = [[], []]
+        self.assertEqual(self.model.get_current_seed_sample('A', '1'), '')
+
+    @patch('abq_data_entry.models.execute_values')
+    def test_save_records(self, execute_values):
+        record = {'Date': '2018-07-01', 'Time': '12:00', 'Lab': 'E'}
+        records = [dict(record, Plot=plot) for plot in (1, 2, 3, 3)]
+        self.model.batch_size = 3
+        self.assertEqual(self.model.save_records(iter(records)), 4)
+
+        # two batches, each writing lab_checks and plot_checks
+        self.assertEqual(execute_values.call_count, 4)
+        lc_rows = list(execute_values.call_args_list[0][0][2])
+        pc_rows = list(execute_values.call_args_list[1][0][2])
+        self.assertEqual(len(lc_rows), 1)
+        self.assertEqual(len(pc_rows), 3)
+        self.connection.commit.assert_called_once()
+
+        # a key repeated within a batch is written once
+        records = [dict(record, Plot=plot) for plot in (1, 1, 2, 3)]
+        self.assertEqual(self.model.save_records(records), 3)
+        self.assertEqual(self.model.save_records([]), 0)
+
+    def test_iter_record_batches(self):
+        self.cursor.fetchmany.side_effect = [[1, 2], [3], []]
+        batches = list(self.model.iter_record_batches(batch_size=2))
+        self.assertEqual(batches, [[1, 2], [3]])
+        self.connection.cursor.assert_called_with(name='record_batches')
+        self.cursor.fetchmany.assert_called_with(2)
+        self.connection.commit.assert_called_once()
+
+        # closing it early gives the connection back
+        self.pool.putconn.reset_mock()
+        self.cursor.fetchmany.side_effect = [[1, 2], [3], []]
+        with closing(self.model.iter_record_batches(batch_size=2)) as batches:
+            next(batches)
+        self.pool.putconn.assert_called_once_with(
+            self.connection, close=False)
+        self.connection.rollback.assert_called_once()
+
+    def test_iter_changes(self):
+        self.cursor.fetchmany.side_effect = [[1, 2], [3], []]
+        changes = list(self.model.iter_changes(None, 'now', batch_size=2))
+        self.assertEqual(changes, [1, 2, 3])
+        self.connection.cursor.assert_called_with(name='record_changes')
+        query, parameters = self.cursor.execute.call_args[0]
+        self.assertIn('updated_at > %(since)s', query)
+        # no watermark yet means every record
+        self.assertEqual(
+            parameters, {'since': '-infinity', 'until': 'now'})
+
+    def test_upload_watermark(self):
+        self.cursor.fetchall.return_value = [{'since': None, 'until': 2}]
+        self.assertEqual(
+            self.model.get_upload_window(['rest', 'ftp abq', 'rest']),
+            (None, 2))
+        # one window for every destination, ending upload_lag behind now()
+        self.cursor.execute.assert_called_once()
+        query, parameters = self.cursor.execute.call_args[0]
+        self.assertIn('now() - %(lag)s', query)
+        self.assertEqual(parameters['lag'], self.model.upload_lag)
+        self.assertEqual(parameters['destinations'], ['ftp abq', 'rest'])
+        self.assertEqual(parameters['count'], 2)
+        self.model.set_upload_watermark('ftp abq', 2)
+        query, parameters = self.cursor.execute.call_args[0]
+        self.assertIn('GREATEST', query)
+        self.assertEqual(parameters, {'destination': 'ftp abq', 'until': 2})
+
+    def test_get_records_page(self):
+        self.model.get_records_page(limit=10)
+        query, parameters = self.cursor.execute.call_args[0]
+        self.assertNotIn('>', query)
+        self.assertEqual(parameters['limit'], 10)
+
+        after = {'Date': '2018-07-01', 'Time': '8:00', 'Lab': 'A',
+                 'Plot': 20, 'Notes': ''}
+        self.model.get_records_page(after, limit=10)
+        query, parameters = self.cursor.execute.call_args[0]
+        # the key is compared on the primary key columns
+        self.assertIn(
+            '(pc.date, pc.time, pc.lab_id, pc.plot) > '
+            '(%(Date)s, %(Time)s::time, %(Lab)s, %(Plot)s)', query)
+        self.assertIn('ORDER BY pc.date, pc.time, pc.lab_id, pc.plot', query)
+        self.assertEqual(parameters['Plot'], 20)
+        self.assertNotIn('OFFSET', query)
+
+    def test_get_records(self):
+        rows = [{'Date': '2018-07-01', 'Time': '8:00', 'Lab': 'A',
+                 'Plot': plot} for plot in (1, 2)]
+        self.cursor.fetchall.return_value = rows
+        self.model.get_records(0, 2)
+        query = self.cursor.execute.call_args[0][0]
+        self.assertNotIn('OFFSET', query)
+
+        # the next page follows on from the last record
+        self.model.get_records(2, 2)
+        query, parameters = self.cursor.execute.call_args[0]
+        self.assertNotIn('OFFSET', query)
+        self.assertEqual(parameters['Plot'], 2)
+
+        # an unvisited page has to use OFFSET
+        self.model.get_records(10, 2)
+        query = self.cursor.execute.call_args[0][0]
+        self.assertIn('OFFSET', query)
+
+
+class TestPagedRecords(TestCase):
+
+    def test_paging(self):
+        fetch = Mock(side_effect=lambda start, limit: list(
+            range(start, min(start + limit, 25))))
+        records = models.PagedRecords(25, fetch, page_size=10, max_pages=2)
+        self.assertEqual(len(records), 25)
+        self.assertEqual(records[3], 3)
+        self.assertEqual(records[-1], 24)
+        self.assertEqual(records[8:12], [8, 9, 10, 11])
+        with self.assertRaises(IndexError):
+            records[25]
+        self.assertEqual(fetch.call_count, 3)
+
+        # only max_pages pages are kept
+        records[24]
+        self.assertEqual(fetch.call_count, 4)
+
+    def test_changes(self):
+        data = list(range(25))
+        fetch = Mock(
+            side_effect=lambda start, limit: data[start:start + limit])
+        records = models.PagedRecords(25, fetch, page_size=10)
+        records[5], records[15], records[24]
+
+        # mirror an insert at 12 in the underlying data
+        data.insert(12, 'new')
+        records.insert(12, 'new')
+        self.assertEqual(len(records), 26)
+        self.assertEqual(records[12], 'new')
+        self.assertEqual(records[25], 24)
+
+        data[3] = 'changed'
+        records[3] = 'changed'
+        self.assertEqual(records[3], 'changed')
+
+        del data[0]
+        del records[0]
+        self.assertEqual(len(records), 25)
+        self.assertEqual(list(records), data)
+
+    def test_background_pages(self):
+        data = list(range(25))
+        fetch = Mock(
+            side_effect=lambda start, limit: data[start:start + limit])
+        records = models.PagedRecords(25, fetch, page_size=10)
+        self.assertIsNone(records.peek(12))
+        self.assertEqual(records.missing_pages(8, 30), [0, 1, 2])
+        fetch.assert_not_called()
+
+        generation = records.generation
+        pages = records.fetch_pages([0, 1])
+        self.assertTrue(records.add_pages(pages, generation))
+        self.assertEqual(records.peek(12), 12)
+        self.assertEqual(records.missing_pages(8, 30), [2])
+
+        # pages fetched before rows moved are dropped
+        pages = records.fetch_pages([2])
+        records.insert(0, 'new')
+        self.assertFalse(records.add_pages(pages, generation))
+        self.assertEqual(records.missing_pages(20, 26), [2])
+
+
+class TestChangeTracker(TestCase):
+
+    record = {'Date': '2018-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': 1}
+    key = ('2018-06-01', '8:00', 'A', '1')
+
+    def test_mark(self):
+        changes = models.ChangeTracker()
+        self.assertEqual(changes.get_status(self.key), '')
+        changes.mark(self.record, 'update')
+        self.assertEqual(changes.get_status(self.key), 'updated')
+        # an inserted row stays highlighted as inserted
+        changes.mark(self.record, 'insert')
+        self.assertEqual(changes.get_status(self.key), 'inserted')
+        changes.clear()
+        self.assertEqual(changes.get_status(self.key), '')
+
+    # seconds allowed to look up 100k rows after 10k edits; scanning
+    # lists of edited keys took several seconds
+    lookup_budget = 0.5
+
+    @benchmark
+    def test_lookup_budget(self):
+        changes = models.ChangeTracker()
+        for plot in range(10000):
+            changes.mark(dict(self.record, Plot=plot), 'update')
+        keys = [('2018-06-01', '8:00', 'A', str(plot))
+                for plot in range(100000)]
+        start = time.perf_counter()
+        statuses = [changes.get_status(key) for key in keys]
+        self.assertLess(time.perf_counter() - start, self.lookup_budget)
+        self.assertEqual(statuses.count('updated'), 10000)
+
+    @patch('abq_data_entry.models.time.monotonic')
+    def test_expire(self, monotonic):
+        changes = models.ChangeTracker(max_age=60)
+        monotonic.return_value = 100
+        changes.mark(self.record, 'insert')
+        monotonic.return_value = 200
+        self.assertEqual(changes.get_status(self.key), '')
+        self.assertIn(self.key, changes.inserted)
+        changes.expire()
+        self.assertNotIn(self.key, changes.inserted)
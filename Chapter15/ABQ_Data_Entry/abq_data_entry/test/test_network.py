@@ -0,0 +1,206 @@
+import gzip
+import os
+import time
+from queue import Queue
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import patch
+from .. import network
+from .support import UploadServer
+
+
+class TestCorporateRestUploaderWithQueue(TestCase):
+
+    def setUp(self):
+        self.server = UploadServer()
+        self.tempdir = TemporaryDirectory()
+        self.filepath = os.path.join(self.tempdir.name, 'test.csv')
+        self.data = os.urandom(10000)
+        with open(self.filepath, 'wb') as fh:
+            fh.write(self.data)
+        self.queue = Queue()
+        self.sessions = network.SessionManager()
+
+    def tearDown(self):
+        self.sessions.close()
+        self.server.stop()
+        self.tempdir.cleanup()
+
+    def write_csv(self):
+        """Replace the test file with a compressible one"""
+        lines = [
+            '2018-06-01,8:00,J Simms,A,{},AXM477,24.09,1.03,22.01,9,21,3,'
+            '8.7,1.67,2.73,\n'.format(plot % 20 + 1) for plot in range(2000)]
+        self.data = ''.join(lines).encode()
+        with open(self.filepath, 'wb') as fh:
+            fh.write(self.data)
+
+    def make_uploader(self, token=None):
+        uploader = network.CorporateRestUploaderWithQueue(
+            self.filepath, self.server.url + '/upload',
+            self.server.url + '/auth', 'user', 'password',
+            self.queue, token=token, compress=False, sessions=self.sessions)
+        uploader.chunk_size = 4096
+        uploader.backoff = 0
+        return uploader
+
+    def get_messages(self):
+        messages = []
+        while not self.queue.empty():
+            messages.append(self.queue.get())
+        return messages
+
+    def test_upload(self):
+        uploader = self.make_uploader()
+        uploader.run()
+        messages = self.get_messages()
+        self.assertEqual(messages[-1].status, 'done')
+        progress = [m.body for m in messages if m.subject == 'Uploading']
+        self.assertEqual(progress, [
+            '4096 of 10000 bytes uploaded',
+            '8192 of 10000 bytes uploaded',
+            '10000 of 10000 bytes uploaded'])
+        upload = self.server.uploads[uploader.token]
+        self.assertEqual(upload['filename'], 'test.csv')
+        self.assertEqual(bytes(upload['data']), self.data)
+
+    def test_retries(self):
+        self.server.drop_puts = 1
+        self.server.bad_checksums = 1
+        uploader = self.make_uploader()
+        uploader.run()
+        messages = self.get_messages()
+        self.assertEqual(messages[-1].status, 'done')
+        self.assertEqual(
+            len([m for m in messages if m.subject == 'Retrying']), 2)
+        self.assertEqual(
+            bytes(self.server.uploads[uploader.token]['data']), self.data)
+
+        self.server.bad_checksums = 10
+        uploader = self.make_uploader()
+        uploader.run()
+        self.assertEqual(self.get_messages()[-1].status, 'error')
+
+    def test_stop(self):
+        self.server.drop_puts = 1
+        uploader = self.make_uploader()
+        uploader.backoff = 60
+        uploader.start()
+        while self.queue.get(timeout=5).subject != 'Retrying':
+            pass
+        # cuts the backoff short
+        uploader.stop.set()
+        uploader.join(5)
+        self.assertFalse(uploader.is_alive())
+        message = self.get_messages()[-1]
+        self.assertEqual(message.status, 'error')
+        self.assertEqual(message.body, 'Upload stopped')
+
+    def test_resume(self):
+        uploader = self.make_uploader()
+        uploader.run()
+        # the server lost the end of the file
+        upload = self.server.uploads[uploader.token]
+        del upload['data'][5000:]
+        self.get_messages()
+
+        self.server.requests.clear()
+        resumed = self.make_uploader(token=uploader.token)
+        resumed.run()
+        self.assertEqual(resumed.token, uploader.token)
+        self.assertEqual(bytes(upload['data']), self.data)
+        # only the missing bytes are sent again, on the same login
+        self.assertEqual(
+            [method for method, path in self.server.requests],
+            ['GET', 'PUT', 'PUT'])
+
+    def test_session_reuse(self):
+        for i in range(3):
+            uploader = self.make_uploader()
+            uploader.run()
+            self.assertEqual(self.get_messages()[-1].status, 'done')
+        self.assertEqual(len(self.server.uploads), 3)
+        # one connection and one login for all three uploads
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests.count(('POST', '/auth')), 1)
+
+        # expired logins are renewed on the same connection
+        later = time.monotonic() + self.sessions.max_age
+        with patch('abq_data_entry.network.time.monotonic',
+                   return_value=later):
+            self.make_uploader().run()
+        self.assertEqual(self.server.requests.count(('POST', '/auth')), 2)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_login_renewal(self):
+        self.make_uploader().run()
+        self.get_messages()
+        # the server drops the login
+        self.server.sessions.clear()
+        uploader = self.make_uploader()
+        uploader.run()
+        self.assertEqual(self.get_messages()[-1].status, 'done')
+        self.assertEqual(self.server.requests.count(('POST', '/auth')), 2)
+        self.assertEqual(
+            bytes(self.server.uploads[uploader.token]['data']), self.data)
+
+    def test_threads(self):
+        self.make_uploader().run()
+        self.get_messages()
+        # another thread gets its own session, but the same login
+        uploader = self.make_uploader()
+        thread = Thread(target=uploader.run)
+        thread.start()
+        thread.join()
+        self.assertEqual(self.get_messages()[-1].status, 'done')
+        self.assertEqual(self.server.requests.count(('POST', '/auth')), 1)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_bad_expiry(self):
+        self.server.login = {'expires_in': 'soon'}
+        session = self.sessions.get(
+            self.server.url + '/auth', 'user', 'password')
+        later = time.monotonic() + self.sessions.max_age - 1
+        with patch('abq_data_entry.network.time.monotonic',
+                   return_value=later):
+            self.assertIs(self.sessions.get(
+                self.server.url + '/auth', 'user', 'password'), session)
+        self.assertEqual(self.server.requests.count(('POST', '/auth')), 1)
+
+    def test_manifest(self):
+        manifest = os.path.join(self.tempdir.name, 'test.csv.manifest.json')
+        with open(manifest, 'w') as fh:
+            fh.write('{"records": 2}')
+        uploader = self.make_uploader()
+        uploader.manifest = manifest
+        uploader.run()
+        self.assertEqual(self.get_messages()[-1].status, 'done')
+        self.assertEqual(
+            bytes(self.server.uploads[uploader.token]['data']), self.data)
+        upload = self.server.uploads[uploader.tokens[manifest]]
+        self.assertEqual(upload['filename'], 'test.csv.manifest.json')
+        self.assertEqual(bytes(upload['data']), b'{"records": 2}')
+        # the manifest follows the file it describes
+        self.assertEqual(
+            list(self.server.uploads),
+            [uploader.token, uploader.tokens[manifest]])
+
+    def test_compressed_upload(self):
+        self.write_csv()
+        uploader = self.make_uploader()
+        uploader.compress = True
+        uploader.run()
+        self.assertEqual(self.get_messages()[-1].status, 'done')
+        upload = self.server.uploads[uploader.token]
+        self.assertEqual(upload['encoding'], 'gzip')
+        self.assertLess(len(upload['data']), len(self.data) / 5)
+        self.assertEqual(gzip.decompress(bytes(upload['data'])), self.data)
+
+        # servers that don't accept gzip get the file as it is
+        self.server.accept_gzip = False
+        uploader = self.make_uploader()
+        uploader.compress = True
+        uploader.run()
+        upload = self.server.uploads[uploader.token]
+        self.assertEqual(bytes(upload['data']), self.data)
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from .. import startup
+from .support import benchmark
+
+PROJECT_DIR = os.path.dirname(
+    os.path.dirname(os.path.abspath(startup.__file__)))
+
+
+class TestStartup(TestCase):
+
+    # seconds allowed for a cold import of the application
+    import_budget = 1.5
+
+    @benchmark
+    def test_import_budget(self):
+        script = (
+            'import time\n'
+            'start = time.perf_counter()\n'
+            'import abq_data_entry.application\n'
+            'print(time.perf_counter() - start)\n')
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=PROJECT_DIR,
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertLess(float(result.stdout), self.import_budget)
+
+    def test_application_imports(self):
+        # the chart libraries are loaded when a chart is first shown
+        script = (
+            'import sys\n'
+            'import abq_data_entry.application\n'
+            'print("matplotlib" in sys.modules, "numpy" in sys.modules)\n')
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=PROJECT_DIR,
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.split(), ['False', 'False'])
+
+    def test_models_imports(self):
+        # the importer uses the models without the network layer
+        script = (
+            'import sys\n'
+            'import abq_data_entry.models\n'
+            'print("requests" in sys.modules)\n')
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=PROJECT_DIR,
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_package_imports(self):
+        # Application is only imported when it is asked for
+        script = (
+            'import sys\n'
+            'import abq_data_entry\n'
+            'print("abq_data_entry.application" in sys.modules)\n'
+            'from abq_data_entry import Application\n'
+            'print(Application.__module__)\n')
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=PROJECT_DIR,
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(
+            result.stdout.split(), ['False', 'abq_data_entry.application'])
+
+    def test_profile_imports(self):
+        times = startup.profile_imports('abq_data_entry.widgets')
+        names = [name for cumulative, self_time, name in times]
+        self.assertIn('abq_data_entry.widgets', names)
+        self.assertNotIn('matplotlib', names)
+        cumulative = [time[0] for time in times]
+        self.assertEqual(cumulative, sorted(cumulative, reverse=True))
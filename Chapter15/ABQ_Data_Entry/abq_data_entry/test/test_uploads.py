@@ -0,0 +1,172 @@
+import os
+import time
+from ftplib import error_perm
+from tempfile import TemporaryDirectory, mkdtemp
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from .. import models
+from .. import network
+from .. import workers
+from ..uploads import UploadScheduler
+from .support import UploadServer
+
+
+class TestUploadScheduler(TestCase):
+
+    def setUp(self):
+        self.server = UploadServer()
+        self.tempdir = TemporaryDirectory()
+        self.queue_model = models.UploadQueueModel(path=self.tempdir.name)
+        os.makedirs(self.queue_model.spool_dir)
+        self.filepath = os.path.join(
+            mkdtemp(dir=self.queue_model.spool_dir), 'test.csv')
+        with open(self.filepath, 'wb') as fh:
+            fh.write(b'Date,Time,Lab,Plot\n2018-06-01,8:00,A,1\n')
+        self.rest = {
+            'name': 'rest', 'kind': 'rest',
+            'upload_url': self.server.url + '/upload',
+            'auth_url': self.server.url + '/auth'}
+        self.ftp = {'name': 'ftp', 'kind': 'ftp', 'host': 'ftp', 'port': 21}
+        self.on_done = Mock()
+        self.sessions = network.SessionManager()
+        self.scheduler = self.make_scheduler()
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+        self.sessions.close()
+        self.server.stop()
+        self.tempdir.cleanup()
+
+    def make_scheduler(self):
+        scheduler = UploadScheduler(
+            workers.Dispatcher(Mock()), self.queue_model,
+            on_done=self.on_done, sessions=self.sessions)
+        scheduler.backoff = 0
+        return scheduler
+
+    def finish(self):
+        """Wait for the uploads, then drain as the Tk thread would"""
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.scheduler.dispatcher.dispatch()
+            if not any(job['status'] in self.scheduler.active
+                       for job in self.scheduler.jobs):
+                break
+            time.sleep(.01)
+
+    @patch('abq_data_entry.uploads.n.upload_to_corporate_ftp')
+    def test_upload(self, upload_ftp):
+        self.scheduler.login('rest', 'user', 'password')
+        self.scheduler.login('ftp', 'user', 'password')
+        jobs = self.scheduler.add(
+            self.filepath, None, [self.rest, self.ftp], until='now')
+        self.finish()
+        self.assertEqual([job['status'] for job in jobs], ['done', 'done'])
+        upload_ftp.assert_called_with(
+            self.filepath, 'ftp', 21, 'user', 'password', manifest=None,
+            stop=self.scheduler.stopped)
+        (upload,) = self.server.uploads.values()
+        self.assertEqual(upload['filename'], 'test.csv')
+        self.assertEqual(self.on_done.call_count, 2)
+        self.assertEqual(self.on_done.call_args[0][0]['until'], 'now')
+        self.assertEqual(self.server.requests.count(('POST', '/auth')), 1)
+        # the extract is deleted once every destination has it
+        self.assertFalse(os.path.exists(os.path.dirname(self.filepath)))
+        self.assertEqual(models.UploadQueueModel(
+            path=self.tempdir.name).jobs, [])
+
+    @patch('abq_data_entry.uploads.n.upload_to_corporate_ftp')
+    def test_restart(self, upload_ftp):
+        (job,) = self.scheduler.add(self.filepath, None, [self.ftp])
+        self.assertEqual(job['status'], 'waiting')
+        upload_ftp.assert_not_called()
+
+        # the queue is read back after a restart
+        self.scheduler.shutdown()
+        self.queue_model = models.UploadQueueModel(path=self.tempdir.name)
+        self.scheduler = self.make_scheduler()
+        (job,) = self.scheduler.jobs
+        self.assertEqual(job['status'], 'waiting')
+        self.scheduler.login('ftp', 'user', 'password')
+        self.finish()
+        self.assertEqual(job['status'], 'done')
+        upload_ftp.assert_called_once()
+
+    @patch('abq_data_entry.uploads.n.upload_to_corporate_ftp')
+    def test_retries(self, upload_ftp):
+        upload_ftp.side_effect = [ConnectionRefusedError, None]
+        self.scheduler.login('ftp', 'user', 'password')
+        (job,) = self.scheduler.add(self.filepath, None, [self.ftp])
+        self.finish()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['attempts'], 1)
+
+        upload_ftp.side_effect = ConnectionRefusedError
+        self.scheduler.max_retries = 2
+        (job,) = self.scheduler.add(self.filepath, None, [self.ftp])
+        self.finish()
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(upload_ftp.call_count, 5)
+
+        # a refused login isn't retried, and has to be given again
+        upload_ftp.side_effect = error_perm('530 Login incorrect')
+        self.scheduler.retry(job['id'])
+        self.finish()
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(upload_ftp.call_count, 6)
+        self.assertTrue(self.scheduler.needs_login('ftp'))
+
+        self.assertTrue(self.scheduler.remove(job['id']))
+        self.assertNotIn(job, self.scheduler.jobs)
+        # retries wake the Tk thread with an event, not by polling
+        self.scheduler.dispatcher.widget.after.assert_not_called()
+
+    def test_shutdown(self):
+        self.server.drop_puts = 1
+        self.scheduler.login('rest', 'user', 'password')
+        with patch.object(
+                network.CorporateRestUploaderWithQueue, 'backoff', 60):
+            (job,) = self.scheduler.add(self.filepath, None, [self.rest])
+            deadline = time.monotonic() + 5
+            while ('retrying' not in job['detail'] and
+                   time.monotonic() < deadline):
+                time.sleep(.01)
+                self.scheduler.dispatcher.dispatch()
+            self.assertIn('retrying in 60s', job['detail'])
+            start = time.monotonic()
+            self.scheduler.shutdown()
+            # the upload gives up its backoff instead of holding up exit
+            self.scheduler.executor.shutdown(wait=True)
+            self.assertLess(time.monotonic() - start, 5)
+
+    def test_shutdown_stalled(self):
+        self.server.stall_puts = 1
+        self.scheduler.login('rest', 'user', 'password')
+        with patch.object(
+                network.CorporateRestUploaderWithQueue, 'timeout', (5, .5)):
+            (job,) = self.scheduler.add(self.filepath, None, [self.rest])
+            deadline = time.monotonic() + 5
+            while (not any(method == 'PUT'
+                           for method, path in self.server.requests) and
+                   time.monotonic() < deadline):
+                time.sleep(.01)
+            start = time.monotonic()
+            self.scheduler.shutdown()
+            # the stalled request times out rather than holding up exit
+            self.scheduler.executor.shutdown(wait=True)
+            self.assertLess(time.monotonic() - start, 5)
+
+    @patch('abq_data_entry.uploads.n.upload_to_corporate_ftp')
+    def test_shutdown_timers(self, upload_ftp):
+        upload_ftp.side_effect = ConnectionRefusedError
+        self.scheduler.backoff = 60
+        self.scheduler.login('ftp', 'user', 'password')
+        (job,) = self.scheduler.add(self.filepath, None, [self.ftp])
+        deadline = time.monotonic() + 5
+        while job['status'] != 'retrying' and time.monotonic() < deadline:
+            time.sleep(.01)
+            self.scheduler.dispatcher.dispatch()
+        self.scheduler.shutdown()
+        # the retry is cancelled
+        self.assertEqual(self.scheduler._timers, {})
+        self.assertEqual(upload_ftp.call_count, 1)
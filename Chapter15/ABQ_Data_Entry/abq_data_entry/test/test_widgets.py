@@ -183,3 +183,43 @@ class TestValidatedSpinbox(TkTestCase):
 
         self.click_arrow(arrow='dec', times=1)
         self.assertEqual(self.vsb.get(), '5')
+
+
+class TestValidatedCombobox(TkTestCase):
+
+    def setUp(self):
+        self.vcb = widgets.ValidatedCombobox(
+            self.root, values=['J Simms', 'Joe Blow', 'Alex Ng'])
+
+    def tearDown(self):
+        self.vcb.destroy()
+
+    def test_get_matches(self):
+        self.assertEqual(self.vcb.get_matches('j'), ['J Simms', 'Joe Blow'])
+        self.assertEqual(self.vcb.get_matches('JOE'), ['Joe Blow'])
+        self.assertEqual(self.vcb.get_matches('x'), [])
+
+        # the index follows changes to values
+        self.vcb.config(values=['Zed'])
+        self.assertEqual(self.vcb.get_matches('z'), ['Zed'])
+        self.vcb['values'] = ['Jo']
+        self.assertEqual(self.vcb.get_matches('j'), ['Jo'])
+
+    def test__key_validate(self):
+        self.assertTrue(self.vcb._key_validate('J', '1'))
+        self.assertFalse(self.vcb._key_validate('x', '1'))
+        # a unique match is filled in
+        self.assertFalse(self.vcb._key_validate('Jo', '1'))
+        self.assertEqual(self.vcb.get(), 'Joe Blow')
+
+    def test_show_matches(self):
+        self.vcb.show_matches = True
+        self.vcb._key_validate('J', '1')
+        self.assertEqual(
+            self.vcb.tk.splitlist(self.vcb.cget('values')),
+            ('J Simms', 'Joe Blow'))
+        # narrowing the list doesn't change the index
+        self.assertEqual(self.vcb.get_matches('a'), ['Alex Ng'])
+        self.vcb._key_validate('', '0')
+        values = self.vcb.tk.splitlist(self.vcb.cget('values'))
+        self.assertEqual(len(values), 3)
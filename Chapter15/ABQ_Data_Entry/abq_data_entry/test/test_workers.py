@@ -0,0 +1,156 @@
+import time
+from threading import Event, Thread
+from tkinter import TclError
+from unittest import TestCase
+from unittest.mock import Mock, call
+from .. import workers
+
+
+class TestDispatcher(TestCase):
+
+    def setUp(self):
+        self.widget = Mock()
+        self.dispatcher = workers.Dispatcher(self.widget)
+
+    def test_post(self):
+        self.widget.bind.assert_called_with(
+            self.dispatcher.event, self.dispatcher.dispatch, add='+')
+        handler = Mock()
+        self.dispatcher.post(handler, 1)
+        self.dispatcher.post(handler, 2)
+        # one wakeup for both calls
+        self.widget.event_generate.assert_called_once_with(
+            self.dispatcher.event, when='tail')
+        handler.assert_not_called()
+        self.dispatcher.dispatch()
+        handler.assert_has_calls([call(1), call(2)])
+
+        self.dispatcher.post(handler, 3)
+        self.assertEqual(self.widget.event_generate.call_count, 2)
+
+    def test_producers(self):
+        received = []
+        sender = self.dispatcher.sender(received.append)
+
+        def produce(n):
+            for i in range(100):
+                sender.put((n, i))
+
+        threads = [Thread(target=produce, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.dispatcher.dispatch()
+        self.assertEqual(len(received), 400)
+        self.assertEqual(
+            [i for n, i in received if n == 2], list(range(100)))
+
+    def test_error(self):
+        handler = Mock(side_effect=[ValueError, None])
+        self.dispatcher.post(handler, 1)
+        self.dispatcher.post(handler, 2)
+        with self.assertRaises(ValueError):
+            self.dispatcher.dispatch()
+        # the remaining call gets another wakeup
+        self.assertEqual(self.widget.event_generate.call_count, 2)
+        self.dispatcher.dispatch()
+        handler.assert_called_with(2)
+
+    def wait_for_wakes(self, count):
+        deadline = time.monotonic() + 5
+        while (self.widget.event_generate.call_count < count and
+               time.monotonic() < deadline):
+            time.sleep(.01)
+
+    def test_wake_retried(self):
+        # Tk isn't in its mainloop yet
+        self.widget.event_generate.side_effect = [RuntimeError, None]
+        handler = Mock()
+        self.dispatcher.post(handler, 1)
+        self.dispatcher.post(handler, 2)
+        self.wait_for_wakes(2)
+        self.assertEqual(self.widget.event_generate.call_count, 2)
+        # tried again from a timer, never by polling from the Tk thread
+        self.widget.after.assert_not_called()
+        time.sleep(self.dispatcher.retry_interval * 3)
+        self.assertEqual(self.widget.event_generate.call_count, 2)
+        self.dispatcher.dispatch()
+        handler.assert_has_calls([call(1), call(2)])
+
+    def test_widget_destroyed(self):
+        self.widget.event_generate.side_effect = TclError
+        self.dispatcher.post(Mock(), 1)
+        # doesn't stay pending, and isn't retried
+        self.assertIsNone(self.dispatcher._retry)
+        self.widget.event_generate.side_effect = None
+        self.dispatcher.post(Mock(), 2)
+        self.assertEqual(self.widget.event_generate.call_count, 2)
+
+    def test_close(self):
+        self.dispatcher.retry_interval = 60
+        self.widget.event_generate.side_effect = RuntimeError
+        self.dispatcher.post(Mock(), 1)
+        retry = self.dispatcher._retry
+        self.assertTrue(retry.is_alive())
+        self.dispatcher.close()
+        retry.join(5)
+        self.assertFalse(retry.is_alive())
+        self.dispatcher.post(Mock(), 2)
+        self.assertEqual(self.widget.event_generate.call_count, 1)
+
+
+class TestAsyncModel(TestCase):
+
+    def setUp(self):
+        self.dispatcher = workers.Dispatcher(Mock())
+        self.model = Mock()
+        self.on_busy = Mock()
+        self.tasks = workers.AsyncModel(
+            self.dispatcher, self.model, on_busy=self.on_busy)
+
+    def tearDown(self):
+        self.tasks.shutdown()
+
+    def finish(self):
+        """Wait for the workers, then drain as the Tk thread would"""
+        deadline = time.monotonic() + 5
+        while self.tasks.busy and time.monotonic() < deadline:
+            time.sleep(.01)
+            self.dispatcher.dispatch()
+
+    def test_call(self):
+        self.model.get_record.return_value = {'Plot': 1}
+        callback = Mock()
+        self.tasks.call('get_record', 'a', 'b', callback=callback)
+        self.on_busy.assert_called_with(True)
+        self.finish()
+        self.model.get_record.assert_called_with('a', 'b')
+        callback.assert_called_with({'Plot': 1})
+        self.on_busy.assert_called_with(False)
+
+    def test_error(self):
+        self.model.get_record.side_effect = ValueError('Test message')
+        callback = Mock()
+        errback = Mock()
+        self.tasks.call('get_record', callback=callback, errback=errback)
+        self.finish()
+        callback.assert_not_called()
+        self.assertIsInstance(errback.call_args[0][0], ValueError)
+
+    def test_superseded(self):
+        started = Event()
+        release = Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'slow'
+
+        callback = Mock()
+        self.tasks.run(slow, callback=callback, channel='autofill')
+        started.wait(5)
+        self.tasks.run(lambda: 'fast', callback=callback, channel='autofill')
+        release.set()
+        self.finish()
+        callback.assert_called_once_with('fast')
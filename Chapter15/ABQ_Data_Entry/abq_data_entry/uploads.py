@@ -0,0 +1,242 @@
+import ftplib as ftp
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Timer
+from uuid import uuid4
+import requests
+from . import network as n
+
+
+class UploadScheduler:
+    """Send extracts to the corporate destinations in the background
+
+    Each job sends one extract, and its manifest, to one destination,
+    so an extract bound for several destinations goes to all of them
+    at once, up to max_workers at a time.  Jobs are kept in an
+    UploadQueueModel, which is saved as they change.
+
+    A destination is a dict with a 'name', a 'kind' ('rest' or
+    'ftp') and the settings that kind needs.  Credentials are only
+    kept in memory, so jobs for a destination wait until login() is
+    called for it, as do jobs loaded from a previous run.  Failed
+    uploads are retried with exponential backoff; a job that keeps
+    failing or is refused is marked failed until retry() is called.
+
+    Job state is only changed on the Tk thread: uploads run on the
+    pool and report back through the Dispatcher.  on_status(job) is
+    called whenever a job changes, on_done(job) once it is sent.
+    """
+
+    max_retries = 5
+    # seconds before the first retry; doubled for each retry after
+    backoff = 30
+    max_backoff = 30 * 60
+
+    # statuses of jobs that are neither finished nor held up
+    active = ('queued', 'running', 'retrying')
+
+    def __init__(self, dispatcher, queue_model, max_workers=2,
+                 on_status=None, on_done=None, sessions=None):
+        self.dispatcher = dispatcher
+        self.queue_model = queue_model
+        self.on_status = on_status
+        self.on_done = on_done
+        self.executor = ThreadPoolExecutor(max_workers)
+        # logged in REST sessions, shared by the jobs
+        self.sessions = sessions or n.shared_sessions
+        # destination name -> (username, password)
+        self.credentials = {}
+        # job id -> Timer for jobs waiting to retry
+        self._timers = {}
+        # set by shutdown() to make running uploads give up
+        self.stopped = Event()
+        for job in self.jobs:
+            if job['status'] in self.active:
+                # interrupted by a restart
+                job['status'] = 'waiting'
+                job['detail'] = 'Waiting for login'
+
+    @property
+    def jobs(self):
+        return self.queue_model.jobs
+
+    def get_job(self, job_id):
+        for job in self.jobs:
+            if job['id'] == job_id:
+                return job
+        raise KeyError(job_id)
+
+    def add(self, filepath, manifest, destinations, until=None):
+        """Queue an extract to be sent to each destination
+
+        until is recorded on the jobs for on_done() to use.
+        Returns the new jobs.
+        """
+        jobs = [{
+            'id': uuid4().hex, 'destination': destination,
+            'filepath': filepath, 'manifest': manifest, 'until': until,
+            'status': 'waiting', 'detail': '', 'attempts': 0, 'tokens': {}
+        } for destination in destinations]
+        self.jobs.extend(jobs)
+        for job in jobs:
+            self._submit(job)
+        self.queue_model.save()
+        return jobs
+
+    def needs_login(self, name):
+        return name not in self.credentials
+
+    def login(self, name, username, password):
+        """Set the credentials for a destination and start its jobs"""
+        self.credentials[name] = (username, password)
+        for job in self.jobs:
+            if (job['destination']['name'] == name and
+                    job['status'] == 'waiting'):
+                self._submit(job)
+
+    def retry(self, job_id):
+        """Try a failed or waiting job again now"""
+        job = self.get_job(job_id)
+        if job['status'] in ('failed', 'waiting', 'retrying'):
+            self._cancel_timer(job)
+            job['attempts'] = 0
+            self._submit(job)
+
+    def remove(self, job_id):
+        """Drop a job, unless it is being sent
+
+        Returns True if the job was removed.
+        """
+        job = self.get_job(job_id)
+        if job['status'] in ('queued', 'running'):
+            return False
+        self._cancel_timer(job)
+        self.jobs.remove(job)
+        self.queue_model.save()
+        self._clean_up(job)
+        return True
+
+    def shutdown(self):
+        """Stop retrying, and stop the uploads so they don't hold up exit
+
+        Uploads that haven't started return as soon as a worker picks
+        them up, and running ones stop after their current block or
+        request.
+        """
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+    def _set_status(self, job, status, detail):
+        job['status'] = status
+        job['detail'] = detail
+        if self.on_status:
+            self.on_status(job)
+
+    def _cancel_timer(self, job):
+        timer = self._timers.pop(job['id'], None)
+        if timer is not None:
+            timer.cancel()
+
+    def _retry(self, job):
+        # a timer that was cancelled as it fired has already been popped
+        if self._timers.pop(job['id'], None) is not None:
+            self._submit(job)
+
+    def _submit(self, job):
+        if job not in self.jobs:
+            # removed while waiting to retry
+            return
+        name = job['destination']['name']
+        if name not in self.credentials:
+            self._set_status(job, 'waiting', 'Waiting for login')
+            return
+        self._set_status(job, 'queued', '')
+        # the worker records upload tokens here, so a retry resumes
+        tokens = dict(job['tokens'])
+        progress = self.dispatcher.sender(
+            lambda message: self._progress(job, message))
+        future = self.executor.submit(
+            self._upload, job['destination'], job['filepath'],
+            job['manifest'], self.credentials[name], tokens, progress)
+        future.add_done_callback(
+            lambda future: self.dispatcher.post(
+                self._finished, job, tokens, future))
+
+    def _progress(self, job, message):
+        if job['status'] in ('queued', 'running'):
+            self._set_status(job, 'running', message.body)
+
+    def _upload(self, destination, filepath, manifest, credentials, tokens,
+                progress):
+        """Send an extract to a destination; runs on a worker thread"""
+        if self.stopped.is_set():
+            raise n.UploadStopped('Upload stopped')
+        username, password = credentials
+        progress.put(n.Message(
+            'info', 'Connecting', 'Connecting to {}'.format(
+                destination['name'])))
+        if destination['kind'] == 'ftp':
+            n.upload_to_corporate_ftp(
+                filepath, destination['host'], destination['port'],
+                username, password, manifest=manifest, stop=self.stopped)
+        else:
+            uploader = n.CorporateRestUploaderWithQueue(
+                filepath, destination['upload_url'],
+                destination['auth_url'], username, password, progress,
+                manifest=manifest, sessions=self.sessions,
+                stop=self.stopped)
+            uploader.tokens = tokens
+            uploader.upload(uploader.get_session())
+
+    def _is_refusal(self, error):
+        """True if trying again won't help"""
+        if isinstance(error, requests.HTTPError):
+            response = error.response
+            return response is not None and response.status_code in (
+                401, 403)
+        return isinstance(error, (ftp.error_perm, FileNotFoundError))
+
+    def _finished(self, job, tokens, future):
+        if job not in self.jobs:
+            return
+        job['tokens'] = tokens
+        error = future.exception()
+        if error is None:
+            self._set_status(job, 'done', 'Uploaded')
+            self.queue_model.save()
+            self._clean_up(job)
+            if self.on_done:
+                self.on_done(job)
+            return
+
+        job['attempts'] += 1
+        if self._is_refusal(error):
+            # make the next attempt ask for a login again
+            self.credentials.pop(job['destination']['name'], None)
+            self._set_status(job, 'failed', str(error))
+        elif job['attempts'] > self.max_retries:
+            self._set_status(job, 'failed', str(error))
+        else:
+            delay = min(
+                self.backoff * 2 ** (job['attempts'] - 1), self.max_backoff)
+            self._set_status(
+                job, 'retrying', '{}; retrying in {}s'.format(error, delay))
+            timer = Timer(delay, self.dispatcher.post, (self._retry, job))
+            timer.daemon = True
+            self._timers[job['id']] = timer
+            timer.start()
+        self.queue_model.save()
+
+    def _clean_up(self, job):
+        """Delete a spooled extract once no job still needs it"""
+        if any(other['filepath'] == job['filepath'] and
+               other['status'] != 'done' for other in self.jobs):
+            return
+        dirname = os.path.dirname(job['filepath'])
+        spool_dir = self.queue_model.spool_dir
+        if os.path.dirname(dirname) == spool_dir:
+            shutil.rmtree(dirname, ignore_errors=True)
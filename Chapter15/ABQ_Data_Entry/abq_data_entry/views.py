@@ -1,17 +1,31 @@
+import os
 import tkinter as tk
 from tkinter import ttk
 from tkinter.simpledialog import Dialog
+from tkinter.font import nametofont
+from collections.abc import MutableSequence, Sequence
 from datetime import datetime
 from . import widgets as w
 
-#matplotlib
-import matplotlib
-# needs to be set before we load any other libraries
-# in order to avoid a warning
-matplotlib.use('TkAgg')
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2TkAgg)
+
+def load_chart_backend():
+    """Import matplotlib's Tk backend on first use
+
+    matplotlib is slow to import and only YieldChartView needs it,
+    so it is kept out of application startup.  Returns the Figure,
+    canvas and toolbar classes.
+    """
+    import matplotlib
+    # needs to be set before we load any other libraries
+    # in order to avoid a warning
+    matplotlib.use('TkAgg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends import backend_tkagg
+    # NavigationToolbar2TkAgg was renamed in matplotlib 2.2
+    toolbar = getattr(backend_tkagg, 'NavigationToolbar2Tk', None)
+    if toolbar is None:
+        toolbar = backend_tkagg.NavigationToolbar2TkAgg
+    return Figure, backend_tkagg.FigureCanvasTkAgg, toolbar
 
 
 class DataRecordForm(tk.Frame):
@@ -78,9 +92,13 @@ class DataRecordForm(tk.Frame):
             label_args={'style': 'RecordInfo.TLabel'}
         )
         self.inputs['Plot'].grid(row=1, column=0)
+        # only the combobox used for a list of technicians shows matches
         self.inputs['Technician'] = w.LabelInput(
             recordinfo, "Technician",
             field_spec=fields['Technician'],
+            input_args=(
+                {'show_matches': True}
+                if 'values' in fields['Technician'] else {}),
             label_args={'style': 'RecordInfo.TLabel'}
         )
         self.inputs['Technician'].grid(row=1, column=1)
@@ -298,7 +316,15 @@ class DataRecordForm(tk.Frame):
 
 
 class RecordList(tk.Frame):
-    """Display for CSV file contents"""
+    """Display for CSV file contents
+
+    Only the rows in view are inserted into the treeview.  The
+    scrollbar maps over the full set of rows, which are read from
+    the supplied sequence as the user scrolls.  Rows from a
+    PagedRecords whose page isn't loaded are shown as placeholders
+    while the load_record_pages callback fetches it in the
+    background; it hands the pages to add_pages().
+    """
 
     column_defs = {
         '#0': {'label': 'Row', 'anchor': tk.W},
@@ -310,17 +336,27 @@ class RecordList(tk.Frame):
     default_width = 100
     default_minwidth = 10
     default_anchor = tk.CENTER
+    # rows moved per notch of the mouse wheel
+    wheel_units = 3
 
-    def __init__(self, parent, callbacks,
-                 inserted, updated,
+    def __init__(self, parent, callbacks, changes=None,
                  *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
         self.callbacks = callbacks
-        self.inserted = inserted
-        self.updated = updated
+        # a ChangeTracker used to highlight inserted and updated rows
+        self.changes = changes
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
 
+        # the full set of rows, the index of the first row in view,
+        # the number of rows in view and the index of the selected row
+        self.rows = []
+        self.first = 0
+        self.page_size = 10
+        self.selected = None
+        # page numbers being loaded for the rows in view
+        self._loading = None
+
         # create treeview
         self.treeview = ttk.Treeview(
             self,
@@ -330,13 +366,12 @@ class RecordList(tk.Frame):
         # hide first column
         self.treeview.config(show='headings')
 
-        # configure scrollbar for the treeview
+        # configure scrollbar for the rows
         self.scrollbar = ttk.Scrollbar(
             self,
             orient=tk.VERTICAL,
-            command=self.treeview.yview
+            command=self.on_scroll
         )
-        self.treeview.configure(yscrollcommand=self.scrollbar.set)
         self.treeview.grid(row=0, column=0, sticky='NSEW')
         self.scrollbar.grid(row=0, column=1, sticky='NSW')
 
@@ -354,43 +389,281 @@ class RecordList(tk.Frame):
         # configure row tags
         self.treeview.tag_configure('inserted', background='lightgreen')
         self.treeview.tag_configure('updated', background='lightblue')
+        self.treeview.tag_configure('loading', foreground='gray')
 
         # Bind double-clicks
         self.treeview.bind('<<TreeviewOpen>>', self.on_open_record)
+        self.treeview.bind('<<TreeviewSelect>>', self.on_select)
+        self.treeview.bind('<Configure>', self.on_resize)
+
+        # the treeview only holds the rows in view,
+        # so scrolling and moving the selection is done here
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.treeview.bind(sequence, self.on_wheel)
+        self.treeview.bind('<Up>', lambda e: self.move_selection(-1))
+        self.treeview.bind('<Down>', lambda e: self.move_selection(1))
+        self.treeview.bind(
+            '<Prior>', lambda e: self.move_selection(-self.page_size))
+        self.treeview.bind(
+            '<Next>', lambda e: self.move_selection(self.page_size))
+        self.treeview.bind(
+            '<Home>', lambda e: self.move_selection(-len(self.rows)))
+        self.treeview.bind(
+            '<End>', lambda e: self.move_selection(len(self.rows)))
+
+    @staticmethod
+    def get_rowkey(rowdata):
+        return (str(rowdata['Date']), rowdata['Time'],
+                rowdata['Lab'], str(rowdata['Plot']))
+
+    def upsert_row(self, index, rowdata, update=False):
+        """Put rowdata at index, replacing the row there if update is set
+
+        index is the row number the model reported on saving, so only
+        the one row changes, without reloading or searching the rows.
+        """
+        if not isinstance(self.rows, MutableSequence):
+            self.rows = list(self.rows)
+        if update and index < len(self.rows):
+            self.rows[index] = rowdata
+        else:
+            self.rows.insert(index, rowdata)
+            if self.selected is not None and self.selected >= index:
+                self.selected += 1
+        self.render()
+
+    def remove_row(self, index):
+        """Remove the row at index"""
+        if not isinstance(self.rows, MutableSequence):
+            self.rows = list(self.rows)
+        del self.rows[index]
+        if self.selected is not None:
+            if self.selected > index:
+                self.selected -= 1
+            if self.selected >= len(self.rows):
+                self.selected = len(self.rows) - 1 if self.rows else None
+        self.render()
 
     def populate(self, rows):
-        """Clear the treeview and write the supplied data rows to it."""
+        """Show the supplied data rows in the treeview.
+
+        rows should be a sequence of records, such as a
+        PagedRecords object; only the rows in view are read
+        from it.  Other iterables are read into a list.
+        """
+        if not isinstance(rows, Sequence):
+            rows = list(rows)
+        self.rows = rows
+        self.first = 0
+        self.selected = 0 if len(rows) > 0 else None
+        self._loading = None
+        self.render()
+
+        if self.selected is not None:
+            self.treeview.focus_set()
+
+    def render(self):
+        """Write the rows currently in view to the treeview"""
+        total = len(self.rows)
+        self.first = max(0, min(self.first, total - self.page_size))
 
-        for row in self.treeview.get_children():
-            self.treeview.delete(row)
+        children = self.treeview.get_children()
+        if children:
+            self.treeview.delete(*children)
 
         valuekeys = list(self.column_defs.keys())[1:]
-        for rowdata in rows:
-            rowkey = (str(rowdata['Date']), rowdata['Time'],
-                      rowdata['Lab'], str(rowdata['Plot']))
+        shown = max(0, min(self.page_size, total - self.first))
+        for index in range(self.first, self.first + shown):
+            rowdata = self.get_row(index)
+            if rowdata is None:
+                self.treeview.insert(
+                    '', 'end', iid=str(index), text='',
+                    values=['Loading...'] + [''] * (len(valuekeys) - 1),
+                    tag='loading')
+                continue
+            rowkey = self.get_rowkey(rowdata)
             values = [rowdata[key] for key in valuekeys]
-            if self.inserted and rowkey in self.inserted:
-                tag = 'inserted'
-            elif self.updated and rowkey in self.updated:
-                tag = 'updated'
-            else:
-                tag = ''
+            tag = self.changes.get_status(rowkey) if self.changes else ''
             stringkey = '{}|{}|{}|{}'.format(*rowkey)
             self.treeview.insert(
-                '', 'end', iid=stringkey,
+                '', 'end', iid=str(index),
                 text=stringkey, values=values,
                 tag=tag)
 
-        if len(rows) > 0:
-            firstrow = self.treeview.identify_row(0)
-            self.treeview.focus_set()
-            self.treeview.selection_set(firstrow)
-            self.treeview.focus(firstrow)
+        if (
+            self.selected is not None and
+            self.first <= self.selected < self.first + shown
+        ):
+            self.treeview.selection_set(str(self.selected))
+            self.treeview.focus(str(self.selected))
+
+        if total:
+            self.scrollbar.set(
+                self.first / total,
+                (self.first + shown) / total)
+        else:
+            self.scrollbar.set(0, 1)
+        self._load_missing_pages()
+
+    def get_row(self, index):
+        """Return the row at index, or None while its page loads"""
+        peek = getattr(self.rows, 'peek', None)
+        return self.rows[index] if peek is None else peek(index)
+
+    def _load_missing_pages(self):
+        missing_pages = getattr(self.rows, 'missing_pages', None)
+        if missing_pages is None:
+            return
+        numbers = missing_pages(self.first, self.first + self.page_size)
+        if numbers and numbers != self._loading:
+            self._loading = numbers
+            self.callbacks['load_record_pages'](self.rows, numbers)
+
+    def add_pages(self, rows, generation, pages):
+        """Show pages fetched for rows by load_record_pages"""
+        if rows is not self.rows:
+            return
+        self._loading = None
+        rows.add_pages(pages, generation)
+        self.render()
+
+    def on_resize(self, event):
+        style = ttk.Style()
+        rowheight = style.lookup('Treeview', 'rowheight')
+        if not rowheight:
+            rowheight = nametofont('TkDefaultFont').metrics('linespace')
+        # leave room for the heading
+        page_size = max(1, event.height // int(rowheight) - 1)
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.render()
+
+    def on_scroll(self, action, amount, unit=None):
+        """Handle commands from the scrollbar"""
+        if action == 'moveto':
+            self.first = int(float(amount) * len(self.rows))
+        elif unit == 'pages':
+            self.first += int(amount) * self.page_size
+        else:
+            self.first += int(amount)
+        self.render()
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            direction = -1
+        else:
+            direction = 1
+        self.on_scroll('scroll', direction * self.wheel_units, 'units')
+        return 'break'
+
+    def move_selection(self, step):
+        """Move the selection by step rows, scrolling to keep it in view"""
+        if len(self.rows) == 0:
+            return 'break'
+        if self.selected is None:
+            index = self.first
+        else:
+            index = self.selected + step
+        index = max(0, min(index, len(self.rows) - 1))
+        self.selected = index
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + self.page_size:
+            self.first = index - self.page_size + 1
+        self.render()
+        return 'break'
+
+    def on_select(self, *args):
+        selection = self.treeview.selection()
+        if selection:
+            self.selected = int(selection[0])
 
     def on_open_record(self, *args):
 
         selected_id = self.treeview.selection()[0]
-        self.callbacks['on_open_record'](selected_id.split('|'))
+        rowdata = self.get_row(int(selected_id))
+        if rowdata is not None:
+            self.callbacks['on_open_record'](self.get_rowkey(rowdata))
+
+
+class UploadStatusView(tk.Frame):
+    """Status of the upload jobs, one row per job"""
+
+    column_defs = {
+        'Destination': {'width': 220, 'stretch': True},
+        'File': {'width': 220},
+        'Status': {'width': 80},
+        'Detail': {'width': 260, 'stretch': True}
+    }
+
+    def __init__(self, parent, callbacks, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.callbacks = callbacks
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.treeview = ttk.Treeview(
+            self,
+            columns=list(self.column_defs.keys()),
+            selectmode='browse',
+            show='headings'
+        )
+        self.scrollbar = ttk.Scrollbar(
+            self,
+            orient=tk.VERTICAL,
+            command=self.treeview.yview
+        )
+        self.treeview.configure(yscrollcommand=self.scrollbar.set)
+        self.treeview.grid(row=0, column=0, sticky='NSEW')
+        self.scrollbar.grid(row=0, column=1, sticky='NSW')
+
+        for name, definition in self.column_defs.items():
+            self.treeview.heading(name, text=name, anchor=tk.W)
+            self.treeview.column(
+                name, anchor=tk.W, width=definition['width'],
+                stretch=definition.get('stretch', False))
+
+        self.treeview.tag_configure('done', background='lightgreen')
+        self.treeview.tag_configure('failed', background='pink')
+        self.treeview.tag_configure('waiting', background='lightyellow')
+
+        buttons = tk.Frame(self)
+        ttk.Button(buttons, text='Retry', command=self.on_retry).pack(
+            side=tk.LEFT)
+        ttk.Button(buttons, text='Remove', command=self.on_remove).pack(
+            side=tk.LEFT)
+        buttons.grid(row=1, column=0, sticky='W')
+
+    def update_job(self, job):
+        """Add or update the row for job"""
+        values = (
+            job['destination']['name'], os.path.basename(job['filepath']),
+            job['status'], job['detail'])
+        if self.treeview.exists(job['id']):
+            self.treeview.item(job['id'], values=values, tags=job['status'])
+        else:
+            self.treeview.insert(
+                '', 'end', iid=job['id'], values=values, tags=job['status'])
+
+    def remove_job(self, job_id):
+        if self.treeview.exists(job_id):
+            self.treeview.delete(job_id)
+
+    def get_selected(self):
+        """Return the selected job's id, or None"""
+        selection = self.treeview.selection()
+        return selection[0] if selection else None
+
+    def on_retry(self):
+        job_id = self.get_selected()
+        if job_id is not None:
+            self.callbacks['retry_upload'](job_id)
+
+    def on_remove(self):
+        job_id = self.get_selected()
+        if job_id is not None:
+            self.callbacks['remove_upload'](job_id)
+
 
 class LoginDialog(Dialog):
 
@@ -426,8 +699,28 @@ class LoginDialog(Dialog):
 
 
 class LineChartView(tk.Canvas):
+    """A line chart drawn on a Tk canvas
+
+    Series are kept at full resolution and reduced with LTTB to
+    about points_per_pixel points per pixel of chart width each time
+    they are drawn, so large series draw quickly.  They are redrawn
+    when the chart is resized.
+
+    The mouse wheel zooms the x axis around the pointer, dragging
+    pans, and double-clicking shows all the data again.  Zooming and
+    panning scale and move the drawn lines; the lines are only drawn
+    again from the data when the zoom changes by more than
+    redraw_zoom or the view pans past the extra data drawn beyond
+    each edge.
+    """
 
     margin = 20
+    points_per_pixel = 2
+    # zoom factor for each mouse wheel step
+    zoom_step = 1.25
+    redraw_zoom = 2
+    # chart widths of data drawn beyond each side of the view
+    overdraw = 1
 
     def __init__(self, parent, chart_width, chart_height,
                  x_axis, y_axis, max_x, max_y):
@@ -440,57 +733,202 @@ class LineChartView(tk.Canvas):
         self.max_y = max_y
         self.chart_width = chart_width
         self.chart_height = chart_height
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+        # the part of the data shown, as (min, max)
+        self.x_range = (0, max_x)
+        self.y_range = (0, max_y)
+        # full resolution (x, y) arrays by color
+        self.series = {}
+        self.legend = {}
+        self._view_size = None
+        # the x range of the view when the lines were last drawn
+        self._drawn_range = self.x_range
+        self._drag_start = None
 
-        # draw axes and labels
+        # create chart
+        self.chart = tk.Canvas(
+            self, width=chart_width, height=chart_height,
+            background='white')
+        self.chart_window = self.create_window(
+            (0, 0), window=self.chart, anchor='sw')
+        self.draw_axes()
+        self.bind('<Configure>', self.on_resize)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.chart.bind(sequence, self.on_wheel)
+        self.chart.bind('<ButtonPress-1>', self.on_drag_start)
+        self.chart.bind('<B1-Motion>', self.on_drag)
+        self.chart.bind('<Double-Button-1>', self.reset_zoom)
+
+    def draw_axes(self):
+        """Draw the axes, labels and legend for the current size"""
+        self.delete('axes')
+        view_width = self.chart_width + 2 * self.margin
+        view_height = self.chart_height + 2 * self.margin
         self.origin = (self.margin, view_height - self.margin)
+        self.coords(self.chart_window, self.origin)
         self.create_line(
-            self.origin, (self.margin, self.margin), width=2)
+            self.origin, (self.margin, self.margin), width=2, tags='axes')
         self.create_line(
             self.origin,
             (view_width - self.margin,
-             view_height - self.margin))
+             view_height - self.margin), tags='axes')
         self.create_text(
             (view_width // 2, view_height - self.margin),
-            text=x_axis, anchor='n')
+            text=self.x_axis, anchor='n', tags='axes')
         # angle requires tkinter 8.6
         self.create_text(
             (self.margin, view_height // 2),
-            text=y_axis, angle=90, anchor='s')
-
-        # create chart
-        self.chart = tk.Canvas(
-            self, width=chart_width, height=chart_height,
-            background='white')
-        self.create_window(
-            self.origin, window=self.chart, anchor='sw')
-
-    def plot_line(self, data, color):
-        x_scale = self.chart_width / self.max_x
-        y_scale = self.chart_height / self.max_y
+            text=self.y_axis, angle=90, anchor='s', tags='axes')
+        y = self.margin
+        x = round(self.margin * 1.5) + self.chart_width
+        for label, color in self.legend.items():
+            self.create_text(
+                (x, y), text=label, fill=color, anchor='w', tags='axes')
+            y += 20
 
-        # calculate coordinates
-        coords = [(round(x * x_scale),
-            self.chart_height - round(y * y_scale))
-            for x, y in data]
+    def on_resize(self, event):
+        if self._view_size is None:
+            self._view_size = (event.width, event.height)
+            return
+        width_change = event.width - self._view_size[0]
+        height_change = event.height - self._view_size[1]
+        if not (width_change or height_change):
+            return
+        self._view_size = (event.width, event.height)
+        self.chart_width = max(1, self.chart_width + width_change)
+        self.chart_height = max(1, self.chart_height + height_change)
+        self.chart.config(width=self.chart_width, height=self.chart_height)
+        self.draw_axes()
+        self.redraw()
+
+    def plot_line(self, x, y, color):
+        """Draw a line through points given as arrays of x and y values
+
+        x values must be in ascending order.
+        """
+        import numpy as np
+
+        self.series[color] = (
+            np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        self._drawn_range = self.x_range
+        self._draw_line(color)
+
+    def redraw(self):
+        """Redraw every series for the current size and ranges"""
+        self._drawn_range = self.x_range
+        for color in self.series:
+            self._draw_line(color)
+
+    def _scales(self):
+        x_min, x_max = self.x_range
+        y_min, y_max = self.y_range
+        return (
+            self.chart_width / ((x_max - x_min) or 1),
+            self.chart_height / ((y_max - y_min) or 1))
+
+    def _needs_redraw(self):
+        x_min, x_max = self.x_range
+        drawn_min, drawn_max = self._drawn_range
+        width = x_max - x_min
+        drawn_width = drawn_max - drawn_min
+        extra = drawn_width * self.overdraw
+        return (
+            width * self.redraw_zoom < drawn_width or
+            width > drawn_width * self.redraw_zoom or
+            x_min < drawn_min - extra or x_max > drawn_max + extra)
+
+    def zoom(self, factor, x):
+        """Zoom the x axis by factor, keeping pixel column x in place"""
+        x_scale, y_scale = self._scales()
+        x_min, x_max = self.x_range
+        center = x_min + x / x_scale
+        self.x_range = (
+            center - (center - x_min) / factor,
+            center + (x_max - center) / factor)
+        self.chart.scale('line', x, 0, factor, 1)
+        if self._needs_redraw():
+            self.redraw()
+
+    def pan(self, dx, dy):
+        """Move the view by dx, dy pixels"""
+        x_scale, y_scale = self._scales()
+        x_min, x_max = self.x_range
+        y_min, y_max = self.y_range
+        self.x_range = (x_min - dx / x_scale, x_max - dx / x_scale)
+        self.y_range = (y_min + dy / y_scale, y_max + dy / y_scale)
+        self.chart.move('line', dx, dy)
+        if self._needs_redraw():
+            self.redraw()
+
+    def reset_zoom(self, *args):
+        self.x_range = (0, self.max_x)
+        self.y_range = (0, self.max_y)
+        self.redraw()
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            factor = self.zoom_step
+        else:
+            factor = 1 / self.zoom_step
+        self.zoom(factor, event.x)
+        return 'break'
+
+    def on_drag_start(self, event):
+        self._drag_start = (event.x, event.y)
+
+    def on_drag(self, event):
+        if self._drag_start is None:
+            return
+        self.pan(event.x - self._drag_start[0], event.y - self._drag_start[1])
+        self._drag_start = (event.x, event.y)
+
+    def _draw_line(self, color):
+        import numpy as np
+        from . import charts
+
+        tag = 'series_' + color
+        self.chart.delete(tag)
+        x, y = self.series[color]
+        x_min, x_max = self.x_range
+        y_min = self.y_range[0]
+        x_scale, y_scale = self._scales()
+
+        # the visible points and overdraw widths either side, so the
+        # view can pan without a redraw, plus one more point either
+        # side so the line runs to the edges
+        extra = (x_max - x_min) * self.overdraw
+        start = max(0, np.searchsorted(x, x_min - extra, 'left') - 1)
+        end = np.searchsorted(x, x_max + extra, 'right') + 1
+        x, y = charts.lttb(
+            x[start:end], y[start:end],
+            self.points_per_pixel * self.chart_width *
+            (1 + 2 * self.overdraw))
+        if len(x) < 2:
+            return
+
+        # calculate coordinates as x1, y1, x2, y2...
+        coords = np.empty(2 * len(x))
+        coords[0::2] = np.rint((x - x_min) * x_scale)
+        coords[1::2] = self.chart_height - np.rint((y - y_min) * y_scale)
 
         # create the line
-        self.chart.create_line(*coords, width=2, fill=color)
+        self.chart.create_line(
+            *coords.tolist(), width=2, fill=color, tags=('line', tag))
 
     def draw_legend(self, mapping):
-        y = self.margin
-        x = round(self.margin * 1.5) + self.chart_width
-        for label, color in mapping.items():
-            self.create_text((x, y), text=label, fill=color, anchor='w')
-            y += 20
+        self.legend = dict(mapping)
+        self.draw_axes()
 
 
 class YieldChartView(tk.Frame):
 
     def __init__(self, parent, x_axis, y_axis, title):
         super().__init__(parent)
+        Figure, FigureCanvasTkAgg, NavigationToolbar = load_chart_backend()
         self.figure = Figure(figsize=(6, 4), dpi=100)
         self.canvas = FigureCanvasTkAgg(self.figure, master=self)
-        self.toolbar = NavigationToolbar2TkAgg(self.canvas, self)
+        self.toolbar = NavigationToolbar(self.canvas, self)
 
         self.canvas.get_tk_widget().pack(fill='both', expand=True)
 
@@ -502,13 +940,12 @@ class YieldChartView(tk.Frame):
         self.scatters = []
         self.scatter_labels = []
 
-    def draw_scatter(self, data, color, label):
+    def draw_scatter(self, x, y, s, color, label):
         """Draw data values on the scatter plot
 
-        Should be a list of items in the format (x, y, s)"""
-        x, y, s = zip(*data)
+        x, y and s are arrays of positions and sizes"""
         # make differences in s more visible
-        s = [(x ** 2)//2 for x in s]
+        s = s ** 2 // 2
         scatter = self.axes.scatter(x, y, s, c=color, label=label, alpha=.5)
         self.scatters.append(scatter)
         self.scatter_labels.append(label)
@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import ttk
+from bisect import bisect_left
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 from .constants import FieldTypes as FT
@@ -134,6 +135,68 @@ class RequiredEntry(ValidatedMixin, ttk.Entry):
 
 
 class ValidatedCombobox(ValidatedMixin, ttk.Combobox):
+    """A combobox that autocompletes from its values
+
+    Values are kept in a sorted, case-folded index that is only
+    rebuilt when the values option changes, so each keystroke is a
+    bisect rather than a scan of every value.  With show_matches,
+    the dropdown list is narrowed to the values matching the text
+    typed so far.
+    """
+
+    def __init__(self, *args, show_matches=False, **kwargs):
+        self.show_matches = show_matches
+        self._values = ()
+        self._keys = []
+        self._sorted_values = []
+        super().__init__(*args, **kwargs)
+        self._build_index(self.cget('values'))
+        if show_matches:
+            self.bind('<FocusOut>', self._show_all_values, add='+')
+
+    def _build_index(self, values):
+        if isinstance(values, str):
+            values = self.tk.splitlist(values)
+        self._values = tuple(values)
+        index = sorted((str(value).casefold(), value) for value in values)
+        self._keys = [key for key, value in index]
+        self._sorted_values = [value for key, value in index]
+
+    def configure(self, cnf=None, **kwargs):
+        result = super().configure(cnf, **kwargs)
+        values = kwargs.get('values')
+        if isinstance(cnf, dict):
+            values = cnf.get('values', values)
+        if values is not None:
+            self._build_index(values)
+        return result
+
+    config = configure
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key == 'values':
+            self._build_index(value)
+
+    def get_matches(self, prefix, limit=None):
+        """Return values starting with prefix, ignoring case"""
+        prefix = prefix.casefold()
+        matches = []
+        i = bisect_left(self._keys, prefix)
+        while (
+            i < len(self._keys) and self._keys[i].startswith(prefix)
+            and (limit is None or len(matches) < limit)
+        ):
+            matches.append(self._sorted_values[i])
+            i += 1
+        return matches
+
+    def _show_values(self, values):
+        # bypass configure() so the index keeps every value
+        ttk.Combobox.configure(self, values=values)
+
+    def _show_all_values(self, *args):
+        self._show_values(self._values)
 
     def _key_validate(self, proposed, action, **kwargs):
         valid = True
@@ -141,21 +204,21 @@ class ValidatedCombobox(ValidatedMixin, ttk.Combobox):
         # just clear the field
         if action == '0':
             self.set('')
+            if self.show_matches:
+                self._show_all_values()
             return True
 
-        # get our values list
-        values = self.cget('values')
         # Do a case-insensitve match against the entered text
-        matching = [
-            x for x in values
-            if x.lower().startswith(proposed.lower())
-        ]
+        matching = self.get_matches(
+            proposed, limit=None if self.show_matches else 2)
         if len(matching) == 0:
             valid = False
         elif len(matching) == 1:
             self.set(matching[0])
             self.icursor(tk.END)
             valid = False
+        if self.show_matches and matching:
+            self._show_values(matching)
         return valid
 
     def _focusout_validate(self, **kwargs):
@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from queue import Queue, Empty
+from threading import Lock, Timer
+from tkinter import TclError
+
+
+class Dispatcher:
+    """Run calls posted from any thread on the Tk thread
+
+    post() queues a call and, unless a wakeup is already pending,
+    generates a virtual event on the widget to wake the Tk loop.
+    The event handler runs every queued call, so a burst of posts
+    from any number of threads costs a single wakeup, and nothing
+    runs while the queue is idle.
+
+    Generating the event from a worker thread only works while Tk is
+    in its mainloop.  If it fails, for instance because a call
+    finished before mainloop() started, the wakeup is tried again
+    every retry_interval seconds from a timer thread until it gets
+    through or close() is called.
+    """
+
+    event = '<<DispatcherWake>>'
+    retry_interval = .05
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.calls = Queue()
+        self._lock = Lock()
+        self._wake_pending = False
+        self._retry = None
+        self._closed = False
+        widget.bind(self.event, self.dispatch, add='+')
+
+    def post(self, function, *args):
+        """Call function(*args) on the Tk thread; safe from any thread"""
+        self.calls.put((function, args))
+        self._wake()
+
+    def _wake(self):
+        with self._lock:
+            if self._wake_pending or self._closed:
+                return
+            self._wake_pending = True
+        try:
+            self.widget.event_generate(self.event, when='tail')
+        except RuntimeError:
+            # Tk isn't in its mainloop
+            with self._lock:
+                self._wake_pending = False
+            self._retry_wake()
+        except TclError:
+            # the widget has been destroyed
+            with self._lock:
+                self._wake_pending = False
+
+    def _retry_wake(self):
+        with self._lock:
+            if self._retry is not None or self._closed:
+                return
+            self._retry = Timer(self.retry_interval, self._retried)
+            self._retry.daemon = True
+            self._retry.start()
+
+    def _retried(self):
+        with self._lock:
+            self._retry = None
+        if not self.calls.empty():
+            self._wake()
+
+    def close(self):
+        """Stop waking the widget; call before it is destroyed"""
+        with self._lock:
+            self._closed = True
+            if self._retry is not None:
+                self._retry.cancel()
+                self._retry = None
+
+    def dispatch(self, *args):
+        """Run every queued call"""
+        with self._lock:
+            self._wake_pending = False
+        try:
+            while True:
+                try:
+                    function, args = self.calls.get_nowait()
+                except Empty:
+                    break
+                function(*args)
+        finally:
+            # if a call raised, make sure the rest still get run
+            if not self.calls.empty():
+                self._wake()
+
+    def sender(self, handler):
+        """Return a queue-like object whose put() runs handler(item)"""
+        return Sender(self, handler)
+
+
+class Sender:
+    """Stands in for a Queue, passing each item put to a handler"""
+
+    def __init__(self, dispatcher, handler):
+        self.dispatcher = dispatcher
+        self.handler = handler
+
+    def put(self, item, *args, **kwargs):
+        self.dispatcher.post(self.handler, item)
+
+
+class AsyncModel:
+    """Run data model calls on worker threads
+
+    Calls are submitted from the Tk thread and run on a thread pool.
+    Finished calls are posted back through a Dispatcher, so callbacks
+    run on the Tk thread and can safely touch widgets.  A call made
+    with a channel supersedes any earlier call on the same channel:
+    the earlier call is cancelled if it hasn't started, and its
+    result is dropped if it has.
+    """
+
+    def __init__(self, dispatcher, model, max_workers=4, on_busy=None):
+        self.dispatcher = dispatcher
+        self.model = model
+        self.on_busy = on_busy
+        self.executor = ThreadPoolExecutor(max_workers)
+        self._ids = count()
+        # channel -> (request id, future) of the latest call
+        self._latest = {}
+        self._pending = 0
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def call(self, method, *args, callback=None, errback=None,
+             channel=None, **kwargs):
+        """Call model.method(*args, **kwargs) on a worker thread"""
+        return self.run(
+            getattr(self.model, method), *args, callback=callback,
+            errback=errback, channel=channel, **kwargs)
+
+    def run(self, function, *args, callback=None, errback=None,
+            channel=None, **kwargs):
+        """Run function(*args, **kwargs) on a worker thread
+
+        callback(result) or errback(exception) is called on the Tk
+        thread when it finishes.  Returns the request id.
+        """
+        request_id = next(self._ids)
+        if channel is not None:
+            self.cancel(channel)
+        future = self.executor.submit(function, *args, **kwargs)
+        if channel is not None:
+            self._latest[channel] = (request_id, future)
+        self._set_pending(self._pending + 1)
+        future.add_done_callback(
+            lambda future: self.dispatcher.post(
+                self._deliver, request_id, channel, future,
+                callback, errback))
+        return request_id
+
+    def cancel(self, channel):
+        """Cancel the latest call on channel, if any"""
+        request = self._latest.pop(channel, None)
+        if request is not None:
+            request[1].cancel()
+
+    def _set_pending(self, pending):
+        was_busy = self.busy
+        self._pending = pending
+        if self.busy != was_busy and self.on_busy:
+            self.on_busy(self.busy)
+
+    def _deliver(self, request_id, channel, future, callback, errback):
+        self._set_pending(self._pending - 1)
+        if channel is not None:
+            latest = self._latest.get(channel)
+            if latest is None or latest[0] != request_id:
+                # superseded or cancelled
+                return
+            del self._latest[channel]
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            if errback:
+                errback(error)
+            else:
+                raise error
+        elif callback:
+            callback(future.result())
+
+    def shutdown(self):
+        """Stop accepting calls and drop any that haven't started"""
+        for channel in list(self._latest):
+            self.cancel(channel)
+        self.executor.shutdown(wait=False)
@@ -17,7 +17,8 @@ setup(
     package_data={'abq_data_entry.images': ['*.png']},
     entry_points={
         'console_scripts': [
-            'abq = abq_data_entry:main'
+            'abq = abq_data_entry:main',
+            'abq-import = abq_data_entry.importer:main'
         ]
     }
 )
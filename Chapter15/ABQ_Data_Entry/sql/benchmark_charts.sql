@@ -0,0 +1,82 @@
+-- Chart query benchmark
+-- Run against a database built with create_db.sql and populate_db.sql:
+--   psql -d abq -f sql/benchmark_charts.sql
+-- Everything runs in a transaction that is rolled back at the end.
+
+\timing on
+BEGIN;
+
+-- about 2.5 million plot checks: every lab, plot and check time
+-- for 6250 days, dated well before any real data
+ALTER TABLE plot_checks DISABLE TRIGGER plot_checks_rollups;
+
+INSERT INTO lab_checks
+    SELECT day, check_time, labs.id, (SELECT min(id) FROM lab_techs)
+    FROM generate_series(
+            DATE '1980-01-01', DATE '1980-01-01' + 6249, '1 day'
+        ) AS day,
+        unnest(ARRAY['8:00', '12:00', '16:00', '20:00']::TIME[])
+            AS check_time,
+        labs;
+
+INSERT INTO plot_checks
+    SELECT lc.date, lc.time, lc.lab_id, plots.plot,
+        plots.current_seed_sample,
+        round((random() * 50 + 1)::NUMERIC, 2),
+        round((random() * 100)::NUMERIC, 2),
+        round((random() * 35 + 4)::NUMERIC, 2),
+        random() < 0.01,
+        (random() * 1000)::INTEGER,
+        (random() * 20)::INTEGER,
+        (random() * 1000)::INTEGER,
+        h.max_height, h.min_height,
+        round(((h.max_height + h.min_height) / 2)::NUMERIC, 2),
+        NULL
+    FROM lab_checks lc
+        JOIN plots ON plots.lab_id = lc.lab_id
+        CROSS JOIN LATERAL (SELECT round((random() * 500 + 500)::NUMERIC, 2)
+                    AS max_height,
+                round((random() * 500)::NUMERIC, 2) AS min_height
+                -- refer to the outer row so each row gets new heights
+                WHERE lc.date IS NOT NULL AND plots.plot IS NOT NULL) AS h
+    WHERE lc.date < DATE '1980-01-01' + 6250;
+
+ALTER TABLE plot_checks ENABLE TRIGGER plot_checks_rollups;
+ANALYZE plot_checks;
+
+\echo 'Rebuilding the rollups'
+SELECT refresh_chart_rollups();
+
+\echo 'Growth chart, scanning plot_checks'
+SELECT count(*) FROM (
+    SELECT date - (SELECT min(date) FROM plot_checks) AS day,
+        lab_id, avg(median_height) AS avg_height
+    FROM plot_checks GROUP BY date, lab_id) AS growth;
+
+\echo 'Growth chart, from the rollup'
+SELECT count(*) FROM (
+    SELECT date - (SELECT min(date) FROM growth_by_lab_day) AS day,
+        lab_id, total_median_height / check_count AS avg_height
+    FROM growth_by_lab_day) AS growth;
+
+\echo 'Yield chart, scanning plot_checks'
+SELECT count(*) FROM (
+    SELECT lab_id, plot, seed_sample, max(fruit) AS yield,
+        avg(humidity) AS avg_humidity, avg(temperature) AS avg_temperature
+    FROM plot_checks WHERE NOT equipment_fault
+    GROUP BY lab_id, plot, seed_sample) AS yields;
+
+\echo 'Yield chart, from the rollup'
+SELECT count(*) FROM (
+    SELECT lab_id, plot, seed_sample, max_fruit AS yield,
+        total_humidity / NULLIF(humidity_count, 0) AS avg_humidity,
+        total_temperature / NULLIF(temperature_count, 0)
+            AS avg_temperature
+    FROM yield_by_plot) AS yields;
+
+\echo 'Updating one check, maintaining the rollups'
+UPDATE plot_checks SET fruit = 0
+WHERE date = DATE '1980-01-01' AND time = '8:00'
+    AND lab_id = 'A' AND plot = 1;
+
+ROLLBACK;
@@ -0,0 +1,76 @@
+-- Check that record list pages are read from the plot_checks
+-- primary key, without an OFFSET scan or a sort of every row
+-- Run against a database built with create_db.sql and populate_db.sql:
+--   psql -d abq -f sql/check_record_pages.sql
+-- The test rows are added in a transaction that is rolled back, and
+-- an exception is raised if either plan sorts or scans plot_checks.
+
+BEGIN;
+
+-- about 400,000 plot checks, dated well before any real data
+ALTER TABLE plot_checks DISABLE TRIGGER plot_checks_rollups;
+
+INSERT INTO lab_checks
+    SELECT day, check_time, labs.id, (SELECT min(id) FROM lab_techs)
+    FROM generate_series(
+            DATE '1980-01-01', DATE '1980-01-01' + 999, '1 day'
+        ) AS day,
+        unnest(ARRAY['8:00', '12:00', '16:00', '20:00']::TIME[])
+            AS check_time,
+        labs;
+
+INSERT INTO plot_checks
+    SELECT lc.date, lc.time, lc.lab_id, plots.plot,
+        plots.current_seed_sample, 20, 50, 20, FALSE, 0, 10, 0, 10, 1, 5,
+        NULL
+    FROM lab_checks lc
+        JOIN plots ON plots.lab_id = lc.lab_id
+    WHERE lc.date < DATE '1980-01-01' + 1000;
+
+ALTER TABLE plot_checks ENABLE TRIGGER plot_checks_rollups;
+ANALYZE lab_checks;
+ANALYZE plot_checks;
+
+CREATE FUNCTION pg_temp.check_plan(query TEXT) RETURNS VOID AS $$
+DECLARE
+    line TEXT;
+    plan TEXT := '';
+BEGIN
+    FOR line IN EXECUTE 'EXPLAIN ' || query LOOP
+        plan := plan || line || E'\n';
+    END LOOP;
+    RAISE NOTICE E'%\n%', query, plan;
+    IF plan !~ 'Index (Only )?Scan using plot_checks_pkey'
+            OR plan ~ 'Sort'
+            OR plan ~ 'Seq Scan on plot_checks' THEN
+        RAISE EXCEPTION 'plot_checks is not read by its primary key';
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- SQLModel.records_query, first page and a keyset page
+SELECT pg_temp.check_plan($q$
+    SELECT pc.date AS "Date", to_char(pc.time, 'FMHH24:MI') AS "Time",
+        lt.name AS "Technician", pc.lab_id AS "Lab", pc.plot AS "Plot"
+    FROM plot_checks AS pc JOIN lab_checks AS lc
+        ON pc.lab_id = lc.lab_id AND pc.date = lc.date
+        AND pc.time = lc.time
+        JOIN lab_techs AS lt ON lc.lab_tech_id = lt.id
+    WHERE (NOT FALSE OR pc.date = CURRENT_DATE)
+    ORDER BY pc.date, pc.time, pc.lab_id, pc.plot LIMIT 100
+$q$);
+
+SELECT pg_temp.check_plan($q$
+    SELECT pc.date AS "Date", to_char(pc.time, 'FMHH24:MI') AS "Time",
+        lt.name AS "Technician", pc.lab_id AS "Lab", pc.plot AS "Plot"
+    FROM plot_checks AS pc JOIN lab_checks AS lc
+        ON pc.lab_id = lc.lab_id AND pc.date = lc.date
+        AND pc.time = lc.time
+        JOIN lab_techs AS lt ON lc.lab_tech_id = lt.id
+    WHERE (NOT FALSE OR pc.date = CURRENT_DATE)
+        AND (pc.date, pc.time, pc.lab_id, pc.plot) >
+            ('1982-06-01', '12:00'::time, 'C', 7)
+    ORDER BY pc.date, pc.time, pc.lab_id, pc.plot LIMIT 100
+$q$);
+
+ROLLBACK;
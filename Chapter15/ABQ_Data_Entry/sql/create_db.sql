@@ -25,6 +25,7 @@ CREATE TABLE lab_checks(
         time TIME NOT NULL,
         lab_id CHAR(1) NOT NULL REFERENCES labs(id),
         lab_tech_id SMALLINT NOT NULL REFERENCES lab_techs(id),
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
         PRIMARY KEY(date, time, lab_id)
         );
 
@@ -47,6 +48,7 @@ CREATE TABLE plot_checks(
             NOT NULL CHECK
             (median_height BETWEEN min_height AND max_height),
         notes TEXT,
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
         PRIMARY KEY(date, time, lab_id, plot),
         FOREIGN KEY(lab_id, date, time)
             REFERENCES lab_checks(lab_id, date, time),
@@ -79,6 +81,16 @@ CREATE VIEW data_record_view AS (
             ON lc.lab_tech_id = lt.id
         );
 
+-- Delta extracts find changed checks by their updated_at
+CREATE INDEX lab_checks_updated_at_idx ON lab_checks (updated_at);
+CREATE INDEX plot_checks_updated_at_idx ON plot_checks (updated_at);
+
+-- The updated_at time each upload destination has received
+-- changes up to
+CREATE TABLE upload_watermarks (
+        destination VARCHAR(512) PRIMARY KEY,
+        uploaded_until TIMESTAMP WITH TIME ZONE NOT NULL
+        );
 
 CREATE TABLE local_weather (
         datetime TIMESTAMP(0) WITH TIME ZONE PRIMARY KEY,
@@ -87,3 +99,126 @@ CREATE TABLE local_weather (
         pressure NUMERIC(7,2),
         conditions VARCHAR(32)
         );
+
+-- Chart rollups
+-- Kept up to date by triggers on plot_checks so the charts
+-- don't have to scan every check ever recorded.
+CREATE TABLE growth_by_lab_day (
+        date DATE NOT NULL,
+        lab_id CHAR(1) NOT NULL REFERENCES labs(id),
+        total_median_height NUMERIC NOT NULL,
+        check_count INTEGER NOT NULL,
+        PRIMARY KEY(date, lab_id)
+        );
+
+-- Only checks without an equipment fault are counted
+CREATE TABLE yield_by_plot (
+        lab_id CHAR(1) NOT NULL,
+        plot SMALLINT NOT NULL,
+        seed_sample CHAR(6) NOT NULL,
+        max_fruit SMALLINT NOT NULL,
+        total_humidity NUMERIC NOT NULL,
+        humidity_count INTEGER NOT NULL,
+        total_temperature NUMERIC NOT NULL,
+        temperature_count INTEGER NOT NULL,
+        check_count INTEGER NOT NULL,
+        PRIMARY KEY(lab_id, plot, seed_sample),
+        FOREIGN KEY(lab_id, plot) REFERENCES plots(lab_id, plot)
+        );
+
+-- Lets the triggers find a plot's new maximum yield without
+-- reading the table
+CREATE INDEX plot_checks_yield_idx
+    ON plot_checks (lab_id, plot, seed_sample, fruit)
+    WHERE NOT equipment_fault;
+
+CREATE FUNCTION update_chart_rollups() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE growth_by_lab_day SET
+            total_median_height = total_median_height - OLD.median_height,
+            check_count = check_count - 1
+        WHERE date = OLD.date AND lab_id = OLD.lab_id;
+        DELETE FROM growth_by_lab_day
+        WHERE date = OLD.date AND lab_id = OLD.lab_id AND check_count = 0;
+
+        IF NOT OLD.equipment_fault THEN
+            UPDATE yield_by_plot SET
+                total_humidity = total_humidity - coalesce(OLD.humidity, 0),
+                humidity_count = humidity_count
+                    - (OLD.humidity IS NOT NULL)::INTEGER,
+                total_temperature = total_temperature
+                    - coalesce(OLD.temperature, 0),
+                temperature_count = temperature_count
+                    - (OLD.temperature IS NOT NULL)::INTEGER,
+                check_count = check_count - 1
+            WHERE lab_id = OLD.lab_id AND plot = OLD.plot
+                AND seed_sample = OLD.seed_sample;
+            DELETE FROM yield_by_plot
+            WHERE lab_id = OLD.lab_id AND plot = OLD.plot
+                AND seed_sample = OLD.seed_sample AND check_count = 0;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO growth_by_lab_day AS g VALUES
+            (NEW.date, NEW.lab_id, NEW.median_height, 1)
+        ON CONFLICT (date, lab_id) DO UPDATE SET
+            total_median_height =
+                g.total_median_height + EXCLUDED.total_median_height,
+            check_count = g.check_count + 1;
+
+        IF NOT NEW.equipment_fault THEN
+            INSERT INTO yield_by_plot AS y VALUES (
+                NEW.lab_id, NEW.plot, NEW.seed_sample, NEW.fruit,
+                coalesce(NEW.humidity, 0),
+                (NEW.humidity IS NOT NULL)::INTEGER,
+                coalesce(NEW.temperature, 0),
+                (NEW.temperature IS NOT NULL)::INTEGER,
+                1)
+            ON CONFLICT (lab_id, plot, seed_sample) DO UPDATE SET
+                max_fruit = greatest(y.max_fruit, EXCLUDED.max_fruit),
+                total_humidity = y.total_humidity + EXCLUDED.total_humidity,
+                humidity_count = y.humidity_count + EXCLUDED.humidity_count,
+                total_temperature =
+                    y.total_temperature + EXCLUDED.total_temperature,
+                temperature_count =
+                    y.temperature_count + EXCLUDED.temperature_count,
+                check_count = y.check_count + 1;
+        END IF;
+    END IF;
+
+    -- A maximum can't be reduced incrementally; if the old row
+    -- may have held it, look it up again
+    IF TG_OP IN ('UPDATE', 'DELETE') AND NOT OLD.equipment_fault THEN
+        UPDATE yield_by_plot y SET max_fruit = (
+            SELECT max(fruit) FROM plot_checks pc
+            WHERE pc.lab_id = y.lab_id AND pc.plot = y.plot
+                AND pc.seed_sample = y.seed_sample
+                AND NOT pc.equipment_fault)
+        WHERE lab_id = OLD.lab_id AND plot = OLD.plot
+            AND seed_sample = OLD.seed_sample AND max_fruit <= OLD.fruit;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER plot_checks_rollups
+    AFTER INSERT OR UPDATE OR DELETE ON plot_checks
+    FOR EACH ROW EXECUTE PROCEDURE update_chart_rollups();
+
+-- Rebuild the rollups from scratch, e.g. after loading data
+-- with the trigger disabled
+CREATE FUNCTION refresh_chart_rollups() RETURNS void AS $$
+    DELETE FROM growth_by_lab_day;
+    DELETE FROM yield_by_plot;
+    INSERT INTO growth_by_lab_day
+        SELECT date, lab_id, sum(median_height), count(*)
+        FROM plot_checks GROUP BY date, lab_id;
+    INSERT INTO yield_by_plot
+        SELECT lab_id, plot, seed_sample, max(fruit),
+            coalesce(sum(humidity), 0), count(humidity),
+            coalesce(sum(temperature), 0), count(temperature), count(*)
+        FROM plot_checks WHERE NOT equipment_fault
+        GROUP BY lab_id, plot, seed_sample;
+$$ LANGUAGE SQL;
@@ -0,0 +1,154 @@
+-- Bring a database built with an older create_db.sql up to date
+--   psql -d abq -f sql/migrate_db.sql
+-- Every step checks for what it adds, so this can be run again,
+-- and on a database that is already current, safely.
+
+BEGIN;
+
+-- Delta extracts find changed checks by their updated_at; rows
+-- that predate the column are stamped with the migration time,
+-- so the first upload after it sends them
+ALTER TABLE lab_checks ADD COLUMN IF NOT EXISTS
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+ALTER TABLE plot_checks ADD COLUMN IF NOT EXISTS
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS lab_checks_updated_at_idx
+    ON lab_checks (updated_at);
+CREATE INDEX IF NOT EXISTS plot_checks_updated_at_idx
+    ON plot_checks (updated_at);
+
+CREATE TABLE IF NOT EXISTS upload_watermarks (
+        destination VARCHAR(512) PRIMARY KEY,
+        uploaded_until TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+
+-- Chart rollups
+-- Kept up to date by triggers on plot_checks so the charts
+-- don't have to scan every check ever recorded.
+CREATE TABLE IF NOT EXISTS growth_by_lab_day (
+        date DATE NOT NULL,
+        lab_id CHAR(1) NOT NULL REFERENCES labs(id),
+        total_median_height NUMERIC NOT NULL,
+        check_count INTEGER NOT NULL,
+        PRIMARY KEY(date, lab_id)
+        );
+
+-- Only checks without an equipment fault are counted
+CREATE TABLE IF NOT EXISTS yield_by_plot (
+        lab_id CHAR(1) NOT NULL,
+        plot SMALLINT NOT NULL,
+        seed_sample CHAR(6) NOT NULL,
+        max_fruit SMALLINT NOT NULL,
+        total_humidity NUMERIC NOT NULL,
+        humidity_count INTEGER NOT NULL,
+        total_temperature NUMERIC NOT NULL,
+        temperature_count INTEGER NOT NULL,
+        check_count INTEGER NOT NULL,
+        PRIMARY KEY(lab_id, plot, seed_sample),
+        FOREIGN KEY(lab_id, plot) REFERENCES plots(lab_id, plot)
+        );
+
+-- Lets the triggers find a plot's new maximum yield without
+-- reading the table
+CREATE INDEX IF NOT EXISTS plot_checks_yield_idx
+    ON plot_checks (lab_id, plot, seed_sample, fruit)
+    WHERE NOT equipment_fault;
+
+CREATE OR REPLACE FUNCTION update_chart_rollups() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE growth_by_lab_day SET
+            total_median_height = total_median_height - OLD.median_height,
+            check_count = check_count - 1
+        WHERE date = OLD.date AND lab_id = OLD.lab_id;
+        DELETE FROM growth_by_lab_day
+        WHERE date = OLD.date AND lab_id = OLD.lab_id AND check_count = 0;
+
+        IF NOT OLD.equipment_fault THEN
+            UPDATE yield_by_plot SET
+                total_humidity = total_humidity - coalesce(OLD.humidity, 0),
+                humidity_count = humidity_count
+                    - (OLD.humidity IS NOT NULL)::INTEGER,
+                total_temperature = total_temperature
+                    - coalesce(OLD.temperature, 0),
+                temperature_count = temperature_count
+                    - (OLD.temperature IS NOT NULL)::INTEGER,
+                check_count = check_count - 1
+            WHERE lab_id = OLD.lab_id AND plot = OLD.plot
+                AND seed_sample = OLD.seed_sample;
+            DELETE FROM yield_by_plot
+            WHERE lab_id = OLD.lab_id AND plot = OLD.plot
+                AND seed_sample = OLD.seed_sample AND check_count = 0;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO growth_by_lab_day AS g VALUES
+            (NEW.date, NEW.lab_id, NEW.median_height, 1)
+        ON CONFLICT (date, lab_id) DO UPDATE SET
+            total_median_height =
+                g.total_median_height + EXCLUDED.total_median_height,
+            check_count = g.check_count + 1;
+
+        IF NOT NEW.equipment_fault THEN
+            INSERT INTO yield_by_plot AS y VALUES (
+                NEW.lab_id, NEW.plot, NEW.seed_sample, NEW.fruit,
+                coalesce(NEW.humidity, 0),
+                (NEW.humidity IS NOT NULL)::INTEGER,
+                coalesce(NEW.temperature, 0),
+                (NEW.temperature IS NOT NULL)::INTEGER,
+                1)
+            ON CONFLICT (lab_id, plot, seed_sample) DO UPDATE SET
+                max_fruit = greatest(y.max_fruit, EXCLUDED.max_fruit),
+                total_humidity = y.total_humidity + EXCLUDED.total_humidity,
+                humidity_count = y.humidity_count + EXCLUDED.humidity_count,
+                total_temperature =
+                    y.total_temperature + EXCLUDED.total_temperature,
+                temperature_count =
+                    y.temperature_count + EXCLUDED.temperature_count,
+                check_count = y.check_count + 1;
+        END IF;
+    END IF;
+
+    -- A maximum can't be reduced incrementally; if the old row
+    -- may have held it, look it up again
+    IF TG_OP IN ('UPDATE', 'DELETE') AND NOT OLD.equipment_fault THEN
+        UPDATE yield_by_plot y SET max_fruit = (
+            SELECT max(fruit) FROM plot_checks pc
+            WHERE pc.lab_id = y.lab_id AND pc.plot = y.plot
+                AND pc.seed_sample = y.seed_sample
+                AND NOT pc.equipment_fault)
+        WHERE lab_id = OLD.lab_id AND plot = OLD.plot
+            AND seed_sample = OLD.seed_sample AND max_fruit <= OLD.fruit;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS plot_checks_rollups ON plot_checks;
+CREATE TRIGGER plot_checks_rollups
+    AFTER INSERT OR UPDATE OR DELETE ON plot_checks
+    FOR EACH ROW EXECUTE PROCEDURE update_chart_rollups();
+
+-- Rebuild the rollups from scratch, e.g. after loading data
+-- with the trigger disabled
+CREATE OR REPLACE FUNCTION refresh_chart_rollups() RETURNS void AS $$
+    DELETE FROM growth_by_lab_day;
+    DELETE FROM yield_by_plot;
+    INSERT INTO growth_by_lab_day
+        SELECT date, lab_id, sum(median_height), count(*)
+        FROM plot_checks GROUP BY date, lab_id;
+    INSERT INTO yield_by_plot
+        SELECT lab_id, plot, seed_sample, max(fruit),
+            coalesce(sum(humidity), 0), count(humidity),
+            coalesce(sum(temperature), 0), count(temperature), count(*)
+        FROM plot_checks WHERE NOT equipment_fault
+        GROUP BY lab_id, plot, seed_sample;
+$$ LANGUAGE SQL;
+
+-- Fill the rollups from the checks already recorded; this rebuilds
+-- them from scratch, so is safe to repeat
+SELECT refresh_chart_rollups();
+
+COMMIT;